@@ -0,0 +1,242 @@
+"""
+content-addressed on-disk cache of spaCy annotations
+
+The spaCy annotation of an article only depends on its content and on the
+spaCy model, so it is cached under the sha1 of both (the model is identified
+by the spaCy version, the model name and the version of the model data). The
+cache stores what the converter needs (the entity mentions, see
+utils.entity_mentions_from_doc) as zlib-compressed json in an SQLite database.
+When the database grows beyond max_bytes, the least recently used entries are
+evicted.
+
+The last use of the entries that are hit is kept in memory and written in one
+transaction by flush (called per batch by utils.annotate_articles, and by
+close), so a hit does not cost a write transaction.
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import importlib.metadata
+
+import semeval_classes
+
+CACHE_FORMAT_VERSION = '1'
+DEFAULT_MAX_BYTES = 10 * 2 ** 30
+EVICT_TO = 0.9  # evict until the cache is at 90% of max_bytes
+
+
+def model_version(model_name):
+    """
+    return the version of the installed data of a spaCy model, from its
+    meta.json (in the spaCy data folder) or its package metadata
+
+    :param str model_name: name of the spaCy model, e.g. en
+
+    :rtype: str | None
+    :return: version, None if it can not be found
+    """
+    try:
+        from spacy import util
+        data_path = util.get_data_path()
+    except (ImportError, AttributeError):
+        data_path = None
+    if data_path:
+        meta_path = os.path.join(str(data_path), model_name, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as infile:
+                return json.load(infile).get('version')
+    try:
+        return importlib.metadata.version(model_name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def model_identifier(model_name):
+    """
+    return identifier of a spaCy model (spaCy version, model name and
+    version of the model data)
+
+    the model itself is not loaded, so the cache can be consulted
+    without loading spaCy's model
+
+    :param str model_name: name of the spaCy model, e.g. en
+
+    :rtype: str
+    :return: identifier
+    """
+    try:
+        from spacy.about import __version__ as spacy_version
+    except ImportError:
+        from spacy import __version__ as spacy_version
+    return 'spacy-%s/%s-%s/%s' % (spacy_version, model_name,
+                                  model_version(model_name) or 'unknown',
+                                  CACHE_FORMAT_VERSION)
+
+
+def serialize_mentions(entity_mentions):
+    """
+    :param list entity_mentions: list of semeval_classes.EntityMention (provenance spacy)
+
+    :rtype: bytes
+    :return: compressed json of (sentence, mention, type, begin, end) tuples
+    """
+    rows = [(m.sentence, m.mention, m.the_type, m.begin_index, m.end_index)
+            for m in entity_mentions]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'))
+
+
+def deserialize_mentions(value, provenance='spacy'):
+    """
+    inverse of serialize_mentions
+
+    :rtype: list
+    :return: list of semeval_classes.EntityMention
+    """
+    return [semeval_classes.EntityMention(sentence=sentence,
+                                          mention=mention,
+                                          meaning='',
+                                          the_type=the_type,
+                                          begin_index=begin_index,
+                                          end_index=end_index,
+                                          provenance=provenance)
+            for sentence, mention, the_type, begin_index, end_index
+            in json.loads(zlib.decompress(value).decode('utf-8'))]
+
+
+class AnnotationCache:
+    """
+    cache of the spaCy entity mentions of article contents
+    """
+    def __init__(self, path, model_id, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        self._total_size = 0
+        self._last_used = {}  # key -> time of the hits that are not written yet
+
+    @property
+    def connection(self):
+        # sqlite connections can not be shared with forked processes,
+        # so every process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self._last_used = {}
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS annotations
+                                        (key TEXT PRIMARY KEY,
+                                         value BLOB,
+                                         size INTEGER,
+                                         last_used REAL)''')
+            self._connection.execute('''CREATE INDEX IF NOT EXISTS annotations_last_used
+                                        ON annotations (last_used)''')
+            self._connection.commit()
+            self._pid = os.getpid()
+            self._total_size = self.size()
+        return self._connection
+
+    def key(self, content):
+        sha1 = hashlib.sha1(self.model_id.encode('utf-8'))
+        sha1.update(b'\x00')
+        sha1.update(content.encode('utf-8'))
+        return sha1.hexdigest()
+
+    def get(self, content):
+        """
+        :param str content: article content
+
+        :rtype: list | None
+        :return: list of semeval_classes.EntityMention, None if not cached
+        """
+        key = self.key(content)
+        row = self.connection.execute('SELECT value FROM annotations WHERE key = ?',
+                                      (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._last_used[key] = time.time()
+        return deserialize_mentions(row[0])
+
+    def flush(self):
+        """
+        write the last use of the hits since the previous flush
+        """
+        if not self._last_used:
+            return
+        with self.connection:
+            self.connection.executemany('UPDATE annotations SET last_used = ? WHERE key = ?',
+                                        [(last_used, key) for key, last_used in self._last_used.items()])
+        self._last_used = {}
+
+    def put(self, content, entity_mentions):
+        """
+        :param str content: article content
+        :param list entity_mentions: list of semeval_classes.EntityMention
+        """
+        self.put_many([(content, entity_mentions)])
+
+    def put_many(self, annotations):
+        """
+        store the annotations of several articles in one transaction
+
+        :param list annotations: list of (article content, list of
+        semeval_classes.EntityMention)
+        """
+        if not annotations:
+            return
+        now = time.time()
+        rows = []
+        for content, entity_mentions in annotations:
+            value = serialize_mentions(entity_mentions)
+            rows.append((self.key(content), value, len(value), now))
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO annotations VALUES (?, ?, ?, ?)', rows)
+
+        # other processes may write to the same cache, so the running total is
+        # only an estimate; evict recomputes it
+        self._total_size += sum(row[2] for row in rows)
+        if self._total_size > self.max_bytes:
+            self.evict()
+
+    def size(self):
+        """
+        :rtype: int
+        :return: number of bytes of the cached values
+        """
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM annotations').fetchone()[0]
+
+    def evict(self):
+        """
+        remove least recently used entries if the cache is larger than max_bytes
+        """
+        self.flush()
+        total = self.size()
+        self._total_size = total
+        if total <= self.max_bytes:
+            return
+
+        target = self.max_bytes * EVICT_TO
+        with self.connection:
+            rows = self.connection.execute('SELECT key, size FROM annotations ORDER BY last_used')
+            to_delete = []
+            for key, size in rows:
+                if total <= target:
+                    break
+                to_delete.append((key,))
+                total -= size
+            self.connection.executemany('DELETE FROM annotations WHERE key = ?', to_delete)
+        self._total_size = total
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self.flush()
+            self._connection.close()
+        self._connection = None
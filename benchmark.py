@@ -0,0 +1,268 @@
+"""
+stage-level benchmark of the conversion on the NewsReader NAFs in naf/
+
+The NAFs are read into memory once, after which every stage is timed
+separately over all of them (best of repeat runs):
+
+* etree_parse: full lxml parse of the NAF (reference for naf_parse)
+* naf_parse: naf_reader.parse_naf, as used by the conversion
+* token_table: token_table.TokenTable
+* mentions: utils.create_entity_mention_obj and utils.create_event_mention_obj
+* load_article: utils.load_article_into_newsitem_class (token table,
+  mentions and topics)
+* rdfize: utils.rdfize_news_item into a list
+* serialize_nt: writing the triples as N-Triples (rdf_sinks.NTriplesSink)
+* serialize_turtle: rdflib Graph.serialize as Turtle, one graph per article
+
+The articles are made from the NAF headers (id and creation time, one
+publisher for all), as the conversion does with the NewsReader NAFs only.
+Their triples are compared with the golden triple set in naf_golden.nt.gz,
+so an optimisation can be shown to be both faster and output-identical.
+After a deliberate change of the output, the golden set is rewritten
+with --update-golden.
+"""
+import os
+import io
+import json
+import time
+import gzip
+import argparse
+
+from lxml import etree
+from rdflib import Graph
+
+import utils
+import naf_reader
+import rdf_sinks
+import token_table
+
+FIXTURE_FOLDER = 'naf'
+GOLDEN_PATH = 'naf_golden.nt.gz'
+FIXTURE_SOURCE = 'NewsReader fixtures'
+
+
+class _ListSink:
+    """
+    sink that keeps the triples in a list
+    """
+    def __init__(self):
+        self.triples = []
+        self.add = self.triples.append
+
+
+def load_fixtures(folder=FIXTURE_FOLDER):
+    """
+    read the NAFs of a folder into memory
+
+    :param str folder: folder with NewsReader NAFs
+
+    :rtype: list
+    :return: sorted list of (identifier, NAF bytestring)
+    """
+    nafs = naf_reader.NafFolder(folder)
+    fixtures = [(identifier, nafs.read(identifier))
+                for identifier in sorted(nafs.identifiers())]
+    nafs.close()
+    return fixtures
+
+
+def fixture_article(identifier, naf):
+    """
+    create the signalmedia article of a fixture from its NAF header
+
+    :param str identifier: article id
+    :param naf: NAF tree
+
+    :rtype: dict
+    :return: article with id, published and source
+    """
+    return {'id': identifier,
+            'published': naf.find('nafHeader/fileDesc').get('creationtime'),
+            'source': FIXTURE_SOURCE,
+            'content': ''}
+
+
+def fixture_triples(fixtures):
+    """
+    convert the fixtures into N-Triples lines
+
+    :param list fixtures: see load_fixtures
+
+    :rtype: set
+    :return: set of N-Triples lines (without newline)
+    """
+    lines = set()
+    for identifier, data in fixtures:
+        naf = naf_reader.parse_naf(data)
+        item = utils.news_item(signalmedia_json=fixture_article(identifier, naf),
+                               preprocessing={('newsreader', naf)})
+        sink = utils.json2rdf(item, _ListSink())
+        for subject, predicate, obj in sink.triples:
+            lines.add('%s %s %s .' % (rdf_sinks.nt_term(subject),
+                                      rdf_sinks.nt_term(predicate),
+                                      rdf_sinks.nt_term(obj)))
+    return lines
+
+
+def load_golden(path=GOLDEN_PATH):
+    """
+    :rtype: set
+    :return: set of N-Triples lines (without newline)
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as infile:
+        return {line.rstrip('\n') for line in infile if line.strip()}
+
+
+def write_golden(lines, path=GOLDEN_PATH):
+    """
+    write the golden triple set, sorted (mtime 0, so the file only changes
+    when the triples do)
+    """
+    data = ''.join('%s\n' % line for line in sorted(lines)).encode('utf-8')
+    with open(path, 'wb') as outfile:
+        with gzip.GzipFile(fileobj=outfile, mode='wb', mtime=0) as gzip_file:
+            gzip_file.write(data)
+
+
+def compare_to_golden(lines, golden):
+    """
+    :rtype: tuple
+    :return: (sorted lines not in golden, sorted golden lines not in lines)
+    """
+    return sorted(lines - golden), sorted(golden - lines)
+
+
+def best_time(function, repeat):
+    """
+    :param function: function without arguments
+    :param int repeat: number of runs
+
+    :rtype: float
+    :return: smallest number of seconds of a run
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def benchmark_stages(fixtures, repeat=3):
+    """
+    time the stages of the conversion separately over the fixtures
+
+    :param list fixtures: see load_fixtures
+    :param int repeat: number of runs per stage
+
+    :rtype: dict
+    :return: mapping stage -> seconds (best run) for all fixtures
+    """
+    nafs = [naf_reader.parse_naf(data) for identifier, data in fixtures]
+    tables = [token_table.TokenTable(naf) for naf in nafs]
+    items = [utils.news_item(signalmedia_json=fixture_article(identifier, naf),
+                             preprocessing={('newsreader', naf)})
+             for (identifier, data), naf in zip(fixtures, nafs)]
+    news_items = [utils.load_article_into_newsitem_class(item) for item in items]
+    sinks = [utils.rdfize_news_item(news_item, _ListSink()) for news_item in news_items]
+
+    def etree_parse():
+        for identifier, data in fixtures:
+            etree.parse(io.BytesIO(data))
+
+    def naf_parse():
+        for identifier, data in fixtures:
+            naf_reader.parse_naf(data)
+
+    def build_token_tables():
+        for naf in nafs:
+            token_table.TokenTable(naf)
+
+    def mentions():
+        for naf, tokens in zip(nafs, tables):
+            basename = naf.find('nafHeader/fileDesc').get('filename')
+            for entity_el in naf.iterfind('entities/entity'):
+                utils.create_entity_mention_obj(entity_el, 'newsreader', tokens)
+            for predicate_el in naf.iterfind('srl/predicate'):
+                utils.create_event_mention_obj(predicate_el, 'newsreader', tokens, basename)
+
+    def load_article():
+        for item in items:
+            utils.load_article_into_newsitem_class(item)
+
+    def rdfize():
+        for news_item in news_items:
+            utils.rdfize_news_item(news_item, _ListSink())
+
+    def serialize_nt():
+        sink = rdf_sinks.NTriplesSink(os.devnull)
+        for list_sink in sinks:
+            for triple in list_sink.triples:
+                sink.add(triple)
+        sink.close()
+
+    graphs = []
+    for list_sink in sinks:
+        g = Graph()
+        for triple in list_sink.triples:
+            g.add(triple)
+        graphs.append(g)
+
+    def serialize_turtle():
+        for g in graphs:
+            g.serialize(format='turtle')
+
+    stages = [('etree_parse', etree_parse),
+              ('naf_parse', naf_parse),
+              ('token_table', build_token_tables),
+              ('mentions', mentions),
+              ('load_article', load_article),
+              ('rdfize', rdfize),
+              ('serialize_nt', serialize_nt),
+              ('serialize_turtle', serialize_turtle)]
+    return {name: best_time(function, repeat) for name, function in stages}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Time the stages of the conversion on the NewsReader NAFs in naf/ and check the output against the golden triple set.''')
+    parser.add_argument('-n', dest="naf_folder", default=FIXTURE_FOLDER, help="folder with NewsReader NAFs")
+    parser.add_argument('-r', type=int, dest="repeat", default=3, help="number of runs per stage (the best one is reported)")
+    parser.add_argument('-g', dest="path_golden", default=GOLDEN_PATH, help="path to the golden triple set (sorted N-Triples, gzip)")
+    parser.add_argument('-o', dest="path_output", help="if provided, the timings are written to this path (json)")
+    parser.add_argument('--update-golden', dest="update_golden", action='store_true',
+                        help="write the golden triple set from the current output instead of checking it")
+    parser.add_argument('--skip-timing', dest="skip_timing", action='store_true', help="only check the output")
+
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.naf_folder)
+    lines = fixture_triples(fixtures)
+    if args.update_golden:
+        write_golden(lines, args.path_golden)
+        print('wrote %s triples to %s' % (len(lines), args.path_golden))
+        golden_ok = True
+    else:
+        extra, missing = compare_to_golden(lines, load_golden(args.path_golden))
+        golden_ok = not extra and not missing
+        print('golden: %s (%s triples, %s not in golden, %s missing)' % (
+              'ok' if golden_ok else 'DIFFERENT', len(lines), len(extra), len(missing)))
+        for label, examples in [('not in golden', extra), ('missing', missing)]:
+            for line in examples[:5]:
+                print('  %s: %s' % (label, line))
+
+    if not args.skip_timing:
+        timings = benchmark_stages(fixtures, repeat=args.repeat)
+        print('%-18s %10s %14s %12s' % ('stage', 'seconds', 'ms/article', 'articles/s'))
+        for name, seconds in timings.items():
+            print('%-18s %10.3f %14.2f %12.1f' % (name, seconds,
+                                                 1000 * seconds / len(fixtures),
+                                                 len(fixtures) / seconds if seconds else 0.0))
+        if args.path_output:
+            with open(args.path_output, 'w') as outfile:
+                json.dump({'num_articles': len(fixtures),
+                           'repeat': args.repeat,
+                           'golden_ok': golden_ok,
+                           'seconds': timings}, outfile, indent=1)
+
+    if not golden_ok:
+        raise SystemExit(1)
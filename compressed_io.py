@@ -0,0 +1,329 @@
+"""
+reading (and seeking in) compressed corpus files
+
+Files are opened by extension: .gz (gzip), .zst (zstandard, needs the
+optional zstandard package) or uncompressed. The offsets in the indexes of
+corpus_index.py depend on the kind of file:
+
+* plain: byte offset in the file
+* blocked: gzip file made up of several members (e.g. written by
+  compress_blocks, or bgzip). The offset of a line is a virtual offset:
+  (offset of its gzip member << 24) | offset of the line in the member,
+  so a line is reached with one seek and the decompression of at most one
+  member.
+* stream: any other gzip or zstd file. The offset of a line is the offset
+  in the decompressed data, so seeking means decompressing from the start
+  (or from the current position when reading forward).
+"""
+import io
+import gzip
+import zlib
+
+PLAIN = 'plain'
+BLOCKED = 'blocked'
+STREAM = 'stream'
+
+IN_MEMBER_BITS = 24
+MAX_IN_MEMBER = 2 ** IN_MEMBER_BITS
+DEFAULT_BLOCK_SIZE = 2 ** 20
+READ_SIZE = 2 ** 20
+
+
+def compression_of(path):
+    """
+    :param str path: path to file
+
+    :rtype: str
+    :return: gzip | zstd | None
+    """
+    if path.endswith('.gz') or path.endswith('.tgz'):
+        return 'gzip'
+    if path.endswith('.zst'):
+        return 'zstd'
+    return None
+
+
+def open_binary(path):
+    """
+    open a (compressed) file for reading decompressed bytes
+
+    :param str path: path to file (.gz, .zst or uncompressed)
+
+    :return: binary file object
+    """
+    return open_binary_fileobj(open(path, 'rb'), path)
+
+
+def open_binary_fileobj(fileobj, name):
+    """
+    wrap a binary file object in a decompressor according to the extension of name
+
+    :param fileobj: binary file object with the (compressed) data
+    :param str name: file name, used for the compression (.gz, .zst)
+
+    :return: binary file object, closing it closes fileobj
+    """
+    compression = compression_of(name)
+    if compression == 'gzip':
+        return _Closing(gzip.GzipFile(fileobj=fileobj, mode='rb'), fileobj)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            fileobj.close()
+            raise ImportError('reading %s requires the zstandard package' % name)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fileobj,
+                                                                            closefd=True))
+    return fileobj
+
+
+class _Closing(io.BufferedReader):
+    """
+    buffered reader of a decompressor that also closes the underlying file
+    (GzipFile does not close a file object it was given)
+    """
+    def __init__(self, raw, fileobj):
+        super().__init__(raw)
+        self._fileobj = fileobj
+
+    def close(self):
+        super().close()
+        self._fileobj.close()
+
+
+def virtual_offset(member_offset, in_member_offset):
+    return (member_offset << IN_MEMBER_BITS) | in_member_offset
+
+
+def split_virtual_offset(offset):
+    return offset >> IN_MEMBER_BITS, offset & (MAX_IN_MEMBER - 1)
+
+
+def iter_gzip_members(path):
+    """
+    create generator of the members of a gzip file
+
+    :param str path: path to gzip file
+
+    :rtype: generator
+    :return: generator of (offset of the member in the file, decompressed chunk),
+    several chunks per member for large members
+    """
+    with open(path, 'rb') as infile:
+        member_offset = 0
+        position = 0
+        decompressor = zlib.decompressobj(wbits=31)
+        while True:
+            data = infile.read(READ_SIZE)
+            if not data:
+                break
+            while data:
+                chunk = decompressor.decompress(data)
+                if chunk:
+                    yield member_offset, chunk
+                if not decompressor.eof:
+                    position += len(data)
+                    break
+                # the member ends in data, the rest is the start of the next one
+                used = len(data) - len(decompressor.unused_data)
+                position += used
+                member_offset = position
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(wbits=31)
+
+
+class IndexedLines:
+    """
+    iterate over the lines of a (compressed) file with their offsets
+
+    after the iteration, kind is PLAIN, BLOCKED or STREAM (see module docstring)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.kind = None
+
+    def __iter__(self):
+        compression = compression_of(self.path)
+        if compression is None:
+            self.kind = PLAIN
+            yield from self._iter_plain()
+        elif compression == 'gzip':
+            yield from self._iter_gzip()
+        else:
+            self.kind = STREAM
+            offset = 0
+            with open_binary(self.path) as infile:
+                for line in infile:
+                    yield offset, line
+                    offset += len(line)
+
+    def _iter_plain(self):
+        offset = 0
+        with open(self.path, 'rb') as infile:
+            for line in infile:
+                yield offset, line
+                offset += len(line)
+
+    def _iter_gzip(self):
+        # virtual offsets; as long as all lines start in the first member,
+        # they are equal to the offsets in the decompressed data
+        self.kind = BLOCKED
+        decompressed_offset = 0
+        current_member = None
+        in_member = 0
+        pending = []
+        line_start = None
+        for member_offset, chunk in iter_gzip_members(self.path):
+            if member_offset != current_member:
+                current_member = member_offset
+                in_member = 0
+            start = 0
+            while start < len(chunk):
+                if line_start is None:
+                    if self.kind == STREAM:
+                        line_start = decompressed_offset
+                    elif in_member >= MAX_IN_MEMBER:
+                        if current_member != 0:
+                            raise ValueError('%s has gzip members larger than %s bytes, '
+                                             'recompress it with compressed_io.compress_blocks' % (
+                                             self.path, MAX_IN_MEMBER))
+                        self.kind = STREAM
+                        line_start = decompressed_offset
+                    else:
+                        line_start = virtual_offset(current_member, in_member)
+                end = chunk.find(b'\n', start)
+                if end == -1:
+                    pending.append(chunk[start:])
+                    in_member += len(chunk) - start
+                    decompressed_offset += len(chunk) - start
+                    break
+                pending.append(chunk[start:end + 1])
+                in_member += end + 1 - start
+                decompressed_offset += end + 1 - start
+                yield line_start, b''.join(pending)
+                pending = []
+                line_start = None
+                start = end + 1
+        if pending:
+            yield line_start, b''.join(pending)
+
+
+class LineReader:
+    """
+    read lines of a (compressed) file starting at offsets from IndexedLines
+    """
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.infile = None
+        self._raw = None
+        self.position = None  # next offset, if known
+
+    def _reopen(self):
+        self.close()
+        self.infile = open_binary(self.path)
+        self.position = 0
+
+    def seek(self, offset):
+        """
+        :param int offset: offset of a line as given by IndexedLines
+        """
+        if offset == self.position:
+            return
+        if self.kind == PLAIN:
+            if self.infile is None:
+                self._reopen()
+            self.infile.seek(offset)
+        elif self.kind == BLOCKED:
+            member_offset, in_member = split_virtual_offset(offset)
+            self.close()
+            raw = open(self.path, 'rb')
+            raw.seek(member_offset)
+            self.infile = gzip.GzipFile(fileobj=raw, mode='rb')
+            self._raw = raw
+            self._skip(in_member)
+        else:
+            if self.infile is None or self.position is None or offset < self.position:
+                self._reopen()
+            self._skip(offset - self.position)
+        self.position = offset
+
+    def _skip(self, num_bytes):
+        while num_bytes > 0:
+            skipped = len(self.infile.read(min(num_bytes, READ_SIZE)))
+            if not skipped:
+                raise ValueError('offset beyond the end of %s' % self.path)
+            num_bytes -= skipped
+
+    def readline(self):
+        if self.infile is None:
+            self._reopen()
+        line = self.infile.readline()
+        if self.kind == BLOCKED:
+            # the next virtual offset is not known without the member bookkeeping
+            self.position = None
+        elif self.position is not None:
+            self.position += len(line)
+        return line
+
+    def close(self):
+        if self.infile is not None:
+            self.infile.close()
+            if self._raw is not None:
+                self._raw.close()
+                self._raw = None
+        self.infile = None
+        self.position = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def compress_blocks(path_input, path_output, block_size=DEFAULT_BLOCK_SIZE, level=6):
+    """
+    gzip a jsonl into members of about block_size decompressed bytes,
+    cut at line ends, so that it can be indexed with virtual offsets
+    (see corpus_index.build_line_index). The output can be read with any gzip
+    reader.
+
+    :param str path_input: path to (compressed) input
+    :param str path_output: path to gzip output
+    :param int block_size: decompressed size after which a member is closed
+    (at most MAX_IN_MEMBER)
+
+    :rtype: int
+    :return: number of members written
+    """
+    if block_size > MAX_IN_MEMBER:
+        raise ValueError('block_size should be at most %s' % MAX_IN_MEMBER)
+    num_members = 0
+    block = []
+    size = 0
+    with open_binary(path_input) as infile, open(path_output, 'wb') as outfile:
+        for line in infile:
+            block.append(line)
+            size += len(line)
+            if size >= block_size:
+                outfile.write(gzip.compress(b''.join(block), compresslevel=level))
+                num_members += 1
+                block = []
+                size = 0
+        if block:
+            outfile.write(gzip.compress(b''.join(block), compresslevel=level))
+            num_members += 1
+    return num_members
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='''Gzip a jsonl in line-aligned members, so that it can be read from any indexed line.''')
+    parser.add_argument('path_input', help="path to (compressed) jsonl")
+    parser.add_argument('path_output', help="path to gzip output")
+    parser.add_argument('-b', type=int, dest="block_size", default=DEFAULT_BLOCK_SIZE, help="decompressed bytes per gzip member")
+    args = parser.parse_args()
+
+    num_members = compress_blocks(args.path_input, args.path_output, args.block_size)
+    print('wrote %s gzip members' % num_members)
@@ -1,37 +1,271 @@
+import os
+import cProfile
 import utils
+import metrics
+import corpus_index
+import rdf_sinks
+import manifest
+import dedup
 import argparse
 
-from rdflib import Graph
+from rdflib import URIRef
 
-parser = argparse.ArgumentParser(description='''Convert SignalMedia to RDF.''')
-parser.add_argument('-f', type=int, dest="start_line", help="convert from line number", required=True)
-parser.add_argument('-t', type=int, dest="end_line",   help="convert till line number (inclusive)", required=True)
-parser.add_argument('-s', type=int, dest="batch_size",   help="batch size", required=True)
+graph_name = URIRef('%sSignalMedia' % utils.cltlDataPrefix)
 
-args = parser.parse_args()
+def convert_batch(path_signalmedia_json,
+                  start,
+                  end,
+                  output_path,
+                  path_newsreader_nafs='',
+                  path_line_index='',
+                  output_format='turtle',
+                  nlp_batch_size=1000,
+                  n_process=1,
+                  path_spacy_nafs='',
+                  logger=None,
+                  manifest_folder='',
+                  path_annotation_cache='',
+                  spacy_annotation=True,
+                  line_numbers=None,
+                  ids_with_naf=None,
+                  compression=None,
+                  max_triples=None,
+                  max_bytes=None,
+                  batch_metrics=None,
+                  profile_path='',
+                  prefetch_depth=0,
+                  n_threads=2,
+                  duplicates=None,
+                  batch_name=None):
+    """
+    convert lines start till end (inclusive) of signalmedia jsonl into
+    one RDF file, or into shards if max_triples or max_bytes is provided
 
-path_signalmedia_json = 'signalmedia-1m.jsonl'
-path_newsreader_nafs = 'naf'
+    :param str path_signalmedia_json: path to signalmedia jsonl
+    :param int start: start line
+    :param int end: end line (inclusive)
+    :param str output_path: path to RDF output file
+    :param str path_newsreader_nafs: path to folder with NewsReader NAFs
+    :param str path_line_index: path to line index of path_signalmedia_json
+    :param str output_format: turtle | nt | nquads | sqlite
+    :param int nlp_batch_size: number of articles per spaCy nlp.pipe batch
+    :param int n_process: number of processes for the spaCy annotation
+    :param str path_spacy_nafs: if provided, the spaCy NAFs are written to this folder
+    :param logging.Logger logger: if provided, progress is logged
+    :param str manifest_folder: if provided, the batch is recorded in the
+    completion manifest in this folder (see manifest.py) once it is done
+    :param str path_annotation_cache: if provided, the spaCy annotation cache
+    (see annotation_cache.py) at this path is used
+    :param bool spacy_annotation: if False, spaCy is not loaded and only the
+    articles with a NewsReader NAF are converted
+    :param list line_numbers: if provided, only these lines (between start and
+    end) are converted
+    :param set ids_with_naf: if provided, the ids of the articles with a
+    NewsReader NAF (see utils.process_first_x_files)
+    :param str compression: gzip | zstd | None, compression of the output
+    :param int max_triples: if provided, a new shard is started when the
+    current one has this many triples (see rdf_sinks.ShardedSink)
+    :param int max_bytes: if provided, a new shard is started when the
+    current one has this many (uncompressed) bytes, only for nt and nquads
+    :param metrics.Metrics batch_metrics: if provided, the time per stage
+    of the conversion is added to it (see metrics.py)
+    :param str profile_path: if provided, the batch is run under cProfile and
+    the profile is written to this path (e.g. for snakeviz or pstats)
+    :param int prefetch_depth: if larger than 0, the jsonl and the NewsReader
+    NAFs are read (and the NAFs parsed) in threads, at most this many
+    articles ahead (see utils.process_first_x_files)
+    :param int n_threads: number of threads for the NewsReader NAFs
+    :param dedup.DuplicateDetector duplicates: if provided, duplicate articles
+    reuse the spaCy annotation of their canonical article and are linked to
+    it (see utils.process_first_x_files). It can be shared by batches that
+    are converted one after another.
+    :param str batch_name: if provided, the batch is recorded in the
+    manifest under this name instead of start-end (for line_numbers that do
+    not form a contiguous range of their own)
 
-for start in range(args.start_line, args.end_line, args.batch_size):
-    end = start + args.batch_size
+    :rtype: tuple
+    :return: (number of articles, number of triples added)
+    """
+    if batch_metrics is None:
+        batch_metrics = metrics.NO_METRICS
+    profiler = None
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
-    exp_basename='%s_%s' % (start, end)
-    log_path = 'logs/%s.log' % exp_basename
-    output_path = 'signalmedia_big_rdf/%s.ttl' % exp_basename
+    # a previous run of this batch may have crashed
+    removed = rdf_sinks.remove_partial_output(output_path)
+    if logger is not None and removed:
+        logger.info('removed the partial output of a previous run: %s' % ', '.join(removed))
 
-    g=Graph()
-    logger = utils.start_logger(log_path)
+    sharded = max_triples is not None or max_bytes is not None
+    if sharded:
+        # the shards are moved into place one by one, the shard manifest
+        # is written when the last one is complete
+        g=rdf_sinks.ShardedSink(output_path, format=output_format, graph_name=graph_name,
+                                compression=compression, max_triples=max_triples,
+                                max_bytes=max_bytes)
+    else:
+        # the output only gets its final name once it is complete
+        part_path = output_path + '.part'
+        g=rdf_sinks.open_sink(part_path, format=output_format, graph_name=graph_name,
+                              compression=compression)
 
     the_generator = utils.process_first_x_files(path_signalmedia_json,
                                                 path_newsreader_nafs=path_newsreader_nafs,
                                                 start=start,
-                                                end=end)
+                                                end=end,
+                                                path_line_index=path_line_index,
+                                                nlp_batch_size=nlp_batch_size,
+                                                n_process=n_process,
+                                                path_spacy_nafs=path_spacy_nafs,
+                                                path_annotation_cache=path_annotation_cache,
+                                                spacy_annotation=spacy_annotation,
+                                                line_numbers=line_numbers,
+                                                ids_with_naf=ids_with_naf,
+                                                metrics=batch_metrics,
+                                                prefetch_depth=prefetch_depth,
+                                                n_threads=n_threads,
+                                                duplicates=duplicates)
 
+    num_articles = 0
     for counter, info_about_news_item in enumerate(the_generator, start):
-        g=utils.json2rdf(info_about_news_item, g)
-#        break
-        if counter % 100 == 0:
+        if sharded:
+            # closes the current shard when it is full
+            with batch_metrics.stage('serialize'):
+                g.start_article(info_about_news_item.signalmedia_json['id'],
+                                info_about_news_item.line_number)
+        with batch_metrics.stage('load_article'):
+            a_news_item = utils.load_article_into_newsitem_class(info_about_news_item)
+        with batch_metrics.stage('rdfize'):
+            g=utils.rdfize_news_item(a_news_item, g)
+        num_articles += 1
+        if logger is not None and counter % 100 == 0:
             logger.info('processed %s files' % counter)
 
-    g.serialize(destination=output_path, format='turtle')
+    with batch_metrics.stage('serialize'):
+        g.close()
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+    if sharded:
+        output_path = g.manifest_path
+    else:
+        os.replace(part_path, output_path)
+
+    if logger is not None and duplicates is not None:
+        logger.info('duplicates: %(exact)s exact, %(near)s near, %(reused)s annotations reused, '
+                    '%(mentions_dropped)s mentions dropped, %(seconds).1fs checking, '
+                    'about %(nlp_seconds_saved).1fs of spaCy saved' % duplicates.report())
+
+    if manifest_folder:
+        manifest.record_batch(manifest_folder, start, end, output_path,
+                              num_articles, g.num_added, name=batch_name)
+    return num_articles, g.num_added
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Convert SignalMedia to RDF.''')
+    parser.add_argument('-f', type=int, dest="start_line", help="convert from line number", required=True)
+    parser.add_argument('-t', type=int, dest="end_line",   help="convert till line number (inclusive)", required=True)
+    parser.add_argument('-s', type=int, dest="batch_size",   help="batch size (default with --max-triples/--max-bytes: one batch)")
+    parser.add_argument('-i', dest="path_line_index", help="path to line index of the jsonl (built if it does not exist)")
+    parser.add_argument('-b', type=int, dest="nlp_batch_size", default=1000, help="number of articles per spaCy nlp.pipe batch")
+    parser.add_argument('-p', type=int, dest="n_process", default=1, help="number of processes for the spaCy annotation")
+    parser.add_argument('-n', dest="path_spacy_nafs", default='', help="if provided, the spaCy NAFs are written to this folder")
+    parser.add_argument('-o', dest="output_format", default='turtle', choices=sorted(rdf_sinks.FORMAT2EXTENSION),
+                        help="output format: turtle (in-memory graph), nt/nquads (streamed) or sqlite (see triple_store.py)")
+    parser.add_argument('-c', dest="path_annotation_cache", default='', help="path to the spaCy annotation cache (sqlite)")
+    parser.add_argument('--newsreader-only', dest="newsreader_only", action='store_true',
+                        help="only convert the NewsReader NAFs, without loading spaCy")
+    parser.add_argument('-r', dest="resume", action='store_true', help="skip the batches that are complete according to the manifest")
+    parser.add_argument('-z', dest="compression", choices=sorted(rdf_sinks.COMPRESSION2EXTENSION),
+                        help="compress the output (not for sqlite)")
+    parser.add_argument('--max-triples', type=int, dest="max_triples",
+                        help="start a new shard when the current one has this many triples")
+    parser.add_argument('--max-bytes', type=int, dest="max_bytes",
+                        help="start a new shard when the current one has this many (uncompressed) bytes (nt and nquads)")
+    parser.add_argument('--metrics', dest="path_metrics", default='logs/metrics.jsonl',
+                        help="path to the metrics of the run (json lines, see metrics.py)")
+    parser.add_argument('--profile-rate', type=float, dest="profile_rate", default=0.0,
+                        help="fraction of the batches that is run under cProfile (logs/profiles/{start}_{end}.prof)")
+    parser.add_argument('--prefetch', type=int, dest="prefetch_depth", default=0,
+                        help="read the jsonl and the NAFs in threads, this many articles ahead (0: no threads)")
+    parser.add_argument('--threads', type=int, dest="n_threads", default=2, help="number of threads parsing the NAFs with --prefetch")
+    parser.add_argument('--dedup', action='store_true',
+                        help="reuse the spaCy annotation of exact and near duplicates and link them to the first copy (see dedup.py)")
+    parser.add_argument('--dedup-threshold', type=float, dest="dedup_threshold", default=dedup.DEFAULT_THRESHOLD,
+                        help="minimum estimated similarity of near duplicates")
+
+    args = parser.parse_args()
+    if args.batch_size is None:
+        if args.max_triples is None and args.max_bytes is None:
+            parser.error('-s is required without --max-triples or --max-bytes')
+        args.batch_size = max(args.end_line - args.start_line, 1)
+    if args.max_bytes is not None and args.output_format not in {'nt', 'nquads'}:
+        parser.error('--max-bytes is only supported for nt and nquads output')
+    if args.compression is not None and args.output_format == 'sqlite':
+        parser.error('sqlite output can not be compressed')
+
+    path_signalmedia_json = 'signalmedia-1m.jsonl'
+    path_newsreader_nafs = 'naf'
+    extension = rdf_sinks.output_extension(args.output_format, args.compression)
+    manifest_folder = 'signalmedia_big_rdf/manifest'
+    path_line_index = args.path_line_index or corpus_index.default_index_path(path_signalmedia_json)
+
+    if not os.path.exists(path_line_index):
+        corpus_index.build_line_index(path_signalmedia_json, path_line_index)
+
+    finished_batches = manifest.load_manifest(manifest_folder) if args.resume else {}
+    metrics_file = metrics.MetricsFile(args.path_metrics)
+    # one detector for all batches, so that duplicates across batches are found
+    duplicates = dedup.DuplicateDetector(threshold=args.dedup_threshold) if args.dedup else None
+
+    for start in range(args.start_line, args.end_line, args.batch_size):
+        end = start + args.batch_size
+
+        exp_basename='%s_%s' % (start, end)
+        log_path = 'logs/%s.log' % exp_basename
+        output_path = 'signalmedia_big_rdf/%s.%s' % (exp_basename, extension)
+
+        if manifest.is_complete(finished_batches.get((start, end))):
+            continue
+
+        logger = utils.start_logger(log_path)
+        profile_path = ''
+        if metrics.profile_batch(start, args.profile_rate):
+            os.makedirs('logs/profiles', exist_ok=True)
+            profile_path = 'logs/profiles/%s.prof' % exp_basename
+
+        batch_metrics = metrics.Metrics()
+        num_articles, num_triples = convert_batch(path_signalmedia_json,
+                      start,
+                      end,
+                      output_path,
+                      path_newsreader_nafs=path_newsreader_nafs,
+                      path_line_index=path_line_index,
+                      output_format=args.output_format,
+                      nlp_batch_size=args.nlp_batch_size,
+                      n_process=args.n_process,
+                      path_spacy_nafs=args.path_spacy_nafs,
+                      logger=logger,
+                      manifest_folder=manifest_folder,
+                      path_annotation_cache=args.path_annotation_cache,
+                      spacy_annotation=not args.newsreader_only,
+                      compression=args.compression,
+                      max_triples=args.max_triples,
+                      max_bytes=args.max_bytes,
+                      batch_metrics=batch_metrics,
+                      profile_path=profile_path,
+                      prefetch_depth=args.prefetch_depth,
+                      n_threads=args.n_threads,
+                      duplicates=duplicates)
+        info = {}
+        if duplicates is not None:
+            info['dedup'] = duplicates.report()
+            duplicates.reset_counts()
+        metrics_file.write(batch_metrics.summary(num_articles, num_triples,
+                                                 start=start, end=end,
+                                                 profiled=bool(profile_path),
+                                                 **info))
+
+    metrics_file.close()
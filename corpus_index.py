@@ -0,0 +1,419 @@
+"""
+byte-offset index of the SignalMedia jsonl
+
+The index is a sidecar file (by default signalmedia-1m.jsonl.idx) with a
+fixed-width record per line: the byte offset at which the line starts and the
+article id. Because the records are fixed-width, the record of line n can be
+read with one seek, so a batch can jump straight to its start line instead of
+reading the corpus from the first line. The jsonl may be compressed (.gz,
+.zst); the offsets are then offsets that compressed_io.LineReader can seek to.
+
+The metadata index (by default signalmedia-1m.jsonl.meta) stores the id,
+publication time, source, byte offset and NewsReader NAF availability of
+every line in columns, so that subsets of the corpus (a publisher, a date
+window, the articles with a NAF) can be selected without parsing the
+articles (see CorpusMetadata.select).
+"""
+import json
+import os
+import time
+import array
+import struct
+import calendar
+
+import compressed_io
+import naf_reader
+
+# version 1: MAGIC_V1 + records (byte offsets of an uncompressed jsonl)
+# version 2: MAGIC + kind of offsets (see compressed_io) + records
+MAGIC_V1 = b'N2RLIDX1'
+MAGIC = b'N2RLIDX2'
+OFFSET_KIND = struct.Struct('<B7x')
+OFFSET_KINDS = [compressed_io.PLAIN, compressed_io.BLOCKED, compressed_io.STREAM]
+RECORD = struct.Struct('<Q36s')  # offset, article id (uuid, 36 chars)
+
+META_MAGIC = b'N2RMETA1'
+META_HEADER = struct.Struct('<Q')  # length of the json header
+ID_SIZE = 36
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'  # 2015-09-04T10:43:03Z
+
+
+def default_index_path(path_signalmedia_json):
+    """
+    return path of the sidecar index of a signalmedia jsonl
+
+    :param str path_signalmedia_json: path to signalmedia jsonl
+
+    :rtype: str
+    :return: path to index
+    """
+    return path_signalmedia_json + '.idx'
+
+
+def default_metadata_path(path_signalmedia_json):
+    """
+    return path of the sidecar metadata index of a signalmedia jsonl
+
+    :param str path_signalmedia_json: path to signalmedia jsonl
+
+    :rtype: str
+    :return: path to metadata index
+    """
+    return path_signalmedia_json + '.meta'
+
+
+def build_line_index(path_signalmedia_json, path_index=None):
+    """
+    build line index of (compressed) signalmedia jsonl (line number -> offset, id)
+
+    the index is written to a temporary file first and then moved into place,
+    so that concurrent readers never see a half-written index
+
+    :param str path_signalmedia_json: path to signalmedia jsonl
+    :param str path_index: path to index, default is default_index_path
+
+    :rtype: int
+    :return: number of lines indexed
+    """
+    if path_index is None:
+        path_index = default_index_path(path_signalmedia_json)
+
+    tmp_path = '%s.tmp%s' % (path_index, os.getpid())
+    num_lines = 0
+    lines = compressed_io.IndexedLines(path_signalmedia_json)
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(MAGIC)
+        outfile.write(OFFSET_KIND.pack(0))  # the kind is known at the end
+        for offset, line in lines:
+            identifier = json.loads(line)['id'].encode('utf-8')
+            if len(identifier) > 36:
+                raise ValueError('id longer than 36 bytes on line %s: %s' % (num_lines + 1,
+                                                                             identifier))
+            outfile.write(RECORD.pack(offset, identifier))
+            num_lines += 1
+        outfile.seek(len(MAGIC))
+        outfile.write(OFFSET_KIND.pack(OFFSET_KINDS.index(lines.kind)))
+
+    os.replace(tmp_path, path_index)
+    return num_lines
+
+
+class LineIndex:
+    """
+    read access to a line index created by build_line_index
+    """
+    def __init__(self, path_index):
+        self.path_index = path_index
+        self.infile = open(path_index, 'rb')
+        magic = self.infile.read(len(MAGIC))
+        if magic == MAGIC:
+            kind, = OFFSET_KIND.unpack(self.infile.read(OFFSET_KIND.size))
+            self.kind = OFFSET_KINDS[kind]
+            self.header_size = len(MAGIC) + OFFSET_KIND.size
+        elif magic == MAGIC_V1:
+            self.kind = compressed_io.PLAIN
+            self.header_size = len(MAGIC_V1)
+        else:
+            self.infile.close()
+            raise ValueError('%s is not a line index' % path_index)
+        size = os.fstat(self.infile.fileno()).st_size
+        self.num_lines = (size - self.header_size) // RECORD.size
+
+    def __len__(self):
+        return self.num_lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.infile.close()
+
+    def lookup(self, line_number):
+        """
+        look up offset and article id of a line
+
+        :param int line_number: line number (starting at 1)
+
+        :rtype: tuple
+        :return: (offset, article id), the offset is a byte offset for
+        uncompressed files (see compressed_io for compressed files)
+        """
+        if not 1 <= line_number <= self.num_lines:
+            raise IndexError('line %s not in index (%s lines)' % (line_number,
+                                                                  self.num_lines))
+        self.infile.seek(self.header_size + (line_number - 1) * RECORD.size)
+        offset, identifier = RECORD.unpack(self.infile.read(RECORD.size))
+        return offset, identifier.rstrip(b'\x00').decode('utf-8')
+
+
+def iter_lines(path_signalmedia_json, line_index, start=1, end=None):
+    """
+    create generator of lines start till end (inclusive) of signalmedia jsonl
+
+    :param str path_signalmedia_json: path to signalmedia jsonl
+    :param LineIndex line_index: index of path_signalmedia_json
+    :param int start: start line
+    :param int end: end line (inclusive), default is last line
+
+    :rtype: generator
+    :return: generator of (line number, line as bytes)
+    """
+    if end is None or end > len(line_index):
+        end = len(line_index)
+    if start > end:
+        return
+
+    offset, _ = line_index.lookup(start)
+    with compressed_io.LineReader(path_signalmedia_json, line_index.kind) as infile:
+        infile.seek(offset)
+        for line_number in range(start, end + 1):
+            yield line_number, infile.readline()
+
+
+def iter_selected_lines(path_signalmedia_json, line_index, line_numbers):
+    """
+    create generator of the lines with the given line numbers
+
+    consecutive lines are read sequentially, a seek is only done for gaps
+
+    :param str path_signalmedia_json: path to signalmedia jsonl
+    :param LineIndex line_index: index of path_signalmedia_json
+    :param iterable line_numbers: increasing line numbers
+
+    :rtype: generator
+    :return: generator of (line number, line as bytes)
+    """
+    next_line_number = None
+    with compressed_io.LineReader(path_signalmedia_json, line_index.kind) as infile:
+        for line_number in line_numbers:
+            if line_number != next_line_number:
+                offset, _ = line_index.lookup(line_number)
+                infile.seek(offset)
+            yield line_number, infile.readline()
+            next_line_number = line_number + 1
+
+
+def parse_date(date):
+    """
+    convert date (2015-09-04) or time (2015-09-04T10:43:03Z) to unix time
+
+    :param str date: date or time (UTC)
+
+    :rtype: int
+    :return: seconds since epoch
+    """
+    if 'T' in date:
+        return calendar.timegm(time.strptime(date, DATE_FORMAT))
+    return calendar.timegm(time.strptime(date, '%Y-%m-%d'))
+
+
+def build_metadata_index(path_signalmedia_json, path_newsreader_nafs='',
+                         path_metadata=None):
+    """
+    build metadata index of signalmedia jsonl
+
+    the columns are (one value per line):
+    offset (Q, as in the line index), published (q, unix time, -1 if
+    missing), source (I, index in the list of sources), has_naf (B, 1 if the
+    NewsReader NAF exists) and id (36 bytes per line). The file starts with
+    META_MAGIC and a json header with the number of lines, the sources, the
+    kind of offsets (see compressed_io) and the position of the columns.
+
+    :param str path_signalmedia_json: path to signalmedia jsonl
+    :param str path_newsreader_nafs: path to folder or archive with NewsReader
+    NAFs (see naf_reader.open_naf_store). The availability is a snapshot:
+    rebuild the index when NAFs are added.
+    :param str path_metadata: path to metadata index, default is default_metadata_path
+
+    :rtype: int
+    :return: number of lines indexed
+    """
+    if path_metadata is None:
+        path_metadata = default_metadata_path(path_signalmedia_json)
+
+    naf_identifiers = set()
+    if path_newsreader_nafs:
+        nafs = naf_reader.open_naf_store(path_newsreader_nafs)
+        naf_identifiers = nafs.identifiers()
+        nafs.close()
+
+    columns = {'offset': array.array('Q'),
+               'published': array.array('q'),
+               'source': array.array('I'),
+               'has_naf': array.array('B')}
+    identifiers = bytearray()
+    source2index = {}
+    lines = compressed_io.IndexedLines(path_signalmedia_json)
+    for offset, line in lines:
+        article = json.loads(line)
+        identifier = article['id'].encode('utf-8')
+        if len(identifier) > ID_SIZE:
+            raise ValueError('id longer than %s bytes on line %s: %s' % (ID_SIZE,
+                                                                         len(columns['offset']) + 1,
+                                                                         identifier))
+        published = -1
+        if article.get('published'):
+            published = parse_date(article['published'])
+        source = article.get('source') or ''
+        if source not in source2index:
+            source2index[source] = len(source2index)
+
+        columns['offset'].append(offset)
+        columns['published'].append(published)
+        columns['source'].append(source2index[source])
+        columns['has_naf'].append(article['id'] in naf_identifiers)
+        identifiers += identifier.ljust(ID_SIZE, b'\x00')
+
+    column_data = [(name, column.typecode, column.tobytes())
+                   for name, column in columns.items()]
+    column_data.append(('id', '%ss' % ID_SIZE, bytes(identifiers)))
+    position = 0
+    layout = {}
+    for name, typecode, data in column_data:
+        layout[name] = [typecode, position, len(data)]
+        position += len(data)
+    header = json.dumps({'num_lines': len(columns['offset']),
+                         'sources': sorted(source2index, key=source2index.get),
+                         'offset_kind': lines.kind,
+                         'columns': layout}).encode('utf-8')
+
+    tmp_path = '%s.tmp%s' % (path_metadata, os.getpid())
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(META_MAGIC)
+        outfile.write(META_HEADER.pack(len(header)))
+        outfile.write(header)
+        for name, typecode, data in column_data:
+            outfile.write(data)
+    os.replace(tmp_path, path_metadata)
+    return len(columns['offset'])
+
+
+class CorpusMetadata:
+    """
+    read access to a metadata index created by build_metadata_index
+
+    the columns are only read when they are used
+    """
+    def __init__(self, path_metadata):
+        self.path_metadata = path_metadata
+        with open(path_metadata, 'rb') as infile:
+            if infile.read(len(META_MAGIC)) != META_MAGIC:
+                raise ValueError('%s is not a metadata index' % path_metadata)
+            header_size, = META_HEADER.unpack(infile.read(META_HEADER.size))
+            header = json.loads(infile.read(header_size).decode('utf-8'))
+        self.data_start = len(META_MAGIC) + META_HEADER.size + header_size
+        self.num_lines = header['num_lines']
+        self.sources = header['sources']
+        self.offset_kind = header.get('offset_kind', compressed_io.PLAIN)
+        self.layout = header['columns']
+        self._columns = {}
+
+    def __len__(self):
+        return self.num_lines
+
+    def _read(self, name):
+        typecode, position, size = self.layout[name]
+        with open(self.path_metadata, 'rb') as infile:
+            infile.seek(self.data_start + position)
+            return infile.read(size)
+
+    def column(self, name):
+        """
+        :param str name: offset | published | source | has_naf
+
+        :rtype: array.array
+        :return: values of the column, the value of line n is at n - 1
+        """
+        if name not in self._columns:
+            values = array.array(self.layout[name][0])
+            values.frombytes(self._read(name))
+            self._columns[name] = values
+        return self._columns[name]
+
+    def identifier(self, line_number):
+        """
+        :param int line_number: line number (starting at 1)
+
+        :rtype: str
+        :return: article id of the line
+        """
+        if 'id' not in self._columns:
+            self._columns['id'] = self._read('id')
+        position = (line_number - 1) * ID_SIZE
+        return self._columns['id'][position:position + ID_SIZE].rstrip(b'\x00').decode('utf-8')
+
+    def select(self, start=1, end=None, publishers=None,
+               from_date=None, to_date=None, has_naf=None):
+        """
+        select lines by their metadata
+
+        :param int start: first line
+        :param int end: last line (inclusive), default is last line
+        :param set publishers: if provided, only lines with one of these sources
+        :param str from_date: if provided, only lines published at or after this
+        date (2015-09-04) or time (2015-09-04T10:43:03Z)
+        :param str to_date: if provided, only lines published before the end of
+        this date or at or before this time
+        :param bool has_naf: if provided, only lines with (True) or without
+        (False) a NewsReader NAF
+
+        :rtype: list
+        :return: sorted list of line numbers
+        """
+        if end is None or end > self.num_lines:
+            end = self.num_lines
+        rows = range(start - 1, end)
+
+        if publishers is not None:
+            source_column = self.column('source')
+            wanted = {index for index, source in enumerate(self.sources)
+                      if source in publishers}
+            rows = [row for row in rows if source_column[row] in wanted]
+        if from_date is not None:
+            published = self.column('published')
+            minimum = parse_date(from_date)
+            rows = [row for row in rows if published[row] >= minimum]
+        if to_date is not None:
+            published = self.column('published')
+            maximum = parse_date(to_date)
+            if 'T' not in to_date:
+                maximum += 24 * 60 * 60 - 1
+            rows = [row for row in rows if 0 <= published[row] <= maximum]
+        if has_naf is not None:
+            has_naf_column = self.column('has_naf')
+            rows = [row for row in rows if bool(has_naf_column[row]) == has_naf]
+        return [row + 1 for row in rows]
+
+    def ids_with_naf(self, line_numbers):
+        """
+        :param iterable line_numbers: line numbers
+
+        :rtype: set
+        :return: ids of the lines whose NewsReader NAF exists
+        """
+        has_naf_column = self.column('has_naf')
+        return {self.identifier(line_number)
+                for line_number in line_numbers
+                if has_naf_column[line_number - 1]}
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='''Build byte-offset index (and metadata index) of SignalMedia jsonl.''')
+    parser.add_argument('path_signalmedia_json', help="path to signalmedia jsonl")
+    parser.add_argument('-o', dest="path_index", help="path to index (default: <jsonl>.idx)")
+    parser.add_argument('-m', dest="path_metadata", help="path to metadata index (default: <jsonl>.meta)")
+    parser.add_argument('--metadata', action='store_true', help="build the metadata index as well")
+    parser.add_argument('--nafs', dest="path_newsreader_nafs", default='naf', help="path to folder with NewsReader NAFs (for --metadata)")
+    args = parser.parse_args()
+
+    num_lines = build_line_index(args.path_signalmedia_json, args.path_index)
+    print('indexed %s lines' % num_lines)
+    if args.metadata:
+        num_lines = build_metadata_index(args.path_signalmedia_json,
+                                         args.path_newsreader_nafs,
+                                         args.path_metadata)
+        print('indexed metadata of %s lines' % num_lines)
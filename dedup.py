@@ -0,0 +1,582 @@
+"""
+detection of duplicate articles, so that their annotation can be reused
+
+SignalMedia contains many syndicated copies of the same story under another
+id and source. DuplicateDetector compares every article with the earlier
+(canonical) articles it has seen:
+
+* exact duplicate: the same content (sha1)
+* near duplicate: an estimated Jaccard similarity of the word 5-gram
+  shingles of at least threshold. The similarity is estimated with MinHash
+  signatures; the candidates are found with LSH (the signature is cut into
+  bands, and articles that share a band are compared), so an article is
+  only compared with a few canonical articles.
+
+The conversion (see utils.process_first_x_files) does not run spaCy on a
+duplicate, but reuses the spaCy mentions of its canonical article: as they
+are for an exact duplicate, remapped to its own offsets for a near duplicate
+(see remap_entity_mentions; mentions in text that differs are dropped). The
+remapped mentions keep their sentence number, so a near duplicate is only
+annotated this way if its sentences are numbered as in the canonical article
+(see sentences_preserved); else it is annotated by spaCy. A duplicate is
+linked to its canonical article with cltlv:duplicateOf. The NewsReader NAF of a
+duplicate, if it has one, is converted as usual.
+
+The detector keeps at most max_canonicals canonical articles (the oldest are
+dropped first). report gives the number of duplicates and an estimate of
+the spaCy time saved, from the spaCy time per character of the annotated
+articles.
+
+find_duplicates finds the duplicates of a whole corpus in a pass before the
+conversion (python dedup.py writes them as tsv). The work units of
+parallel_conversion.py are then made so that a duplicate is converted with
+its canonical article, by a DuplicateDetector that looks the duplicates up
+instead of detecting them (known).
+"""
+import os
+import re
+import json
+import bisect
+import random
+import time
+import hashlib
+import argparse
+import multiprocessing
+from difflib import SequenceMatcher
+from collections import namedtuple, OrderedDict
+
+duplicate = namedtuple('duplicate', ['kind', 'canonical_id', 'similarity'])
+alignment = namedtuple('alignment', ['source_tokens', 'target_tokens', 'blocks'])
+duplicate_line = namedtuple('duplicate_line', ['identifier', 'canonical_line', 'match'])
+
+EXACT = 'exact'
+NEAR = 'near'
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+NUM_BANDS = 8
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_MAX_CANONICALS = 20000
+DEFAULT_WINDOW = 200000  # canonical articles kept by find_duplicates
+MIN_WORDS = 20  # shorter articles are only compared exactly
+
+MERSENNE_PRIME = (1 << 61) - 1
+WORD_PATTERN = re.compile(r'\w+')
+TOKEN_PATTERN = re.compile(r'\S+')
+SENTENCE_END_PATTERN = re.compile(r'[.!?\n]')
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).digest()
+
+
+def shingle_hashes(words, size=SHINGLE_SIZE):
+    """
+    :param list words: lowercased words of a text
+    :param int size: number of words per shingle
+
+    :rtype: set
+    :return: set of 64 bit hashes of the shingles
+    """
+    return {int.from_bytes(hashlib.blake2b(' '.join(words[index:index + size]).encode('utf-8'),
+                                           digest_size=8).digest(), 'little')
+            for index in range(max(len(words) - size + 1, 1))}
+
+
+def permutations(num_perm=NUM_PERM, seed=1):
+    """
+    :rtype: list
+    :return: num_perm (a, b) of the hash functions (a * x + b) mod MERSENNE_PRIME
+    """
+    rng = random.Random(seed)
+    return [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME))
+            for _ in range(num_perm)]
+
+
+def minhash(hashes, the_permutations):
+    """
+    :param set hashes: shingle hashes
+    :param list the_permutations: see permutations
+
+    :rtype: tuple
+    :return: MinHash signature
+    """
+    return tuple(min((a * value + b) % MERSENNE_PRIME for value in hashes)
+                 for a, b in the_permutations)
+
+
+PERMUTATIONS = permutations()
+
+
+def fingerprint(content, the_permutations=PERMUTATIONS):
+    """
+    :param str content: article content
+    :param list the_permutations: see permutations
+
+    :rtype: tuple
+    :return: (sha1 of content, MinHash signature or None if content has
+    less than MIN_WORDS words)
+    """
+    signature = None
+    words = WORD_PATTERN.findall(content.lower())
+    if len(words) >= MIN_WORDS:
+        signature = minhash(shingle_hashes(words), the_permutations)
+    return content_hash(content), signature
+
+
+def estimated_similarity(signature, other_signature):
+    return sum(1 for value, other_value in zip(signature, other_signature)
+               if value == other_value) / len(signature)
+
+
+def align(source, target):
+    """
+    align two texts on their whitespace separated tokens
+
+    :rtype: alignment
+    :return: (tokens of source, tokens of target, matching blocks of
+    difflib.SequenceMatcher), with the tokens as (start, end, token)
+    """
+    source_tokens = [(match.start(), match.end(), match.group()) for match in TOKEN_PATTERN.finditer(source)]
+    target_tokens = [(match.start(), match.end(), match.group()) for match in TOKEN_PATTERN.finditer(target)]
+    matcher = SequenceMatcher(None,
+                              [token for start, end, token in source_tokens],
+                              [token for start, end, token in target_tokens],
+                              autojunk=False)
+    return alignment(source_tokens, target_tokens, matcher.get_matching_blocks())
+
+
+def sentences_preserved(source, target, the_alignment):
+    """
+    check that the sentences of source and target are numbered the same up
+    to the last aligned token: the texts that differ between two aligned
+    tokens have as many sentence ends (. ! ? or a newline) in source as in
+    target
+
+    :param str source: content of the canonical article
+    :param str target: content of the near duplicate
+    :param alignment the_alignment: see align
+
+    :rtype: bool
+    """
+    source_tokens, target_tokens, blocks = the_alignment
+    source_end = target_end = 0
+    for source_index, target_index, size in blocks:
+        for offset in range(size):
+            source_start, next_source_end, _ = source_tokens[source_index + offset]
+            target_start, next_target_end, _ = target_tokens[target_index + offset]
+            source_gap = source[source_end:source_start]
+            target_gap = target[target_end:target_start]
+            if source_gap != target_gap and (len(SENTENCE_END_PATTERN.findall(source_gap)) !=
+                                             len(SENTENCE_END_PATTERN.findall(target_gap))):
+                return False
+            source_end, target_end = next_source_end, next_target_end
+    return True
+
+
+def remap_entity_mentions(entity_mentions, source, target, the_alignment=None):
+    """
+    map entity mentions of source to the offsets of the same text in target
+
+    a mention is mapped if all of its tokens are in an aligned block and its
+    text is the same in target. The mentions keep their sentence number,
+    which only holds for target if sentences_preserved.
+
+    :param list entity_mentions: semeval_classes.EntityMention objects of source
+    :param str source: content that the mentions refer to
+    :param str target: content of the near duplicate
+    :param alignment the_alignment: alignment of source and target (see
+    align), computed if not provided
+
+    :rtype: list
+    :return: list of semeval_classes.EntityMention objects with the offsets in target
+    """
+    if the_alignment is None:
+        the_alignment = align(source, target)
+    source_tokens, target_tokens, blocks = the_alignment
+    source2target = {}
+    for source_index, target_index, size in blocks:
+        for offset in range(size):
+            source2target[source_index + offset] = target_index + offset
+    source_starts = [start for start, end, token in source_tokens]
+
+    remapped = []
+    for entity_mention in entity_mentions:
+        first = bisect.bisect_right(source_starts, entity_mention.begin_index) - 1
+        last = bisect.bisect_right(source_starts, entity_mention.end_index - 1) - 1
+        if first < 0 or first not in source2target or last not in source2target:
+            continue
+        target_first = source2target[first]
+        target_last = source2target[last]
+        if target_last - target_first != last - first:
+            continue
+        begin_index = target_tokens[target_first][0] + entity_mention.begin_index - source_tokens[first][0]
+        end_index = target_tokens[target_last][0] + entity_mention.end_index - source_tokens[last][0]
+        if target[begin_index:end_index] != source[entity_mention.begin_index:entity_mention.end_index]:
+            continue
+        remapped.append(entity_mention._replace(begin_index=begin_index, end_index=end_index))
+    return remapped
+
+
+class DuplicateDetector:
+    """
+    find exact and near duplicates among the articles of a stream
+    """
+    def __init__(self, threshold=DEFAULT_THRESHOLD, num_perm=NUM_PERM, num_bands=NUM_BANDS,
+                 max_canonicals=DEFAULT_MAX_CANONICALS, known=None, keep_contents=True):
+        """
+        :param float threshold: minimum estimated Jaccard similarity of a near duplicate
+        :param int num_perm: length of the MinHash signatures
+        :param int num_bands: number of LSH bands (num_perm must be a multiple)
+        :param int max_canonicals: maximum number of canonical articles kept
+        :param dict known: if provided, the duplicates are not detected but
+        looked up in this map of id -> duplicate (see find_duplicates); the
+        other articles are canonical articles
+        :param bool keep_contents: if False, the content of the canonical
+        articles is not kept (when the annotations are not reused)
+        """
+        if num_perm % num_bands:
+            raise ValueError('num_perm should be a multiple of num_bands')
+        self.threshold = threshold
+        self.rows = num_perm // num_bands
+        self.num_bands = num_bands
+        self.permutations = permutations(num_perm)
+        self.max_canonicals = max_canonicals
+        self.known = known
+        self.keep_contents = keep_contents
+
+        self.canonicals = OrderedDict()  # id -> [hash, signature, content, entity mentions]
+        self.hash2id = {}
+        self.buckets = {}  # (band, values) -> list of ids
+        self.matches = {}  # id -> duplicate, until the article is converted
+        self.alignments = {}  # id -> alignment of a reusable near duplicate, until released
+
+        self.nlp_seconds = 0.0
+        self.nlp_chars = 0
+        self.reset_counts()
+
+    def _bands(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows])
+                for band in range(self.num_bands)]
+
+    def _forget_oldest(self):
+        identifier, (the_hash, signature, content, entity_mentions) = self.canonicals.popitem(last=False)
+        if the_hash is not None and self.hash2id.get(the_hash) == identifier:
+            del self.hash2id[the_hash]
+        if signature is not None:
+            for key in self._bands(signature):
+                ids = self.buckets[key]
+                ids.remove(identifier)
+                if not ids:
+                    del self.buckets[key]
+
+    def check(self, identifier, content, the_fingerprint=None):
+        """
+        compare an article with the canonical articles; if it is not a
+        duplicate, it becomes a canonical article
+
+        :param str identifier: article id
+        :param str content: article content
+        :param tuple the_fingerprint: fingerprint of content, if it is
+        already known (see fingerprint)
+
+        :rtype: duplicate | None
+        :return: (exact | near, id of canonical article, estimated similarity),
+        None if the article is not a duplicate
+        """
+        started = time.perf_counter()
+        try:
+            return self._check(identifier, content, the_fingerprint)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+    def _check(self, identifier, content, the_fingerprint):
+        self.num_checked += 1
+        if self.known is not None:
+            match = self.known.get(identifier)
+            if match is not None:
+                return self._matched(identifier, match)
+            self._add_canonical(identifier, None, None, content)
+            return None
+
+        if the_fingerprint is None:
+            the_fingerprint = fingerprint(content, self.permutations)
+        the_hash, signature = the_fingerprint
+        canonical_id = self.hash2id.get(the_hash)
+        if canonical_id is not None:
+            return self._matched(identifier, duplicate(EXACT, canonical_id, 1.0))
+
+        if signature is not None:
+            candidates = set()
+            for key in self._bands(signature):
+                candidates.update(self.buckets.get(key, ()))
+            best = None
+            for candidate in candidates:
+                similarity = estimated_similarity(signature, self.canonicals[candidate][1])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (candidate, similarity)
+            if best is not None:
+                return self._matched(identifier, duplicate(NEAR, best[0], best[1]))
+
+        self._add_canonical(identifier, the_hash, signature, content)
+        return None
+
+    def _matched(self, identifier, match):
+        if match.kind == EXACT:
+            self.num_exact += 1
+        else:
+            self.num_near += 1
+        self.matches[identifier] = match
+        return match
+
+    def _add_canonical(self, identifier, the_hash, signature, content):
+        if len(self.canonicals) >= self.max_canonicals:
+            self._forget_oldest()
+        self.canonicals[identifier] = [the_hash, signature,
+                                       content if self.keep_contents else None, None]
+        if the_hash is not None:
+            self.hash2id[the_hash] = identifier
+        if signature is not None:
+            for key in self._bands(signature):
+                self.buckets.setdefault(key, []).append(identifier)
+
+    def scan(self, articles):
+        """
+        create generator of articles, checking each of them (see check)
+
+        :param iterable articles: SignalMedia articles (dicts)
+        """
+        for article in articles:
+            self.check(article['id'], article['content'])
+            yield article
+
+    def match(self, identifier):
+        """
+        :rtype: duplicate | None
+        :return: the result of check for an article, until release is called
+        """
+        return self.matches.get(identifier)
+
+    def release(self, identifier):
+        self.matches.pop(identifier, None)
+        self.alignments.pop(identifier, None)
+
+    def remember(self, identifier, entity_mentions):
+        """
+        store the spaCy annotation of a canonical article
+        """
+        canonical = self.canonicals.get(identifier)
+        if canonical is not None:
+            canonical[3] = entity_mentions
+
+    def reusable(self, identifier, content, canonical_content):
+        """
+        :param str identifier: id of a duplicate
+        :param str content: its content
+        :param str canonical_content: content of its canonical article
+
+        :rtype: bool
+        :return: True if the annotation of the canonical article can be
+        reused: always for an exact duplicate, for a near duplicate if its
+        sentences are numbered the same (see sentences_preserved)
+        """
+        if self.matches[identifier].kind == EXACT:
+            return True
+        the_alignment = align(canonical_content, content)
+        if not sentences_preserved(canonical_content, content, the_alignment):
+            self.num_sentences_changed += 1
+            return False
+        self.alignments[identifier] = the_alignment
+        return True
+
+    def annotation_of(self, identifier, content):
+        """
+        :param str identifier: id of a duplicate
+        :param str content: its content
+
+        :rtype: list | None
+        :return: entity mentions of its canonical article with the offsets of
+        content, None if the article is not a duplicate, the annotation of
+        the canonical article is not known or can not be reused (see reusable)
+        """
+        match = self.matches.get(identifier)
+        if match is None:
+            return None
+        canonical = self.canonicals.get(match.canonical_id)
+        if canonical is None or canonical[3] is None:
+            return None
+        if not self.reusable(identifier, content, canonical[2]):
+            return None
+        return self.reuse(identifier, content, canonical[2], canonical[3])
+
+    def reuse(self, identifier, content, canonical_content, entity_mentions):
+        """
+        :param str identifier: id of a duplicate for which reusable is True
+        :param str content: content of the duplicate
+        :param str canonical_content: content of its canonical article
+        :param list entity_mentions: entity mentions of its canonical article
+
+        :rtype: list
+        :return: the entity mentions with the offsets of content
+        """
+        if self.matches[identifier].kind == NEAR:
+            remapped = remap_entity_mentions(entity_mentions, canonical_content, content,
+                                             the_alignment=self.alignments.get(identifier))
+            self.num_mentions_dropped += len(entity_mentions) - len(remapped)
+            entity_mentions = remapped
+        self.num_reused += 1
+        self.chars_reused += len(content)
+        return entity_mentions
+
+    def record_nlp(self, seconds, num_chars):
+        """
+        record the spaCy time of annotated articles, for the estimate of
+        the time saved
+        """
+        self.nlp_seconds += seconds
+        self.nlp_chars += num_chars
+
+    def reset_counts(self):
+        """
+        start new counts for report (e.g. per batch); the canonical articles
+        and the spaCy time per character are kept
+        """
+        self.num_checked = 0
+        self.num_exact = 0
+        self.num_near = 0
+        self.num_reused = 0
+        self.chars_reused = 0
+        self.num_mentions_dropped = 0
+        self.num_sentences_changed = 0
+        self.seconds = 0.0
+
+    def report(self):
+        """
+        :rtype: dict
+        :return: number of articles checked, exact and near duplicates,
+        reused annotations, dropped mentions, near duplicates annotated by
+        spaCy because their sentences differ, the seconds spent checking and
+        the estimated spaCy seconds saved
+        """
+        seconds_per_char = self.nlp_seconds / self.nlp_chars if self.nlp_chars else 0.0
+        return {'checked': self.num_checked,
+                'exact': self.num_exact,
+                'near': self.num_near,
+                'reused': self.num_reused,
+                'mentions_dropped': self.num_mentions_dropped,
+                'sentences_changed': self.num_sentences_changed,
+                'seconds': self.seconds,
+                'nlp_seconds_saved': self.chars_reused * seconds_per_char}
+
+
+def _fingerprint_line(numbered_line):
+    line_number, line = numbered_line
+    article = json.loads(line)
+    return line_number, article['id'], fingerprint(article['content'])
+
+
+def find_duplicates(numbered_lines, threshold=DEFAULT_THRESHOLD, max_canonicals=DEFAULT_WINDOW,
+                    n_process=1, chunksize=100):
+    """
+    find the duplicates in a pass over the corpus, before the conversion, so
+    that work units converted in parallel (see parallel_conversion.py) can
+    be made of a canonical article and its duplicates
+
+    :param iterable numbered_lines: (line number, line) of a SignalMedia jsonl
+    (see utils.iter_article_lines)
+    :param float threshold: minimum estimated Jaccard similarity of a near duplicate
+    :param int max_canonicals: maximum number of canonical articles kept
+    :param int n_process: number of processes computing the fingerprints
+    :param int chunksize: number of lines sent to a process at once
+
+    :rtype: dict
+    :return: line number -> duplicate_line (id, line of canonical article,
+    duplicate) for the duplicates
+    """
+    detector = DuplicateDetector(threshold=threshold, max_canonicals=max_canonicals,
+                                 keep_contents=False)
+    id2line = {}
+    duplicates = {}
+    pool = None
+    if n_process > 1:
+        pool = multiprocessing.get_context('fork').Pool(n_process)
+        results = pool.imap(_fingerprint_line, numbered_lines, chunksize=chunksize)
+    else:
+        results = map(_fingerprint_line, numbered_lines)
+    try:
+        for line_number, identifier, the_fingerprint in results:
+            match = detector.check(identifier, None, the_fingerprint)
+            if match is None:
+                id2line[identifier] = line_number
+                if len(id2line) > 2 * max_canonicals:
+                    id2line = {identifier: id2line[identifier] for identifier in detector.canonicals}
+                continue
+            detector.release(identifier)
+            duplicates[line_number] = duplicate_line(identifier, id2line[match.canonical_id], match)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return duplicates
+
+
+def write_duplicates(path, duplicates):
+    """
+    write the result of find_duplicates as tsv: line, id, canonical line,
+    canonical id, kind, similarity
+
+    :param str path: output path (written to path.part first)
+    :param dict duplicates: line number -> duplicate_line
+    """
+    part_path = path + '.part'
+    with open(part_path, 'w') as outfile:
+        for line_number, (identifier, canonical_line, match) in sorted(duplicates.items()):
+            outfile.write('%s\t%s\t%s\t%s\t%s\t%.3f\n' % (line_number, identifier, canonical_line,
+                                                       match.canonical_id, match.kind,
+                                                       match.similarity))
+    os.replace(part_path, path)
+
+
+def load_duplicates(path):
+    """
+    :param str path: path written by write_duplicates
+
+    :rtype: dict
+    :return: line number -> duplicate_line
+    """
+    duplicates = {}
+    with open(path) as infile:
+        for row in infile:
+            line_number, identifier, canonical_line, canonical_id, kind, similarity = row.rstrip('\n').split('\t')
+            duplicates[int(line_number)] = duplicate_line(identifier, int(canonical_line),
+                                                          duplicate(kind, canonical_id, float(similarity)))
+    return duplicates
+
+
+if __name__ == '__main__':
+    import utils
+    import corpus_index
+    parser = argparse.ArgumentParser(description='''Find exact and near duplicate articles in a SignalMedia jsonl.''')
+    parser.add_argument('path_jsonl', help="path to (compressed) jsonl")
+    parser.add_argument('-o', dest="path_output",
+                        help="if provided, the duplicates are written to this path (tsv: line, id, canonical line, canonical id, kind, similarity)")
+    parser.add_argument('-t', type=float, dest="threshold", default=DEFAULT_THRESHOLD, help="minimum similarity of near duplicates")
+    parser.add_argument('-w', type=int, dest="max_canonicals", default=DEFAULT_WINDOW, help="maximum number of canonical articles kept")
+    parser.add_argument('-p', type=int, dest="n_process", default=1, help="number of processes computing the fingerprints")
+
+    args = parser.parse_args()
+
+    path_line_index = corpus_index.default_index_path(args.path_jsonl)
+    if not os.path.exists(path_line_index):
+        path_line_index = ''
+    started = time.time()
+    duplicates = find_duplicates(utils.iter_article_lines(args.path_jsonl,
+                                                           path_line_index=path_line_index,
+                                                           with_line_numbers=True),
+                                 threshold=args.threshold,
+                                 max_canonicals=args.max_canonicals,
+                                 n_process=args.n_process)
+    if args.path_output:
+        write_duplicates(args.path_output, duplicates)
+    print('exact duplicates: %s' % sum(1 for item in duplicates.values() if item.match.kind == EXACT))
+    print('near duplicates: %s' % sum(1 for item in duplicates.values() if item.match.kind == NEAR))
+    print('seconds: %.1f' % (time.time() - started))
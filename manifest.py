@@ -0,0 +1,144 @@
+"""
+completion manifest of converted batches
+
+For every batch (line range) that has been converted completely, a small json
+file {manifest_folder}/{start}_{end}.json (or {name}.json for a named batch)
+is written with the output path, the number of articles and triples and the
+checksum of the output. Each entry
+is written to a temporary file first and then moved into place, so an entry
+exists if and only if its batch finished. A resumed run skips the batches
+with a valid entry and redoes the others.
+
+For sharded output (see rdf_sinks.ShardedSink) the output is the shard
+manifest {start}_{end}.shards.json, which has the size and checksum of every
+shard; is_complete checks the shards as well.
+"""
+import os
+import json
+import time
+import hashlib
+
+
+SHARD_MANIFEST_SUFFIX = '.shards.json'
+
+
+def entry_path(manifest_folder, start, end, name=None):
+    return os.path.join(manifest_folder, '%s.json' % (name or '%s_%s' % (start, end)))
+
+
+def atomic_write(path, data):
+    """
+    write bytes to path via a temporary file in the same folder
+
+    :param str path: path to write to
+    :param bytes data: content
+    """
+    tmp_path = '%s.tmp%s' % (path, os.getpid())
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(data)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_path, path)
+
+
+def checksum(path, block_size=2 ** 20):
+    """
+    compute sha1 of a file
+
+    :param str path: path to file
+
+    :rtype: str
+    :return: hexdigest
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def record_batch(manifest_folder, start, end, output_path,
+                 num_articles, num_triples, name=None):
+    """
+    record that batch start-end has been converted completely
+
+    :param str manifest_folder: folder of the manifest
+    :param int start: start line
+    :param int end: end line
+    :param str output_path: path to the complete RDF output of the batch
+    :param int num_articles: number of articles converted
+    :param int num_triples: number of triples added
+    :param str name: if provided, the batch is recorded under this name
+    instead of start-end (batches of selected lines that overlap)
+
+    :rtype: dict
+    :return: the manifest entry
+    """
+    os.makedirs(manifest_folder, exist_ok=True)
+    entry = {'start': start,
+             'end': end,
+             'output_path': output_path,
+             'num_articles': num_articles,
+             'num_triples': num_triples,
+             'size': os.path.getsize(output_path),
+             'sha1': checksum(output_path),
+             'finished': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    if name:
+        entry['name'] = name
+    atomic_write(entry_path(manifest_folder, start, end, name=name),
+                 json.dumps(entry, sort_keys=True).encode('utf-8'))
+    return entry
+
+
+def load_manifest(manifest_folder):
+    """
+    load all entries of a manifest
+
+    :param str manifest_folder: folder of the manifest
+
+    :rtype: dict
+    :return: mapping (start, end) -> entry, name -> entry for the batches
+    recorded under a name
+    """
+    entries = {}
+    if not os.path.isdir(manifest_folder):
+        return entries
+    for basename in os.listdir(manifest_folder):
+        if not basename.endswith('.json'):
+            continue
+        with open(os.path.join(manifest_folder, basename)) as infile:
+            entry = json.load(infile)
+        entries[entry.get('name', (entry['start'], entry['end']))] = entry
+    return entries
+
+
+def is_complete(entry, verify_checksum=False):
+    """
+    check whether the output of a manifest entry is still there and complete
+
+    :param dict entry: manifest entry (or None)
+    :param bool verify_checksum: if True, the checksum of the output (and
+    of its shards) is recomputed, else only the size is compared
+
+    :rtype: bool
+    :return: whether the batch can be skipped
+    """
+    if entry is None:
+        return False
+    output_path = entry['output_path']
+    if not _file_is_complete(output_path, entry['size'], entry['sha1'], verify_checksum):
+        return False
+    if output_path.endswith(SHARD_MANIFEST_SUFFIX):
+        with open(output_path) as infile:
+            shards = json.load(infile)['shards']
+        return all(_file_is_complete(shard['path'], shard['size'], shard.get('sha1'), verify_checksum)
+                   for shard in shards)
+    return True
+
+
+def _file_is_complete(path, size, sha1, verify_checksum):
+    if not os.path.exists(path) or os.path.getsize(path) != size:
+        return False
+    if verify_checksum:
+        return checksum(path) == sha1
+    return True
@@ -0,0 +1,233 @@
+"""
+merge the RDF shards of a conversion into one sorted dump without duplicates
+
+Every shard repeats the triples that are shared between articles (the type of
+the news items, the collection, publishers, topics, ...). The merge streams
+the shards as N-Triples/N-Quads lines and removes the duplicates with an
+external sort, so memory is bounded by max_bytes whatever the size of the
+corpus:
+
+1. the lines are read into a buffer of at most max_bytes, which is sorted,
+   deduplicated and written to a temporary run file when it is full
+2. the sorted runs are merged (at most max_open_runs at the same time),
+   dropping the lines equal to the previous one
+
+Turtle shards are parsed one at a time with rdflib and written as N-Triples
+lines, the triples of SQLite shards (see triple_store.py) are read from their
+triples table. Compressed shards (.gz, .zst) are decompressed on the fly.
+"""
+import os
+import glob
+import heapq
+import logging
+import argparse
+import tempfile
+from collections import namedtuple
+
+import rdf_sinks
+import compressed_io
+
+merge_stats = namedtuple('merge_stats', ['num_shards', 'num_triples',
+                                         'num_unique', 'duplicate_ratio'])
+
+DEFAULT_MAX_BYTES = 2 ** 30
+DEFAULT_MAX_OPEN_RUNS = 128
+
+def find_shards(folder):
+    """
+    find the RDF shards in a folder (not recursive, so the manifest
+    and unfinished .part files are left out, as are the shard manifests)
+
+    :param str folder: output folder of the conversion
+
+    :rtype: list
+    :return: sorted list of paths
+    """
+    return sorted(path for path in glob.glob(os.path.join(folder, '*'))
+                  if os.path.isfile(path)
+                  and rdf_sinks.format_of_path(path)[0] is not None)
+
+
+def iter_shard_lines(path):
+    """
+    create generator of the N-Triples (N-Quads) lines of a shard
+
+    :param str path: path to .nt, .nq, .ttl (optionally .gz or .zst) or .sqlite file
+
+    :rtype: generator
+    :return: generator of bytestrings ending with a newline
+    """
+    output_format = rdf_sinks.format_of_path(path)[0]
+    if output_format == 'sqlite':
+        import sqlite3
+        connection = sqlite3.connect(path)
+        try:
+            for row in connection.execute('SELECT subject, predicate, object FROM triples'):
+                yield ('%s %s %s .\n' % row).encode('utf-8')
+        finally:
+            connection.close()
+        return
+
+    if output_format == 'turtle':
+        from rdflib import Graph
+        g = Graph()
+        with compressed_io.open_binary(path) as infile:
+            g.parse(infile, format='turtle')
+        for subject, predicate, obj in g:
+            yield ('%s %s %s .\n' % (rdf_sinks.nt_term(subject),
+                                     rdf_sinks.nt_term(predicate),
+                                     rdf_sinks.nt_term(obj))).encode('utf-8')
+        return
+
+    with compressed_io.open_binary(path) as infile:
+        for line in infile:
+            if not line.strip() or line.startswith(b'#'):
+                continue
+            if not line.endswith(b'\n'):
+                line += b'\n'
+            yield line
+
+
+def unique_sorted(lines):
+    """
+    drop consecutive duplicates from sorted lines
+    """
+    previous = None
+    for line in lines:
+        if line != previous:
+            yield line
+            previous = line
+
+
+def write_run(lines, folder):
+    """
+    sort lines, drop duplicates and write them to a temporary run file
+
+    :rtype: str
+    :return: path to run file
+    """
+    lines.sort()
+    fd, path = tempfile.mkstemp(suffix='.run', dir=folder)
+    with os.fdopen(fd, 'wb') as outfile:
+        outfile.writelines(unique_sorted(lines))
+    return path
+
+
+def merge_runs(paths, outfile):
+    """
+    merge sorted run files into outfile, without duplicates
+
+    :rtype: int
+    :return: number of lines written
+    """
+    infiles = [open(path, 'rb') for path in paths]
+    try:
+        num_lines = 0
+        for line in unique_sorted(heapq.merge(*infiles)):
+            outfile.write(line)
+            num_lines += 1
+    finally:
+        for infile in infiles:
+            infile.close()
+    return num_lines
+
+
+def merge_shards(shard_paths, output_path,
+                 max_bytes=DEFAULT_MAX_BYTES,
+                 max_open_runs=DEFAULT_MAX_OPEN_RUNS,
+                 tmp_folder=None,
+                 logger=None):
+    """
+    merge shards into one sorted N-Triples (N-Quads) file without duplicates
+
+    :param list shard_paths: paths to .nt, .nq, .ttl (optionally .gz or .zst) or .sqlite shards
+    :param str output_path: path to the merged output
+    :param int max_bytes: maximum size of the lines kept in memory
+    :param int max_open_runs: maximum number of run files merged at the same time
+    :param str tmp_folder: folder for the run files, default is the folder of output_path
+    :param logging.Logger logger: if provided, progress is logged
+
+    :rtype: merge_stats
+    :return: (number of shards, number of triples read,
+    number of unique triples, fraction of the triples that were duplicates)
+    """
+    if tmp_folder is None:
+        tmp_folder = os.path.dirname(os.path.abspath(output_path))
+    run_folder = tempfile.mkdtemp(prefix='merge_', dir=tmp_folder)
+
+    runs = []
+    try:
+        buffer = []
+        buffer_size = 0
+        num_triples = 0
+        for num_shards, shard_path in enumerate(shard_paths, 1):
+            for line in iter_shard_lines(shard_path):
+                buffer.append(line)
+                buffer_size += len(line) + 40  # 40: approximate overhead of a bytes object
+                num_triples += 1
+                if buffer_size >= max_bytes:
+                    runs.append(write_run(buffer, run_folder))
+                    buffer = []
+                    buffer_size = 0
+            if logger is not None and num_shards % 100 == 0:
+                logger.info('read %s shards, %s triples, %s runs' % (num_shards,
+                                                                    num_triples,
+                                                                    len(runs)))
+        if buffer or not runs:
+            runs.append(write_run(buffer, run_folder))
+        del buffer
+
+        # merge in passes until the remaining runs can be opened at the same time
+        while len(runs) > max_open_runs:
+            merged_runs = []
+            for index in range(0, len(runs), max_open_runs):
+                group = runs[index:index + max_open_runs]
+                fd, path = tempfile.mkstemp(suffix='.run', dir=run_folder)
+                with os.fdopen(fd, 'wb') as outfile:
+                    merge_runs(group, outfile)
+                for run_path in group:
+                    os.remove(run_path)
+                merged_runs.append(path)
+            runs = merged_runs
+
+        part_path = '%s.part' % output_path
+        with open(part_path, 'wb') as outfile:
+            num_unique = merge_runs(runs, outfile)
+        os.replace(part_path, output_path)
+    finally:
+        for run_path in glob.glob(os.path.join(run_folder, '*')):
+            os.remove(run_path)
+        os.rmdir(run_folder)
+
+    duplicate_ratio = 0.0
+    if num_triples:
+        duplicate_ratio = (num_triples - num_unique) / num_triples
+    stats = merge_stats(num_shards=len(shard_paths),
+                        num_triples=num_triples,
+                        num_unique=num_unique,
+                        duplicate_ratio=duplicate_ratio)
+    if logger is not None:
+        logger.info('merged %s shards: %s triples, %s unique, duplicate ratio %.4f' % stats)
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Merge the RDF shards of a conversion into one sorted dump without duplicate triples.''')
+    parser.add_argument('-i', dest="input_folder", default='signalmedia_big_rdf', help="folder with the shards (.nt, .nq, .ttl, optionally .gz or .zst, or .sqlite)")
+    parser.add_argument('-o', dest="output_path", required=True, help="path to merged output (N-Triples, or N-Quads for .nq shards)")
+    parser.add_argument('-m', type=int, dest="max_mb", default=DEFAULT_MAX_BYTES // 2 ** 20, help="memory for sorting in MB")
+    parser.add_argument('--tmp', dest="tmp_folder", help="folder for temporary files, default is the folder of the output")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    stats = merge_shards(find_shards(args.input_folder),
+                         args.output_path,
+                         max_bytes=args.max_mb * 2 ** 20,
+                         tmp_folder=args.tmp_folder,
+                         logger=logging.getLogger(__name__))
+    print('shards: %s' % stats.num_shards)
+    print('triples: %s' % stats.num_triples)
+    print('unique triples: %s' % stats.num_unique)
+    print('duplicate ratio: %.4f' % stats.duplicate_ratio)
@@ -0,0 +1,279 @@
+"""
+per-stage timing and throughput of the conversion
+
+A Metrics object accumulates the wall-clock and CPU time of the stages of the
+conversion of a batch:
+
+* read: reading the jsonl lines
+* json_decode: json.loads of the lines
+* nlp: spaCy (with n_process > 1: waiting for the worker processes)
+* spacy_naf: building the spaCy NAF (only with path_spacy_nafs)
+* write_spacy_naf: writing the spaCy NAF
+* naf_read: reading the NewsReader NAF from the folder or archive
+* naf_parse: etree.parse of the NewsReader NAF
+* naf_wait: waiting for the NewsReader NAF read and parsed in a thread
+  (with prefetch_depth, instead of naf_read and naf_parse)
+* load_article: utils.load_article_into_newsitem_class
+* rdfize: utils.rdfize_news_item
+* serialize: closing the sink (g.serialize for Turtle, flushing the
+  stream for N-Triples/N-Quads)
+
+Stages can be nested; the time of a stage does not include the time of the
+stages inside it, so the stage times add up to (at most) the time of the batch.
+
+Per batch, Metrics.summary gives the stage times, articles/s, triples/s and
+the peak resident set size. On Linux the peak is reset at the start of the
+batch (see reset_peak_rss), elsewhere it is the peak of the process so far.
+MetricsFile appends the summaries of a run as json lines, followed by a
+line with the totals of the run (including the sums of the duplicate
+detection reports, see dedup.DuplicateDetector.report, if the summaries
+have them as dedup). The metrics of earlier runs to the same file, e.g.
+before a resumed run, are kept.
+
+profile_batch decides which batches are run under cProfile, so that the
+profiler can be enabled on a (deterministic) sample of the batches.
+"""
+import os
+import json
+import time
+import random
+import resource
+
+PROC_STATUS = '/proc/self/status'
+PROC_CLEAR_REFS = '/proc/self/clear_refs'
+
+
+def reset_peak_rss():
+    """
+    reset the peak resident set size of this process (VmHWM, Linux only)
+
+    :rtype: bool
+    :return: whether the peak could be reset
+    """
+    try:
+        with open(PROC_CLEAR_REFS, 'w') as outfile:
+            outfile.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """
+    :rtype: float
+    :return: peak resident set size of this process in MB, since the last
+    reset_peak_rss if it succeeded
+    """
+    try:
+        with open(PROC_STATUS) as infile:
+            for line in infile:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname().sysname == 'Darwin':
+        maxrss /= 1024
+    return maxrss / 1024
+
+
+def _stages_to_dict(stages):
+    return {name: {'calls': calls, 'wall': wall, 'cpu': cpu}
+            for name, (calls, wall, cpu) in sorted(stages.items())}
+
+
+def _add_to_stage(stages, name, wall, cpu, calls=1):
+    stage = stages.get(name)
+    if stage is None:
+        stage = stages[name] = [0, 0.0, 0.0]
+    stage[0] += calls
+    stage[1] += wall
+    stage[2] += cpu
+
+
+class _Stage:
+    """
+    context manager that adds the time spent in it to a stage of a Metrics object
+    """
+    __slots__ = ('metrics', 'name', 'wall', 'cpu')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics._nested.append([0.0, 0.0])
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        nested_wall, nested_cpu = self.metrics._nested.pop()
+        self.metrics.add(self.name, wall - nested_wall, cpu - nested_cpu)
+        if self.metrics._nested:
+            outer = self.metrics._nested[-1]
+            outer[0] += wall
+            outer[1] += cpu
+
+
+class Metrics:
+    """
+    wall-clock and CPU time per stage of the conversion of a batch
+    """
+    def __init__(self):
+        self.stages = {}  # name -> [calls, wall, cpu]
+        self._nested = []
+        self.peak_rss_reset = reset_peak_rss()
+        self.started_wall = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+    def stage(self, name):
+        """
+        :param str name: name of the stage
+
+        :return: context manager timing the code in it as stage name
+        """
+        return _Stage(self, name)
+
+    def add(self, name, wall, cpu, calls=1):
+        _add_to_stage(self.stages, name, wall, cpu, calls=calls)
+
+    def iter_timed(self, iterable, name):
+        """
+        create generator of the items of iterable, timing the production
+        of every item as stage name
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def summary(self, num_articles, num_triples, **info):
+        """
+        :param int num_articles: number of articles of the batch
+        :param int num_triples: number of triples of the batch
+        :param info: added to the summary (e.g. start and end of the batch)
+
+        :rtype: dict
+        :return: summary of the batch (json serializable)
+        """
+        wall = time.perf_counter() - self.started_wall
+        cpu = time.process_time() - self.started_cpu
+        record = dict(info)
+        record.update({'num_articles': num_articles,
+                       'num_triples': num_triples,
+                       'wall': wall,
+                       'cpu': cpu,
+                       'articles_per_s': num_articles / wall if wall else 0.0,
+                       'triples_per_s': num_triples / wall if wall else 0.0,
+                       'peak_rss_mb': peak_rss_mb(),
+                       'pid': os.getpid(),
+                       'stages': _stages_to_dict(self.stages)})
+        return record
+
+
+class _NoMetrics:
+    """
+    stand-in for Metrics that does not time anything
+    """
+    class _NoStage:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+    _no_stage = _NoStage()
+
+    def stage(self, name):
+        return self._no_stage
+
+    def add(self, name, wall, cpu, calls=1):
+        pass
+
+    def iter_timed(self, iterable, name):
+        return iterable
+
+
+NO_METRICS = _NoMetrics()
+
+
+class MetricsFile:
+    """
+    write the batch summaries of a run as json lines, followed on close by
+    a line {"run": {...}} with the totals of the run
+
+    The file is appended to, so the metrics of earlier runs (e.g. before a
+    resumed run) are kept; the totals of a run only cover the batches of
+    that run.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.outfile = open(path, 'a')
+        self.started = time.time()
+        self.num_articles = 0
+        self.num_triples = 0
+        self.num_batches = 0
+        self.max_peak_rss_mb = 0.0
+        self.stages = {}
+        self.dedup = {}
+
+    def write(self, record):
+        """
+        :param dict record: summary of a batch (see Metrics.summary)
+        """
+        self.outfile.write(json.dumps(record, sort_keys=True) + '\n')
+        self.outfile.flush()
+        self.num_batches += 1
+        self.num_articles += record['num_articles']
+        self.num_triples += record['num_triples']
+        self.max_peak_rss_mb = max(self.max_peak_rss_mb, record['peak_rss_mb'])
+        for name, stage in record['stages'].items():
+            _add_to_stage(self.stages, name, stage['wall'], stage['cpu'], calls=stage['calls'])
+        for name, value in record.get('dedup', {}).items():
+            self.dedup[name] = self.dedup.get(name, 0) + value
+
+    def close(self):
+        """
+        write the totals of the run and close the file
+
+        :rtype: dict
+        :return: totals of the run
+        """
+        wall = time.time() - self.started
+        run = {'num_batches': self.num_batches,
+               'num_articles': self.num_articles,
+               'num_triples': self.num_triples,
+               'wall': wall,
+               'articles_per_s': self.num_articles / wall if wall else 0.0,
+               'triples_per_s': self.num_triples / wall if wall else 0.0,
+               'max_peak_rss_mb': self.max_peak_rss_mb,
+               'stages': _stages_to_dict(self.stages)}
+        if self.dedup:
+            run['dedup'] = self.dedup
+        self.outfile.write(json.dumps({'run': run}, sort_keys=True) + '\n')
+        self.outfile.close()
+        return run
+
+
+def profile_batch(start, profile_rate):
+    """
+    decide whether the batch starting at line start is profiled
+
+    the decision only depends on start, so a rerun profiles the same batches
+
+    :param int start: start line of the batch
+    :param float profile_rate: fraction of the batches that is profiled
+
+    :rtype: bool
+    """
+    if profile_rate <= 0:
+        return False
+    return random.Random(start).random() < profile_rate
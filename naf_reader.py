@@ -0,0 +1,323 @@
+"""
+selective streaming reader of NewsReader NAF files
+
+The NewsReader NAFs are mostly made up of layers that the conversion does not
+use (constituency, coreferences, factualities, ...) and of externalRefs of the
+terms and predicates. parse_naf only keeps what
+utils.load_article_into_newsitem_class consumes, in a NAF tree with the
+same paths (nafHeader/fileDesc, text/wf, terms/term, entities/entity,
+srl/predicate, topics/topic).
+
+The NAF is read with etree.iterparse, from the (decompressed) file stream if
+a path is given. The elements of the top-level layers that are not consumed
+(see SKIPPED_LAYERS) are cleared as soon as they end, and their earlier
+siblings deleted, so such a layer never holds more than one element in
+memory; the layer itself is removed when it ends. The parts of terms and
+predicates that are not consumed are cleared as soon as they have been read.
+The peak memory therefore follows the consumed layers, not the size of the
+file.
+
+The NAFs can be stored in a folder (uncompressed or as .gz/.zst files), or in
+a zip or tar archive (see open_naf_store).
+"""
+import io
+import os
+import tarfile
+import zipfile
+from lxml import etree
+
+import compressed_io
+
+CONSUMED_LAYERS = {'nafHeader', 'text', 'terms', 'entities', 'srl', 'topics'}
+
+
+def _strip_term(term_el):
+    """
+    only keep the attributes of a term (the lemma is used)
+    """
+    del term_el[:]
+
+
+def _strip_predicate(predicate_el):
+    """
+    only keep the first span of a predicate
+    """
+    first_span_el = predicate_el.find('span')
+    del predicate_el[:]
+    if first_span_el is not None:
+        predicate_el.append(first_span_el)
+
+
+STRIP_FUNCTIONS = {'term': _strip_term,
+                   'predicate': _strip_predicate}
+
+
+# the layers that are not consumed and the elements they are made of;
+# iterparse only reports these (and the elements in STRIP_FUNCTIONS), as
+# an event for every element costs more than parsing it
+SKIPPED_LAYERS = {'raw': (),
+                  'constituency': ('tree',),
+                  'deps': ('dep',),
+                  'chunks': ('chunk',),
+                  'coreferences': ('coref',),
+                  'factualities': ('factuality',),
+                  'timeExpressions': ('timex3',),
+                  'temporalRelations': ('tlink', 'predicateAnchor'),
+                  'causalRelations': ('clink',),
+                  'markables': ('mark',),
+                  'opinions': ('opinion',),
+                  'attribution': ('statement',)}
+EVENT_TAGS = tuple(set(SKIPPED_LAYERS)
+                   .union(*SKIPPED_LAYERS.values())
+                   .union(STRIP_FUNCTIONS))
+
+
+def _clear(el):
+    """
+    clear an element of a layer that is not consumed, and delete its
+    earlier siblings (which have been cleared already)
+    """
+    el.clear()
+    parent = el.getparent()
+    while el.getprevious() is not None:
+        del parent[0]
+
+
+def iterparse_naf(infile, layers=CONSUMED_LAYERS):
+    """
+    parse a NAF, keeping only the top-level layers in layers
+
+    the elements of the layers in SKIPPED_LAYERS are cleared while the NAF
+    is parsed; other layers that are not in layers are removed when the
+    parsing is done
+
+    :param infile: file object opened in binary mode
+    :param set layers: names of the layers to keep
+
+    :rtype: lxml.etree._Element
+    :return: NAF root element with only the requested layers
+    """
+    context = etree.iterparse(infile, tag=EVENT_TAGS,
+                              remove_blank_text=True,
+                              remove_comments=True)
+    for _, el in context:
+        parent = el.getparent()
+        if parent is None:
+            continue
+        grandparent = parent.getparent()
+        if grandparent is None:
+            # a layer
+            if el.tag not in layers:
+                parent.remove(el)
+        elif grandparent.getparent() is None and parent.tag not in layers:
+            _clear(el)
+        elif parent.tag in layers:
+            strip = STRIP_FUNCTIONS.get(el.tag)
+            if strip is not None:
+                strip(el)
+
+    root = context.root
+    for el in list(root):
+        if el.tag not in layers:
+            root.remove(el)
+    return root
+
+
+def parse_naf(source):
+    """
+    parse the layers of a NAF file that the conversion consumes
+
+    :param source: path to (compressed) NAF file, file object opened in
+    binary mode or the NAF as bytes
+
+    :rtype: lxml.etree._ElementTree
+    :return: NAF tree containing only nafHeader, text/wf,
+    terms/term (without children), entities/entity, srl/predicate
+    (only the first span) and topics/topic
+    """
+    if isinstance(source, bytes):
+        root = iterparse_naf(io.BytesIO(source))
+    elif hasattr(source, 'read'):
+        root = iterparse_naf(source)
+    else:
+        with compressed_io.open_binary(source) as infile:
+            root = iterparse_naf(infile)
+    return etree.ElementTree(root)
+
+
+NAF_EXTENSIONS = ('.in.naf', '.in.naf.gz', '.in.naf.zst')
+
+
+def identifier_of(name):
+    """
+    :param str name: path or archive member name of a NAF
+
+    :rtype: str | None
+    :return: article id ({identifier}.in.naf[.gz|.zst]), None if name is not a NAF
+    """
+    basename = name.rsplit('/', 1)[-1]
+    for extension in NAF_EXTENSIONS:
+        if basename.endswith(extension):
+            return basename[:-len(extension)]
+    return None
+
+
+def _decompressed(name, data):
+    """
+    decompress the bytes of a .gz/.zst archive member
+    """
+    if compressed_io.compression_of(name) is None:
+        return data
+    with compressed_io.open_binary_fileobj(io.BytesIO(data), name) as infile:
+        return infile.read()
+
+
+class NafFolder:
+    """
+    NAFs in a folder: {identifier}.in.naf, .in.naf.gz or .in.naf.zst
+    """
+    # read can be called from several threads at the same time
+    thread_safe = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, identifier):
+        """
+        :param str identifier: article id
+
+        :rtype: bytes | None
+        :return: the (decompressed) NAF, None if there is none
+        """
+        for extension in NAF_EXTENSIONS:
+            try:
+                with compressed_io.open_binary(os.path.join(self.path, identifier + extension)) as infile:
+                    return infile.read()
+            except FileNotFoundError:
+                continue
+        return None
+
+    def identifiers(self):
+        return {identifier for identifier in map(identifier_of, os.listdir(self.path))
+                if identifier is not None}
+
+    def close(self):
+        pass
+
+
+class NafZip:
+    """
+    NAFs in a zip archive, read member by member
+    """
+    thread_safe = False
+
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path)
+        self.identifier2name = {}
+        for name in self.archive.namelist():
+            identifier = identifier_of(name)
+            if identifier is not None:
+                self.identifier2name[identifier] = name
+
+    def read(self, identifier):
+        name = self.identifier2name.get(identifier)
+        if name is None:
+            return None
+        return _decompressed(name, self.archive.read(name))
+
+    def identifiers(self):
+        return set(self.identifier2name)
+
+    def close(self):
+        self.archive.close()
+
+
+class NafTar:
+    """
+    NAFs in a tar archive, read member by member
+
+    An uncompressed tar is indexed when it is opened (only the member headers
+    are read), so its members are read in any order. A compressed tar
+    (.tar.gz, .tgz, .tar.zst) can only be read as a stream: the members are
+    read forwards, and a NAF that comes before the previous one restarts the
+    stream. This is efficient if the NAFs are requested in the order of the
+    archive (e.g. the archive was written in corpus order). Looking up an id
+    without a NAF reads the stream to its end once; pass ids_with_naf (see
+    corpus_index.CorpusMetadata) to avoid that.
+    """
+    thread_safe = False
+
+    def __init__(self, path):
+        self.path = path
+        self.streamed = compressed_io.compression_of(path) is not None
+        self.identifier2member = {}
+        self.all_identifiers = None
+        self.archive = None
+        self._passed = set()
+        if self.streamed:
+            self._restart()
+        else:
+            self.archive = tarfile.open(path, 'r:')
+            for member in self.archive.getmembers():
+                identifier = identifier_of(member.name)
+                if member.isfile() and identifier is not None:
+                    self.identifier2member[identifier] = member
+            self.all_identifiers = set(self.identifier2member)
+
+    def _restart(self):
+        if self.archive is not None:
+            self.archive.close()
+            self._fileobj.close()
+        self._fileobj = compressed_io.open_binary(self.path)
+        self.archive = tarfile.open(fileobj=self._fileobj, mode='r|')
+        self._passed = set()
+
+    def read(self, identifier):
+        if self.all_identifiers is not None and identifier not in self.all_identifiers:
+            return None
+        if not self.streamed:
+            member = self.identifier2member[identifier]
+            return _decompressed(member.name, self.archive.extractfile(member).read())
+
+        if identifier in self._passed:
+            self._restart()
+        while True:
+            member = self.archive.next()
+            if member is None:
+                # read to the end from the start: all ids are known now
+                self.all_identifiers = set(self._passed)
+                return None
+            member_identifier = identifier_of(member.name)
+            if not member.isfile() or member_identifier is None:
+                continue
+            self._passed.add(member_identifier)
+            if member_identifier == identifier:
+                return _decompressed(member.name, self.archive.extractfile(member).read())
+
+    def identifiers(self):
+        if self.all_identifiers is None:
+            self._restart()
+            self.read(None)  # reads the stream to its end, which sets all_identifiers
+        return set(self.all_identifiers)
+
+    def close(self):
+        self.archive.close()
+        if self.streamed:
+            self._fileobj.close()
+
+
+def open_naf_store(path):
+    """
+    open the NAFs at path
+
+    :param str path: folder, zip archive or (compressed) tar archive of NAFs
+
+    :rtype: NafFolder | NafZip | NafTar
+    :return: store with read(identifier) -> NAF bytes or None
+    """
+    if os.path.isdir(path):
+        return NafFolder(path)
+    if path.endswith('.zip'):
+        return NafZip(path)
+    return NafTar(path)
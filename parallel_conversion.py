@@ -0,0 +1,423 @@
+"""
+convert SignalMedia to RDF with a pool of worker processes
+
+The corpus is split into small work units (line ranges). The workers take the
+next unit from a shared queue as soon as they are done with the previous one,
+so ranges with heavy articles do not keep the other cores idle at the end of
+the run. The spaCy model is loaded once in this process and inherited by the
+forked workers (not at all with --newsreader-only).
+
+With --publisher, --from-date, --to-date or --has-naf, only the selected
+lines are converted. They are selected with the metadata index of the corpus
+(see corpus_index.build_metadata_index), without parsing the articles, and
+split into work units of unit_size selected lines.
+
+With --max-triples or --max-bytes, the output of a work unit is split into
+shards of about that size instead of one file per unit, listed with the
+lines of their first and last article in {start}_{end}.shards.json (see
+rdf_sinks.ShardedSink).
+
+With --dedup, the duplicates of the selected lines are found before the
+conversion (see dedup.find_duplicates, written to
+{output}/duplicates_{sha1}.tsv, see duplicates_path, and reused by --resume)
+and every duplicate is put in the work unit of its canonical article if it
+fits, so that its worker can reuse the spaCy annotation. These units are
+named after their lines (see dedup_work_units).
+"""
+import os
+import time
+import hashlib
+import argparse
+import multiprocessing
+
+import utils
+import corpus_index
+import conversion
+import rdf_sinks
+import manifest
+import metrics
+import dedup
+
+settings = {}
+# metadata index of the corpus (corpus_index.CorpusMetadata), set when lines
+# are selected; loaded before the workers are forked, which inherit it
+metadata = None
+# id -> dedup.duplicate of the duplicates found before the conversion, set
+# with --dedup and inherited by the workers like metadata
+known_duplicates = None
+
+def work_units(start_line, end_line, unit_size):
+    """
+    split line range into work units
+
+    :param int start_line: first line
+    :param int end_line: last line (inclusive)
+    :param int unit_size: number of lines per work unit
+
+    :rtype: list
+    :return: list of (start, end) with end inclusive
+    """
+    return [(start, min(start + unit_size - 1, end_line))
+            for start in range(start_line, end_line + 1, unit_size)]
+
+def selected_work_units(line_numbers, unit_size):
+    """
+    split selected lines into work units
+
+    :param list line_numbers: sorted line numbers
+    :param int unit_size: number of selected lines per work unit
+
+    :rtype: list
+    :return: list of (first line, last line, tuple of line numbers)
+    """
+    units = []
+    for index in range(0, len(line_numbers), unit_size):
+        chunk = tuple(line_numbers[index:index + unit_size])
+        units.append((chunk[0], chunk[-1], chunk))
+    return units
+
+def dedup_work_units(line_numbers, unit_size, duplicates):
+    """
+    split lines into work units of at most unit_size lines, with the
+    duplicates in the unit of their canonical article
+
+    the duplicates count toward unit_size: a canonical article and its
+    duplicates that do not fit in one unit are split over several units,
+    and the duplicates without their canonical article are annotated as
+    usual. A duplicate of which the canonical article is not in line_numbers
+    is a canonical article. The lines of a unit are not contiguous, so
+    the unit has a name (see unit_name).
+
+    :param list line_numbers: sorted line numbers
+    :param int unit_size: number of lines per work unit
+    :param dict duplicates: line number -> dedup.duplicate_line (see
+    dedup.find_duplicates)
+
+    :rtype: list
+    :return: list of (first line, last line, tuple of line numbers, name)
+    """
+    groups = {}  # line of canonical article -> its line and those of its duplicates
+    for line_number in line_numbers:
+        item = duplicates.get(line_number)
+        if item is not None and item.canonical_line in groups:
+            groups[item.canonical_line].append(line_number)
+        else:
+            groups[line_number] = [line_number]
+
+    unit_lines = [[]]
+    for group in groups.values():
+        for index in range(0, len(group), unit_size):
+            chunk = group[index:index + unit_size]
+            if len(unit_lines[-1]) + len(chunk) > unit_size:
+                unit_lines.append([])
+            unit_lines[-1].extend(chunk)
+
+    units = []
+    for lines in unit_lines:
+        if lines:
+            chunk = tuple(sorted(lines))
+            units.append((chunk[0], chunk[-1], chunk, unit_name(chunk)))
+    return units
+
+def unit_name(line_numbers):
+    """
+    :param tuple line_numbers: sorted lines of a work unit
+
+    :rtype: str
+    :return: {first line}_{last line}_{sha1 of the lines}, the name of the
+    manifest entry and output of the unit
+    """
+    digest = hashlib.sha1(','.join(map(str, line_numbers)).encode('ascii')).hexdigest()
+    return '%s_%s_%s' % (line_numbers[0], line_numbers[-1], digest[:10])
+
+def unit_key(unit):
+    """
+    :rtype: tuple | str
+    :return: key of the unit in the manifest (see manifest.load_manifest)
+    """
+    if len(unit) == 4:
+        return unit[3]
+    return unit[:2]
+
+def duplicates_path(output_folder, line_numbers, threshold, window):
+    """
+    :rtype: str
+    :return: {output_folder}/duplicates_{sha1}.tsv, with the sha1 of the
+    lines and settings of find_duplicates, so a run with another selection
+    does not reuse it
+    """
+    sha1 = hashlib.sha1(('%s %s ' % (threshold, window)).encode('ascii'))
+    sha1.update(','.join(map(str, line_numbers)).encode('ascii'))
+    return '%s/duplicates_%s.tsv' % (output_folder, sha1.hexdigest()[:10])
+
+def output_path_of_unit(output_folder, start, end, output_format, compression=None, name=None):
+    """
+    return path of the RDF output of a work unit
+
+    :rtype: str
+    :return: {output_folder}/{start}_{end}.{extension} or
+    {output_folder}/{name}.{extension}
+    """
+    return '%s/%s.%s' % (output_folder, name or '%s_%s' % (start, end),
+                         rdf_sinks.output_extension(output_format, compression))
+
+def _init_worker(the_settings):
+    settings.update(the_settings)
+
+def _convert_unit(unit):
+    """
+    convert one work unit in a worker process
+
+    :param tuple unit: (start, end), (start, end, line numbers) or (start,
+    end, line numbers, name)
+
+    :rtype: tuple
+    :return: (start, end, number of articles, number of triples, seconds,
+    metrics summary of the unit)
+    """
+    start, end = unit[:2]
+    line_numbers = None
+    if len(unit) >= 3:
+        line_numbers = unit[2]
+    name = None
+    if len(unit) == 4:
+        name = unit[3]
+    ids_with_naf = None
+    if metadata is not None:
+        ids_with_naf = metadata.ids_with_naf(line_numbers or range(start, end + 1))
+    started = time.time()
+    unit_metrics = metrics.Metrics()
+    profile_path = ''
+    if metrics.profile_batch(start, settings['profile_rate']):
+        profile_path = '%s/%s.prof' % (settings['profile_folder'], name or '%s_%s' % (start, end))
+    duplicates = None
+    if settings['deduplicate']:
+        duplicates = dedup.DuplicateDetector(threshold=settings['dedup_threshold'],
+                                             known=known_duplicates)
+    output_path = output_path_of_unit(settings['output_folder'], start, end,
+                                      settings['output_format'],
+                                      settings['compression'],
+                                      name=name)
+    num_articles, num_triples = conversion.convert_batch(
+        settings['path_signalmedia_json'],
+        start,
+        end,
+        output_path,
+        path_newsreader_nafs=settings['path_newsreader_nafs'],
+        path_line_index=settings['path_line_index'],
+        output_format=settings['output_format'],
+        nlp_batch_size=settings['nlp_batch_size'],
+        manifest_folder=settings['manifest_folder'],
+        path_annotation_cache=settings['path_annotation_cache'],
+        spacy_annotation=settings['spacy_annotation'],
+        line_numbers=line_numbers,
+        ids_with_naf=ids_with_naf,
+        compression=settings['compression'],
+        max_triples=settings['max_triples'],
+        max_bytes=settings['max_bytes'],
+        batch_metrics=unit_metrics,
+        profile_path=profile_path,
+        prefetch_depth=settings['prefetch_depth'],
+        n_threads=settings['n_threads'],
+        duplicates=duplicates,
+        batch_name=name)
+    info = {}
+    if duplicates is not None:
+        info['dedup'] = duplicates.report()
+    summary = unit_metrics.summary(num_articles, num_triples,
+                                   start=start, end=end,
+                                   profiled=bool(profile_path),
+                                   **info)
+    return start, end, num_articles, num_triples, time.time() - started, summary
+
+def run(units, the_settings, n_workers, logger, metrics_file=None):
+    """
+    convert work units with a pool of n_workers processes
+
+    :param list units: list of (start, end), (start, end, line numbers) or
+    (start, end, line numbers, name)
+    :param dict the_settings: arguments of conversion.convert_batch shared by all units
+    :param int n_workers: number of worker processes
+    :param logging.Logger logger: logger for the progress
+    :param metrics.MetricsFile metrics_file: if provided, the metrics of
+    every unit are written to it
+
+    :rtype: tuple
+    :return: (number of articles, number of triples)
+    """
+    total_articles = 0
+    total_triples = 0
+    started = time.time()
+    with multiprocessing.get_context('fork').Pool(n_workers,
+                                                  initializer=_init_worker,
+                                                  initargs=(the_settings,)) as pool:
+        # chunksize 1: every worker asks for the next unit when it is done
+        results = pool.imap_unordered(_convert_unit, units, chunksize=1)
+        for num_done, (start, end, num_articles, num_triples, seconds, summary) in enumerate(results, 1):
+            if metrics_file is not None:
+                metrics_file.write(summary)
+            total_articles += num_articles
+            total_triples += num_triples
+            elapsed = time.time() - started
+            logger.info('unit %s_%s: %s articles, %s triples in %.1fs, peak rss %.0f MB | '
+                        'done %s/%s units, %s articles (%.1f articles/s, %.0f triples/s)' % (
+                        start, end, num_articles, num_triples, seconds, summary['peak_rss_mb'],
+                        num_done, len(units), total_articles,
+                        total_articles / elapsed, total_triples / elapsed))
+    return total_articles, total_triples
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Convert SignalMedia to RDF with a pool of processes.''')
+    parser.add_argument('-f', type=int, dest="start_line", default=1, help="convert from line number")
+    parser.add_argument('-t', type=int, dest="end_line", help="convert till line number (inclusive), default is last line")
+    parser.add_argument('-u', type=int, dest="unit_size", default=100, help="number of articles per work unit (and output file)")
+    parser.add_argument('-w', type=int, dest="n_workers", default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('-b', type=int, dest="nlp_batch_size", default=100, help="number of articles per spaCy nlp.pipe batch")
+    parser.add_argument('-o', dest="output_format", default='turtle', choices=sorted(rdf_sinks.FORMAT2EXTENSION),
+                        help="output format: turtle (in-memory graph), nt/nquads (streamed) or sqlite (see triple_store.py)")
+    parser.add_argument('--jsonl', dest="path_signalmedia_json", default='signalmedia-1m.jsonl', help="path to signalmedia jsonl")
+    parser.add_argument('--nafs', dest="path_newsreader_nafs", default='naf', help="path to folder with NewsReader NAFs")
+    parser.add_argument('--output', dest="output_folder", default='signalmedia_big_rdf', help="output folder")
+    parser.add_argument('--logs', dest="log_folder", default='logs', help="log folder")
+    parser.add_argument('--cache', dest="path_annotation_cache", default='', help="path to the spaCy annotation cache (sqlite)")
+    parser.add_argument('--newsreader-only', dest="newsreader_only", action='store_true',
+                        help="only convert the NewsReader NAFs, without loading spaCy")
+    parser.add_argument('--resume', action='store_true', help="skip the units that are complete according to the manifest")
+    parser.add_argument('--verify', action='store_true', help="with --resume, verify the checksums of the complete units")
+    parser.add_argument('--publisher', dest="publishers", action='append',
+                        help="only convert articles of this source (can be repeated)")
+    parser.add_argument('--from-date', dest="from_date", help="only convert articles published at or after this date (2015-09-01)")
+    parser.add_argument('--to-date', dest="to_date", help="only convert articles published at or before this date (2015-09-30)")
+    parser.add_argument('--has-naf', dest="has_naf", action='store_true', help="only convert articles with a NewsReader NAF")
+    parser.add_argument('--metadata', dest="path_metadata",
+                        help="path to metadata index used for the selection (default: <jsonl>.meta, built if it does not exist)")
+    parser.add_argument('--compress', dest="compression", choices=sorted(rdf_sinks.COMPRESSION2EXTENSION),
+                        help="compress the output (not for sqlite)")
+    parser.add_argument('--max-triples', type=int, dest="max_triples",
+                        help="start a new shard when the current one has this many triples")
+    parser.add_argument('--max-bytes', type=int, dest="max_bytes",
+                        help="start a new shard when the current one has this many (uncompressed) bytes (nt and nquads)")
+    parser.add_argument('--metrics', dest="path_metrics",
+                        help="path to the metrics of the run (json lines, see metrics.py), default: <logs>/metrics.jsonl")
+    parser.add_argument('--profile-rate', type=float, dest="profile_rate", default=0.0,
+                        help="fraction of the units that is run under cProfile (<logs>/profiles/{start}_{end}.prof)")
+    parser.add_argument('--prefetch', type=int, dest="prefetch_depth", default=0,
+                        help="in every worker, read the jsonl and the NAFs in threads, this many articles ahead (0: no threads)")
+    parser.add_argument('--threads', type=int, dest="n_threads", default=2, help="number of threads per worker parsing the NAFs with --prefetch")
+    parser.add_argument('--dedup', dest="deduplicate", action='store_true',
+                        help="reuse the spaCy annotation of exact and near duplicates and link them to the first copy (see dedup.py)")
+    parser.add_argument('--dedup-threshold', type=float, dest="dedup_threshold", default=dedup.DEFAULT_THRESHOLD,
+                        help="minimum estimated similarity of near duplicates")
+    parser.add_argument('--dedup-window', type=int, dest="dedup_window", default=dedup.DEFAULT_WINDOW,
+                        help="number of canonical articles that the duplicates are compared with")
+
+    args = parser.parse_args()
+    if args.max_bytes is not None and args.output_format not in {'nt', 'nquads'}:
+        parser.error('--max-bytes is only supported for nt and nquads output')
+    if args.compression is not None and args.output_format == 'sqlite':
+        parser.error('sqlite output can not be compressed')
+
+    for folder in [args.output_folder, args.log_folder]:
+        os.makedirs(folder, exist_ok=True)
+
+    path_line_index = corpus_index.default_index_path(args.path_signalmedia_json)
+    if not os.path.exists(path_line_index):
+        corpus_index.build_line_index(args.path_signalmedia_json, path_line_index)
+
+    end_line = args.end_line
+    if end_line is None:
+        with corpus_index.LineIndex(path_line_index) as line_index:
+            end_line = len(line_index)
+
+    the_settings = {'path_signalmedia_json': args.path_signalmedia_json,
+                    'path_newsreader_nafs': args.path_newsreader_nafs,
+                    'path_line_index': path_line_index,
+                    'output_folder': args.output_folder,
+                    'output_format': args.output_format,
+                    'nlp_batch_size': args.nlp_batch_size,
+                    'manifest_folder': '%s/manifest' % args.output_folder,
+                    'path_annotation_cache': args.path_annotation_cache,
+                    'spacy_annotation': not args.newsreader_only,
+                    'compression': args.compression,
+                    'max_triples': args.max_triples,
+                    'max_bytes': args.max_bytes,
+                    'profile_rate': args.profile_rate,
+                    'profile_folder': '%s/profiles' % args.log_folder,
+                    'prefetch_depth': args.prefetch_depth,
+                    'n_threads': args.n_threads,
+                    'deduplicate': args.deduplicate,
+                    'dedup_threshold': args.dedup_threshold}
+    if args.profile_rate > 0:
+        os.makedirs(the_settings['profile_folder'], exist_ok=True)
+
+    logger = utils.start_logger('%s/parallel_conversion.log' % args.log_folder)
+    if args.publishers or args.from_date or args.to_date or args.has_naf:
+        path_metadata = args.path_metadata or corpus_index.default_metadata_path(args.path_signalmedia_json)
+        if not os.path.exists(path_metadata):
+            corpus_index.build_metadata_index(args.path_signalmedia_json,
+                                              args.path_newsreader_nafs,
+                                              path_metadata)
+        metadata = corpus_index.CorpusMetadata(path_metadata)
+        line_numbers = metadata.select(start=args.start_line,
+                                       end=end_line,
+                                       publishers=set(args.publishers) if args.publishers else None,
+                                       from_date=args.from_date,
+                                       to_date=args.to_date,
+                                       has_naf=True if args.has_naf else None)
+        logger.info('selected %s lines' % len(line_numbers))
+        units = selected_work_units(line_numbers, args.unit_size)
+    else:
+        line_numbers = None
+        units = work_units(args.start_line, end_line, args.unit_size)
+    if args.deduplicate:
+        lines = line_numbers
+        if lines is None:
+            lines = range(args.start_line, end_line + 1)
+        path_duplicates = duplicates_path(args.output_folder, lines,
+                                          args.dedup_threshold, args.dedup_window)
+        if args.resume and os.path.exists(path_duplicates):
+            # the duplicates of the interrupted run with the same selection
+            duplicates = dedup.load_duplicates(path_duplicates)
+        else:
+            started = time.time()
+            duplicates = dedup.find_duplicates(utils.iter_article_lines(args.path_signalmedia_json,
+                                                                        start=args.start_line,
+                                                                        end=end_line,
+                                                                        path_line_index=path_line_index,
+                                                                        line_numbers=line_numbers,
+                                                                        with_line_numbers=True),
+                                               threshold=args.dedup_threshold,
+                                               max_canonicals=args.dedup_window,
+                                               n_process=args.n_workers)
+            dedup.write_duplicates(path_duplicates, duplicates)
+            logger.info('found %s duplicates in %.1fs' % (len(duplicates), time.time() - started))
+        units = dedup_work_units(lines, args.unit_size, duplicates)
+        selected = set(lines)
+        known_duplicates = {item.identifier: item.match for item in duplicates.values()
+                            if item.canonical_line in selected}
+    if args.resume:
+        finished_units = manifest.load_manifest(the_settings['manifest_folder'])
+        num_units = len(units)
+        units = [unit for unit in units
+                 if not manifest.is_complete(finished_units.get(unit_key(unit)),
+                                             verify_checksum=args.verify)]
+        logger.info('resuming: %s of %s units are complete' % (num_units - len(units),
+                                                                num_units))
+    logger.info('converting lines %s-%s in %s units with %s workers' % (
+                args.start_line, end_line, len(units), args.n_workers))
+
+    if the_settings['spacy_annotation']:
+        # loaded once here, the forked workers inherit it
+        utils.get_nlp()
+
+    metrics_file = metrics.MetricsFile(args.path_metrics or '%s/metrics.jsonl' % args.log_folder)
+    total_articles, total_triples = run(units, the_settings, args.n_workers, logger,
+                                        metrics_file=metrics_file)
+    run_metrics = metrics_file.close()
+    logger.info('finished: %s articles, %s triples' % (total_articles, total_triples))
+    for name, stage in sorted(run_metrics['stages'].items(), key=lambda item: -item[1]['wall']):
+        logger.info('stage %s: %.1fs wall, %.1fs cpu, %s calls' % (name, stage['wall'],
+                                                                 stage['cpu'], stage['calls']))
+    if 'dedup' in run_metrics:
+        logger.info('duplicates: %(exact)s exact, %(near)s near, %(reused)s annotations reused, '
+                    'about %(nlp_seconds_saved).1fs of spaCy saved' % run_metrics['dedup'])
@@ -0,0 +1,143 @@
+"""
+bounded prefetching with threads, in input order
+
+utils.process_first_x_files uses these to overlap the reading of the jsonl
+and the NewsReader NAFs with the CPU work of the conversion:
+
+* iter_prefetched runs a generator (e.g. reading and decoding the jsonl
+  lines) in a reader thread, at most depth items ahead of the consumer
+* OrderedPrefetcher runs a function (e.g. reading and parsing a NAF) on
+  keys in a pool of threads, at most depth keys ahead of the consumer, and
+  returns the results in the order in which the keys were added. lxml
+  releases the GIL while it parses, so the NAFs are parsed while the main
+  thread runs spaCy or builds the RDF.
+
+The memory that is used ahead of the consumer is bounded by depth items.
+Exceptions are raised in the consumer, at the position of the item that
+failed.
+"""
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_END = object()
+
+
+class _Failure:
+    __slots__ = ('exception',)
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def iter_prefetched(iterable, depth):
+    """
+    create generator of the items of iterable, produced in a reader thread
+
+    :param iterable iterable: e.g. a generator of lines
+    :param int depth: maximum number of items produced ahead of the consumer
+
+    :rtype: generator
+    :return: generator of the items of iterable, in order
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        # gives up when the consumer stopped
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as exception:
+            put(_Failure(exception))
+            return
+        put(_END)
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                break
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class OrderedPrefetcher:
+    """
+    call function on keys in a thread pool, at most depth keys ahead of the
+    consumer, and return the results in the order of the keys
+
+    Keys can be added further ahead than depth (e.g. a batch for spaCy);
+    they are then only submitted when the consumer catches up.
+    """
+    def __init__(self, function, n_threads=2, depth=8):
+        """
+        :param function: function of one key
+        :param int n_threads: number of threads
+        :param int depth: maximum number of results computed ahead of the consumer
+        """
+        self.function = function
+        self.depth = max(depth, 1)
+        self.executor = ThreadPoolExecutor(max_workers=max(n_threads, 1),
+                                           thread_name_prefix='prefetch')
+        self.pending = deque()  # [key, future or None] in order
+        self.num_submitted = 0
+
+    def _top_up(self):
+        if self.num_submitted >= self.depth:
+            return
+        for entry in self.pending:
+            if entry[1] is None:
+                entry[1] = self.executor.submit(self.function, entry[0])
+                self.num_submitted += 1
+                if self.num_submitted >= self.depth:
+                    return
+
+    def add(self, key):
+        """
+        :param key: argument of function
+        """
+        self.pending.append([key, None])
+        self._top_up()
+
+    def next(self):
+        """
+        :return: result of function for the oldest key that was added
+        """
+        key, future = self.pending.popleft()
+        if future is None:
+            result = self.function(key)
+        else:
+            self.num_submitted -= 1
+            try:
+                result = future.result()
+            finally:
+                self._top_up()
+        return result
+
+    def close(self):
+        self.pending.clear()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,340 @@
+"""
+output sinks for utils.rdfize_news_item
+
+A sink is anything with an add((subject, predicate, object)) method, so an
+rdflib Graph can be used directly. The sinks in this module add a close()
+that writes the output:
+
+* GraphSink collects the triples in an rdflib Graph and serializes it on close
+  (e.g. to Turtle). Memory grows with the number of triples.
+* NTriplesSink writes every triple as an N-Triples line (or N-Quads line if a
+  graph name is given) as soon as it is added. Memory is constant, but triples
+  that are added more than once are written more than once.
+* triple_store.SQLiteStore adds the triples to an SQLite database with
+  indexes for looking up mentions by offsets and entities.
+* ShardedSink writes to a new shard (GraphSink or NTriplesSink) when the
+  current one exceeds a triple or size budget, and lists the shards with the
+  lines of their first and last article in a shard manifest.
+
+The Turtle and N-Triples/N-Quads output can be compressed on the fly
+(gzip or zstd).
+"""
+import io
+import os
+import glob
+import gzip
+import json
+
+from rdflib import Graph, Literal
+
+import manifest
+
+ESCAPES = str.maketrans({'\\': '\\\\',
+                         '"': '\\"',
+                         '\n': '\\n',
+                         '\r': '\\r'})
+
+FORMAT2EXTENSION = {'turtle': 'ttl',
+                    'nt': 'nt',
+                    'nquads': 'nq',
+                    'sqlite': 'sqlite'}
+
+COMPRESSION2EXTENSION = {'gzip': 'gz',
+                         'zstd': 'zst'}
+
+
+def output_extension(format, compression=None):
+    """
+    :param str format: turtle | nt | nquads | sqlite
+    :param str compression: gzip | zstd | None
+
+    :rtype: str
+    :return: extension of the output, e.g. nt.gz
+    """
+    extension = FORMAT2EXTENSION[format]
+    if compression is not None:
+        extension = '%s.%s' % (extension, COMPRESSION2EXTENSION[compression])
+    return extension
+
+
+def format_of_path(path):
+    """
+    inverse of output_extension
+
+    :param str path: path to output file
+
+    :rtype: tuple
+    :return: (format, compression), format is None if path is not an output file
+    """
+    parts = os.path.basename(path).split('.')
+    compression = None
+    for a_compression, extension in COMPRESSION2EXTENSION.items():
+        if len(parts) > 2 and parts[-1] == extension:
+            compression = a_compression
+            parts = parts[:-1]
+    for format, extension in FORMAT2EXTENSION.items():
+        if len(parts) > 1 and parts[-1] == extension:
+            if format == 'sqlite' and compression is not None:
+                break
+            return format, compression
+    return None, None
+
+
+def open_output(destination, compression=None, append=False):
+    """
+    open a text file for writing, compressed if compression is provided
+
+    :param str destination: path to output file
+    :param str compression: gzip | zstd | None
+    :param bool append: if True, the output is appended to an existing file
+    (compressed output as a new gzip member or zstd frame)
+
+    :return: text file object
+    """
+    mode = 'a' if append else 'w'
+    if compression is None:
+        return open(destination, mode, encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(destination, mode + 't', encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd output requires the zstandard package')
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(destination, mode + 'b')),
+                                encoding='utf-8')
+    raise ValueError('unknown compression: %s' % compression)
+
+
+def nt_term(term):
+    """
+    return N-Triples representation of an rdflib term
+
+    (term.n3() is not used, since it writes multi-line literals with
+    triple quotes, which N-Triples does not allow)
+
+    :param term: rdflib.URIRef | rdflib.Literal | rdflib.BNode
+
+    :rtype: str
+    :return: N-Triples representation of term
+    """
+    if isinstance(term, Literal):
+        lexical = '"%s"' % str(term).translate(ESCAPES)
+        if term.language:
+            return '%s@%s' % (lexical, term.language)
+        if term.datatype:
+            return '%s^^<%s>' % (lexical, term.datatype)
+        return lexical
+    return term.n3()
+
+
+class GraphSink:
+    """
+    collect triples in an rdflib Graph, serialize it on close
+    """
+    def __init__(self, destination, format='turtle', compression=None):
+        self.destination = destination
+        self.format = format
+        self.compression = compression
+        self.graph = Graph()
+        self.num_added = 0
+
+    def add(self, triple):
+        self.graph.add(triple)
+        self.num_added += 1
+
+    def close(self):
+        if self.compression is None:
+            self.graph.serialize(destination=self.destination, format=self.format)
+            return
+        with open_output(self.destination, self.compression) as outfile:
+            outfile.write(self.graph.serialize(format=self.format))
+
+
+class NTriplesSink:
+    """
+    write triples as N-Triples (or N-Quads if graph_name is provided)
+    lines as they are added
+    """
+    def __init__(self, destination, graph_name=None, compression=None, append=False):
+        self.destination = destination
+        self.outfile = open_output(destination, compression, append=append)
+        if graph_name is None:
+            self.line_end = ' .\n'
+        else:
+            self.line_end = ' %s .\n' % nt_term(graph_name)
+        self.num_added = 0
+        self.num_bytes = 0  # uncompressed size of the output
+
+    def add(self, triple):
+        subject, predicate, obj = triple
+        line = '%s %s %s%s' % (nt_term(subject),
+                               nt_term(predicate),
+                               nt_term(obj),
+                               self.line_end)
+        self.outfile.write(line)
+        self.num_added += 1
+        # the output is utf-8; isascii is a flag lookup, encode is only
+        # needed for the lines with non-ASCII literals
+        self.num_bytes += len(line) if line.isascii() else len(line.encode('utf-8'))
+
+    def flush(self):
+        self.outfile.flush()
+
+    def close(self):
+        self.outfile.close()
+
+
+class ShardedSink:
+    """
+    write triples to shards, starting a new shard at the start of an article
+    when the current shard has reached max_triples triples or max_bytes
+    bytes (uncompressed utf-8, only for nt and nquads)
+
+    The shards of output_path {folder}/{name}.{extension} are
+    {folder}/{name}.{number}.{extension}. On close, the shard manifest
+    {folder}/{name}.shards.json lists per shard its path, the jsonl line
+    numbers of its first and last article, the ids of those articles, the
+    number of articles, triples and bytes (of the shard file) and the sha1
+    of the shard file.
+    """
+    def __init__(self, output_path, format='nt', graph_name=None, compression=None,
+                 max_triples=None, max_bytes=None):
+        if max_bytes is not None and format not in {'nt', 'nquads'}:
+            raise ValueError('a size budget is only supported for nt and nquads output')
+        if format == 'sqlite':
+            raise ValueError('sqlite output can not be sharded')
+        folder, basename = os.path.split(output_path)
+        self.name = basename.split('.', 1)[0]
+        self.folder = folder
+        self.format = format
+        self.graph_name = graph_name
+        self.compression = compression
+        self.max_triples = max_triples
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(folder, '%s.shards.json' % self.name)
+        self.shards = []
+        self.sink = None
+        self.num_added = 0
+
+    def shard_path(self, number):
+        return os.path.join(self.folder, '%s.%04d.%s' % (self.name, number,
+                                                         output_extension(self.format,
+                                                                          self.compression)))
+
+    def _full(self):
+        if self.max_triples is not None and self.sink.num_added >= self.max_triples:
+            return True
+        return self.max_bytes is not None and self.sink.num_bytes >= self.max_bytes
+
+    def _close_shard(self):
+        if self.sink is None:
+            return
+        self.sink.close()
+        shard = self.shards[-1]
+        os.replace(self.sink.destination, shard['path'])
+        shard['num_triples'] = self.sink.num_added
+        shard['size'] = os.path.getsize(shard['path'])
+        shard['sha1'] = manifest.checksum(shard['path'])
+        self.sink = None
+
+    def start_article(self, identifier, line_number=None):
+        """
+        to be called before the triples of an article are added
+
+        :param str identifier: article id
+        :param int line_number: line of the article in the jsonl
+        """
+        if self.sink is not None and self._full():
+            self._close_shard()
+        if self.sink is None:
+            path = self.shard_path(len(self.shards) + 1)
+            self.sink = open_sink('%s.part' % path, format=self.format,
+                                  graph_name=self.graph_name,
+                                  compression=self.compression)
+            self.shards.append({'path': path,
+                                'first_line': line_number,
+                                'last_line': line_number,
+                                'first_id': identifier,
+                                'last_id': identifier,
+                                'num_articles': 0})
+        shard = self.shards[-1]
+        shard['last_line'] = line_number
+        shard['last_id'] = identifier
+        shard['num_articles'] += 1
+
+    def add(self, triple):
+        if self.sink is None:
+            self.start_article(None)
+        self.sink.add(triple)
+        self.num_added += 1
+
+    def close(self):
+        """
+        close the last shard and write the shard manifest
+        """
+        self._close_shard()
+        manifest.atomic_write(self.manifest_path,
+                              json.dumps({'shards': self.shards}, indent=1).encode('utf-8'))
+
+
+def load_shard_manifest(manifest_path):
+    """
+    :param str manifest_path: path to shard manifest written by ShardedSink
+
+    :rtype: list
+    :return: list of dicts with path, first_line, last_line, first_id,
+    last_id, num_articles, num_triples, size and sha1
+    """
+    with open(manifest_path) as infile:
+        return json.load(infile)['shards']
+
+
+def remove_partial_output(output_path):
+    """
+    remove what an unfinished conversion to output_path left behind: the
+    .part file of the output, and the shards and .part files of its shards
+    (see ShardedSink)
+
+    :param str output_path: path to the output of a batch
+
+    :rtype: list
+    :return: paths removed
+    """
+    folder, basename = os.path.split(output_path)
+    name, extension = basename.split('.', 1)
+    # .part* includes the journal of an SQLite output
+    paths = glob.glob(glob.escape(output_path) + '.part*')
+    paths.extend(glob.glob(os.path.join(glob.escape(folder),
+                                        '%s.[0-9][0-9][0-9][0-9].%s' % (glob.escape(name), extension))))
+    paths.extend(glob.glob(os.path.join(glob.escape(folder),
+                                        '%s.[0-9][0-9][0-9][0-9].%s.part' % (glob.escape(name), extension))))
+    for path in paths:
+        os.remove(path)
+    return paths
+
+
+def open_sink(destination, format='turtle', graph_name=None, compression=None):
+    """
+    create sink for format
+
+    :param str destination: path to output file
+    :param str format: turtle | nt | nquads | sqlite
+    :param rdflib.URIRef graph_name: name of the graph (only used for nquads)
+    :param str compression: gzip | zstd | None (not for sqlite)
+
+    :rtype: GraphSink | NTriplesSink | triple_store.SQLiteStore
+    :return: sink
+    """
+    if format == 'sqlite':
+        if compression is not None:
+            raise ValueError('sqlite output can not be compressed')
+        import triple_store
+        return triple_store.SQLiteStore(destination)
+    if format == 'nt':
+        return NTriplesSink(destination, compression=compression)
+    if format == 'nquads':
+        if graph_name is None:
+            raise ValueError('nquads output requires a graph name')
+        return NTriplesSink(destination, graph_name=graph_name, compression=compression)
+    return GraphSink(destination, format=format, compression=compression)
@@ -0,0 +1,140 @@
+"""
+scaling benchmark of the conversion on synthetic corpora
+
+For every corpus size (default 1k, 10k and 100k articles), a synthetic corpus
+is generated with synthetic_corpus.py (kept in the work folder, so reruns
+only convert) and converted with parallel_conversion.py in a separate
+process. The throughput and the peak memory are taken from the metrics of
+the run (see metrics.py), the peak memory of the whole conversion (the
+parent process and all its workers) from the resource usage of the child
+processes.
+
+The result is one point per size: articles/s, triples/s and peak memory,
+printed as a table and optionally written as json.
+"""
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import subprocess
+
+import synthetic_corpus
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def read_run_metrics(path_metrics):
+    """
+    :param str path_metrics: metrics file of a run (see metrics.MetricsFile)
+
+    :rtype: dict
+    :return: totals of the (last) run
+    """
+    run = None
+    with open(path_metrics) as infile:
+        for line in infile:
+            record = json.loads(line)
+            if 'run' in record:
+                run = record['run']
+    if run is None:
+        raise ValueError('%s has no totals, the run did not finish' % path_metrics)
+    return run
+
+
+def children_peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        maxrss /= 1024
+    return maxrss / 1024
+
+
+def benchmark_size(num_articles, work_folder, n_workers=1, unit_size=1000,
+                   output_format='nt', naf_ratio=0.25, newsreader_only=False, seed=0):
+    """
+    generate (if needed) and convert a synthetic corpus of num_articles articles
+
+    :rtype: dict
+    :return: point of the scaling curve
+    """
+    folder = os.path.join(work_folder, str(num_articles))
+    path_jsonl = os.path.join(folder, 'corpus.jsonl')
+    path_nafs = os.path.join(folder, 'naf')
+    if not os.path.exists(path_jsonl):
+        os.makedirs(folder, exist_ok=True)
+        stats = synthetic_corpus.generate_corpus(num_articles,
+                                                 path_jsonl + '.part',
+                                                 path_nafs=path_nafs,
+                                                 naf_ratio=naf_ratio,
+                                                 compress_nafs=True,
+                                                 seed=seed)
+        os.replace(path_jsonl + '.part', path_jsonl)
+        print('generated %s articles, %s NAFs in %s' % (stats.num_articles, stats.num_nafs, folder))
+
+    output_folder = os.path.join(folder, 'rdf_%s' % time.strftime('%Y%m%d%H%M%S'))
+    log_folder = os.path.join(output_folder, 'logs')
+    path_metrics = os.path.join(log_folder, 'metrics.jsonl')
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parallel_conversion.py'),
+               '--jsonl', path_jsonl,
+               '--nafs', path_nafs,
+               '--output', output_folder,
+               '--logs', log_folder,
+               '--metrics', path_metrics,
+               '-o', output_format,
+               '-u', str(unit_size),
+               '-w', str(n_workers)]
+    if newsreader_only:
+        command.append('--newsreader-only')
+
+    started = time.time()
+    subprocess.run(command, check=True)
+    wall = time.time() - started
+    run = read_run_metrics(path_metrics)
+    return {'num_articles': num_articles,
+            'num_converted': run['num_articles'],
+            'num_triples': run['num_triples'],
+            'wall': wall,
+            'articles_per_s': run['num_articles'] / wall if wall else 0.0,
+            'triples_per_s': run['num_triples'] / wall if wall else 0.0,
+            'worker_peak_rss_mb': run['max_peak_rss_mb'],
+            # maximum over all child processes so far, hence the sizes are
+            # run from small to large
+            'peak_rss_mb': children_peak_rss_mb(),
+            'stages': run['stages']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Convert synthetic corpora of increasing size and report throughput and peak memory.''')
+    parser.add_argument('-s', type=int, dest="sizes", nargs='+', default=DEFAULT_SIZES, help="corpus sizes (number of articles)")
+    parser.add_argument('-d', dest="work_folder", default='scaling', help="folder for the corpora and the output")
+    parser.add_argument('-w', type=int, dest="n_workers", default=1, help="number of worker processes of the conversion")
+    parser.add_argument('-u', type=int, dest="unit_size", default=1000, help="number of articles per work unit")
+    parser.add_argument('-o', dest="output_format", default='nt', help="output format of the conversion")
+    parser.add_argument('--naf-ratio', type=float, dest="naf_ratio", default=0.25, help="fraction of the articles with a NAF")
+    parser.add_argument('--newsreader-only', dest="newsreader_only", action='store_true',
+                        help="only convert the articles with a NAF, without loading spaCy")
+    parser.add_argument('--json', dest="path_json", help="if provided, the points are written to this path")
+
+    args = parser.parse_args()
+
+    points = []
+    for num_articles in sorted(args.sizes):
+        points.append(benchmark_size(num_articles, args.work_folder,
+                                     n_workers=args.n_workers,
+                                     unit_size=args.unit_size,
+                                     output_format=args.output_format,
+                                     naf_ratio=args.naf_ratio,
+                                     newsreader_only=args.newsreader_only))
+
+    print('%10s %10s %10s %9s %12s %12s %14s %12s' % ('articles', 'converted', 'triples', 'seconds',
+                                                    'articles/s', 'triples/s', 'worker MB', 'peak MB'))
+    for point in points:
+        print('%10d %10d %10d %9.1f %12.1f %12.0f %14.0f %12.0f' % (
+              point['num_articles'], point['num_converted'], point['num_triples'], point['wall'],
+              point['articles_per_s'], point['triples_per_s'],
+              point['worker_peak_rss_mb'], point['peak_rss_mb']))
+    if args.path_json:
+        with open(args.path_json, 'w') as outfile:
+            json.dump(points, outfile, indent=1)
@@ -1,51 +1,93 @@
-class EntityMention:
+from collections import namedtuple
+
+
+class _Mention:
+    """
+    value equality for the mention classes: a mention only equals a mention
+    of the same class with the same values, not a plain tuple or a mention of
+    another class (so they do not collide as set members or dict keys)
+    """
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(other) is type(self) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((type(self).__name__, tuple.__hash__(self)))
+
+
+class EntityMention(_Mention, namedtuple('EntityMention', ['sentence', 'mention',
+                                                 'the_type',
+                                                 'begin_index', 'end_index',
+                                                 'provenance',
+                                                 'meaning'],
+                               defaults=(None,))):
     """
     class containing information about an entity mention
+
+    sentence     e.g. 4 -> which sentence is the entity mentioned in
+    mention      e.g. "John Smith" -> the mention of an entity as found in text
+    the_type     e.g. "Person" | "http://dbpedia.org/ontology/Person"
+    begin_index  e.g. 15 -> begin offset
+    end_index    e.g. 25 -> end offset
+    provenance   e.g. "newsreader" | "spacy"
+    meaning      e.g. "http://dbpedia.org/resource/John_Smith" | empty if the data has no entity disambiguation layer
+
+    Mentions are immutable and compared (and hashed) by value, so adding a
+    mention to a set twice only stores it once.
     """
-    def __init__(self, sentence, mention,
-                 the_type, 
-                 begin_index, end_index,
-                 provenance,
-                 meaning=None):
-        self.sentence = sentence         # e.g. 4 -> which sentence is the entity mentioned in
-        self.mention = mention           # e.g. "John Smith" -> the mention of an entity as found in text
-        self.the_type = the_type         # e.g. "Person" | "http://dbpedia.org/ontology/Person"
-        self.meaning = meaning           # e.g. "http://dbpedia.org/resource/John_Smith" | empty if the data has no entity disambiguation layer
-        self.begin_index = begin_index   # e.g. 15 -> begin offset
-        self.end_index = end_index       # e.g. 25 -> end offset
-        self.provenance = provenance
-
-
-class ConceptMention:
+    __slots__ = ()
+
+
+class ConceptMention(_Mention, namedtuple('ConceptMention', ['sentence', 'mention',
+                                                   'lemma', 'mention_offset_ranges',
+                                                   'provenance',
+                                                   'meaning'],
+                                defaults=(None,))):
     """
     class containing information about a concept mention
+
+    sentence               e.g. 6 -> which sentence is the concept mentioned in
+    mention                e.g. "spies" -> the expression of a concept as found in text
+    lemma                  e.g. "spy" -> lemmatized form of the expression
+    mention_offset_ranges  e.g. ((10, 15),) -> tuple of (begin, end) tuples
+    provenance             e.g. "newsreader"
+    meaning                e.g. "http://www.newsreader-project.eu/wordnet/ili-30-00890590-v" | Or empty if the data has no concept disambiguation layer
     """
-    def __init__(self, sentence, mention,
-                 lemma, mention_offset_ranges,
-                 provenance,
-                 meaning=None):
-        self.sentence = sentence        # e.g. 6 -> which sentence is the concept mentioned in
-        self.mention = mention          # e.g. "spies" -> the expression of a concept as found in text
-        self.lemma = lemma              # e.g. "spy" -> lemmatized form of the expression
-        self.meaning = meaning          # e.g. "http://www.newsreader-project.eu/wordnet/ili-30-00890590-v" | Or empty if the data has no concept disambiguation layer
-        self.mention_offset_ranges = mention_offset_ranges # e.g. list of tuples
-        self.provenance = provenance
-
-
-class EventMention:
+    __slots__ = ()
+
+    def __new__(cls, sentence, mention, lemma, mention_offset_ranges,
+                provenance, meaning=None):
+        # a tuple, so that the mention can be hashed
+        return super().__new__(cls, sentence, mention, lemma,
+                               tuple(mention_offset_ranges), provenance, meaning)
+
+
+class EventMention(_Mention, namedtuple('EventMention', ['sentence', 'mention',
+                                               'lemma', 'mention_offset_ranges',
+                                               'provenance',
+                                               'meaning'],
+                              defaults=(None,))):
     """
     class containing information about an event mention
+
+    sentence               e.g. 6 -> which sentence is the event mentioned in
+    mention                e.g. "enabled" -> the expression of an event as found in text
+    lemma                  e.g. "enable" -> lemmatized form of the expression
+    mention_offset_ranges  e.g. ((10, 17),) -> tuple of (begin, end) tuples
+    provenance             e.g. "newsreader"
+    meaning                e.g. "http://longtailcorpus.org/news/1111-2222-3333-4444#ev3" # some kind of disambiguation identifier
     """
-    def __init__(self, sentence, mention,
-             lemma, mention_offset_ranges,
-             provenance,
-             meaning=None):
-        self.sentence = sentence        # e.g. 6 -> which sentence is the event mentioned in
-        self.mention = mention          # e.g. "enabled" -> the expression of an event as found in text
-        self.lemma = lemma              # e.g. "enable" -> lemmatized form of the expression
-        self.meaning = meaning          # e.g. "http://longtailcorpus.org/news/1111-2222-3333-4444#ev3" # some kind of disambiguation identifier
-        self.mention_offset_ranges = mention_offset_ranges # e.g. list of tuples
-        self.provenance = provenance
+    __slots__ = ()
+
+    def __new__(cls, sentence, mention, lemma, mention_offset_ranges,
+                provenance, meaning=None):
+        # a tuple, so that the mention can be hashed
+        return super().__new__(cls, sentence, mention, lemma,
+                               tuple(mention_offset_ranges), provenance, meaning)
 
 
 class NewsItem:
@@ -65,6 +107,7 @@ class NewsItem:
         self.entity_mentions = set()  # set of instances of EntityMention class
         self.concept_mentions = set() # set of instances of ConceptMention class
         self.event_mentions = set()   # set of instances of EventMention class
+        self.duplicate_of = None      # e.g. "1111-2222-3333-4444" -> id of the article that this one duplicates (see dedup.py)
 
 class Publisher:
     """
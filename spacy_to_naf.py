@@ -12,6 +12,9 @@ EntityElement = namedtuple('EntityElement', ['eid', 'entity_type', 'targets', 't
 DependencyRelation = namedtuple('DependencyRelation', ['from_term', 'to_term', 'rfunc', 'from_orth', 'to_orth'])
 ChunkElement = namedtuple('ChunkElement', ['cid', 'head', 'phrase', 'text', 'targets'])
 
+# The layers naf_from_doc can produce:
+ALL_LAYERS = ('text', 'terms', 'entities', 'deps', 'chunks')
+
 # Only allow legal strings in XML:
 # http://stackoverflow.com/a/25920392/2899924
 illegal_pattern = re.compile('[^\u0020-\uD7FF\u0009\u000A\u000D\uE000-\uFFFD\u10000-\u10FFFF]+')
@@ -139,10 +142,32 @@ def dependencies_to_add(token):
         token = token.head
     return deps
 
-def naf_from_doc(doc, time=None):
+def dependencies_for_sentence(sentence):
+    """
+    Function that returns the DependencyRelations of a sentence, in the same
+    order as calling dependencies_to_add for every token and removing the
+    duplicates, but in linear time: the walk up the tree stops at the first
+    token whose relation has already been added, since the relations of its
+    ancestors have been added as well.
+    """
+    deps = []
+    visited = set()
+    for token in sentence:
+        while token.head is not token and token.i not in visited:
+            visited.add(token.i)
+            deps.append(DependencyRelation(from_term = 't' + str(token.head.i),
+                                           to_term = 't' + str(token.i),
+                                           rfunc = token.dep_,
+                                           from_orth = normalize_token_orth(token.head.orth_),
+                                           to_orth = normalize_token_orth(token.orth_)))
+            token = token.head
+    return deps
+
+def naf_from_doc(doc, time=None, layers=ALL_LAYERS):
     """
     Function that takes a document and returns an ElementTree
     object that corresponds to the root of the NAF structure.
+    Only the layers in layers (see ALL_LAYERS) are produced.
     """
     # NAF:
     # ---------------------
@@ -166,11 +191,22 @@ def naf_from_doc(doc, time=None):
         lp.set("timestamp", time)
     ling_proc.set("layer", "terms")
 
-    text_layer = etree.SubElement(root, "text")
-    terms_layer = etree.SubElement(root, "terms")
-    entities_layer = etree.SubElement(root, "entities")
-    dependency_layer = etree.SubElement(root, "deps")
-    chunks_layer = etree.SubElement(root, "chunks")
+    add_text = 'text' in layers
+    add_terms = 'terms' in layers
+    add_entities = 'entities' in layers
+    add_deps = 'deps' in layers
+    add_chunks = 'chunks' in layers
+
+    if add_text:
+        text_layer = etree.SubElement(root, "text")
+    if add_terms:
+        terms_layer = etree.SubElement(root, "terms")
+    if add_entities:
+        entities_layer = etree.SubElement(root, "entities")
+    if add_deps:
+        dependency_layer = etree.SubElement(root, "deps")
+    if add_chunks:
+        chunks_layer = etree.SubElement(root, "chunks")
     # Initialize variables:
     # ---------------------
     # - Use a generator for entity awareness.
@@ -195,7 +231,6 @@ def naf_from_doc(doc, time=None):
 
 
     for sentence_number, sentence in enumerate(doc.sents, start = 1):
-        dependencies_for_sentence = []
         for token_number, token in enumerate(sentence, start = current_token):
             # Do we need a state change?
             if token_number == next_entity.start:
@@ -226,8 +261,10 @@ def naf_from_doc(doc, time=None):
                                     targets = current_term,
                                     text = current_term_orth)
 
-            add_wf_element(text_layer, wf_data)
-            add_term_element(terms_layer, term_data)
+            if add_text:
+                add_wf_element(text_layer, wf_data)
+            if add_terms:
+                add_term_element(terms_layer, term_data)
 
             # Move to the next term
             term_number += 1
@@ -244,7 +281,8 @@ def naf_from_doc(doc, time=None):
                                             targets = current_entity,
                                             text = current_entity_orth)
                 # Add data to XML:
-                add_entity_element(entities_layer, entity_data)
+                if add_entities:
+                    add_entity_element(entities_layer, entity_data)
 
                 # Move to the next entity:
                 entity_number += 1
@@ -259,32 +297,41 @@ def naf_from_doc(doc, time=None):
                     # No more entities...
                     next_entity = Entity(start=None, end=None, entity_type=None)
 
-            # Add dependencies for the current token to the list.
-            for dep_data in dependencies_to_add(token):
-                if not dep_data in dependencies_for_sentence:
-                    dependencies_for_sentence.append(dep_data)
-
         # At the end of the sentence, add all the dependencies to the XML structure.
-        for dep_data in dependencies_for_sentence:
-            add_dependency_element(dependency_layer, dep_data)
+        if add_deps:
+            for dep_data in dependencies_for_sentence(sentence):
+                add_dependency_element(dependency_layer, dep_data)
         current_token = token_number + 1
 
     # Add chunk layer after adding all other layers.
-    for chunk_data in chunk_tuples_for_doc(doc):
-        add_chunk_element(chunks_layer, chunk_data)
+    if add_chunks:
+        for chunk_data in chunk_tuples_for_doc(doc):
+            add_chunk_element(chunks_layer, chunk_data)
     return root
 
 def current_time():
     "Function that returns the current time (UTC)"
     return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SUTC")
 
-def text_to_NAF(text, nlp):
+def text_to_NAF(text, nlp, layers=ALL_LAYERS):
     """
     Function that takes a text and returns an xml object containing the NAF.
+    Only the layers in layers (see ALL_LAYERS) are produced.
     """
     doc = nlp(text)
     time = current_time()
-    return naf_from_doc(doc, time=time)
+    return naf_from_doc(doc, time=time, layers=layers)
+
+def texts_to_NAF(texts, nlp, batch_size=1000, n_threads=1, layers=ALL_LAYERS):
+    """
+    Generator function that takes an iterable of texts, annotates them in
+    batches with nlp.pipe and yields an xml object containing the NAF per text,
+    in the order of the input.
+    Only the layers in layers (see ALL_LAYERS) are produced.
+    """
+    for doc in nlp.pipe(texts, batch_size=batch_size, n_threads=n_threads):
+        time = current_time()
+        yield naf_from_doc(doc, time=time, layers=layers)
 
 def NAF_to_string(NAF, byte=False):
     """
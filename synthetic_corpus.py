@@ -0,0 +1,197 @@
+"""
+synthetic SignalMedia-shaped corpus for scale testing the conversion
+
+Every synthetic article is a recombination of a NewsReader NAF in naf/ (the
+template) with new metadata:
+
+* id: random uuid4 (reproducible with the seed)
+* content: the raw text of the template, so the offsets of its NAF hold
+* title: the first words of the content
+* source: drawn from a heavy-tailed (Zipf) distribution over the publishers
+  of locations.json followed by a long tail of synthetic publishers, as in
+  SignalMedia where a few sources publish most articles
+* published: a random time in September 2015 (the SignalMedia period)
+* media-type: News or Blog (roughly 3:1, as in SignalMedia)
+
+The templates are drawn uniformly, so the sizes and the entity and predicate
+densities of the synthetic articles follow those of the fixtures. A fraction
+of the articles (naf_ratio) gets a NewsReader NAF: the template with the id
+and creation time of the synthetic article in its header, written as
+{id}.in.naf (or .in.naf.gz, see naf_reader.NafFolder).
+"""
+import os
+import re
+import json
+import uuid
+import gzip
+import random
+import bisect
+import argparse
+import datetime
+from collections import namedtuple, Counter
+
+from lxml import etree
+
+import naf_reader
+
+generation_stats = namedtuple('generation_stats', ['num_articles', 'num_nafs',
+                                                   'num_publishers', 'content_chars'])
+
+PERIOD_START = datetime.datetime(2015, 9, 1)
+PERIOD_SECONDS = 30 * 24 * 3600
+BLOG_RATIO = 0.25
+TITLE_WORDS = 8
+
+RAW_PATTERN = re.compile(rb'<raw>(.*?)</raw>', re.DOTALL)
+CREATIONTIME_PATTERN = re.compile(rb'(<fileDesc[^>]*?creationtime=")[^"]*(")')
+
+
+def raw_text(data):
+    """
+    :param bytes data: NAF as bytestring
+
+    :rtype: str
+    :return: text of the raw layer ('' if there is none)
+    """
+    match = RAW_PATTERN.search(data)
+    if match is None:
+        return ''
+    return etree.fromstring(b'<raw>' + match.group(1) + b'</raw>').text or ''
+
+
+def publisher_pool(num_articles, path_locations='locations.json'):
+    """
+    create the publishers of a corpus with cumulative Zipf weights
+
+    :param int num_articles: size of the corpus (one publisher per 10 articles)
+    :param str path_locations: path to locations.json, its publishers come first
+
+    :rtype: tuple
+    :return: (list of publishers, list of cumulative weights)
+    """
+    publishers = []
+    if path_locations and os.path.exists(path_locations):
+        with open(path_locations) as infile:
+            publishers.extend(sorted(json.load(infile)))
+    num_synthetic = max(num_articles // 10 - len(publishers), 0)
+    publishers.extend('Synthetic Source %s' % number for number in range(1, num_synthetic + 1))
+    cumulative_weights = []
+    total = 0.0
+    for rank in range(1, len(publishers) + 1):
+        total += 1.0 / rank
+        cumulative_weights.append(total)
+    return publishers, cumulative_weights
+
+
+def synthetic_naf(data, template_id, identifier, published):
+    """
+    :param bytes data: template NAF
+    :param str template_id: article id of the template
+    :param str identifier: article id of the synthetic article
+    :param str published: publication time of the synthetic article
+
+    :rtype: bytes
+    :return: template NAF with the id and creation time of the synthetic article
+    """
+    data = data.replace(template_id.encode('utf-8'), identifier.encode('utf-8'))
+    return CREATIONTIME_PATTERN.sub(lambda match: match.group(1) + published.encode('utf-8') + match.group(2),
+                                    data, count=1)
+
+
+def generate_corpus(num_articles,
+                    path_jsonl,
+                    path_nafs='',
+                    path_templates='naf',
+                    naf_ratio=0.25,
+                    compress_nafs=False,
+                    path_locations='locations.json',
+                    seed=0):
+    """
+    write a synthetic SignalMedia jsonl (and NewsReader NAFs)
+
+    :param int num_articles: number of articles
+    :param str path_jsonl: path to output jsonl
+    :param str path_nafs: if provided, folder to write the NAFs to
+    :param str path_templates: folder with the NewsReader NAFs used as templates
+    :param float naf_ratio: fraction of the articles with a NAF
+    :param bool compress_nafs: if True, the NAFs are written as .in.naf.gz
+    :param str path_locations: path to locations.json (see publisher_pool)
+    :param int seed: seed of the random generator
+
+    :rtype: generation_stats
+    :return: (number of articles, number of NAFs, number of publishers used,
+    number of content characters)
+    """
+    rng = random.Random(seed)
+    template_store = naf_reader.NafFolder(path_templates)
+    templates = []
+    for template_id in sorted(template_store.identifiers()):
+        data = template_store.read(template_id)
+        templates.append((template_id, data, raw_text(data)))
+    template_store.close()
+    if not templates:
+        raise ValueError('no NAFs in %s' % path_templates)
+
+    publishers, cumulative_weights = publisher_pool(num_articles, path_locations)
+    if path_nafs:
+        os.makedirs(path_nafs, exist_ok=True)
+
+    num_nafs = 0
+    content_chars = 0
+    publisher_counts = Counter()
+    with open(path_jsonl, 'w', encoding='utf-8') as outfile:
+        for _ in range(num_articles):
+            template_id, data, content = rng.choice(templates)
+            identifier = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+            published = (PERIOD_START + datetime.timedelta(seconds=rng.randrange(PERIOD_SECONDS))).strftime('%Y-%m-%dT%H:%M:%SZ')
+            source = publishers[bisect.bisect_left(cumulative_weights,
+                                                   rng.random() * cumulative_weights[-1])]
+            article = {'id': identifier,
+                       'content': content,
+                       'title': ' '.join(content.split()[:TITLE_WORDS]),
+                       'media-type': 'Blog' if rng.random() < BLOG_RATIO else 'News',
+                       'source': source,
+                       'published': published}
+            outfile.write(json.dumps(article) + '\n')
+            publisher_counts[source] += 1
+            content_chars += len(content)
+
+            if path_nafs and rng.random() < naf_ratio:
+                naf_data = synthetic_naf(data, template_id, identifier, published)
+                if compress_nafs:
+                    with gzip.open(os.path.join(path_nafs, '%s.in.naf.gz' % identifier), 'wb', compresslevel=1) as naf_file:
+                        naf_file.write(naf_data)
+                else:
+                    with open(os.path.join(path_nafs, '%s.in.naf' % identifier), 'wb') as naf_file:
+                        naf_file.write(naf_data)
+                num_nafs += 1
+
+    return generation_stats(num_articles=num_articles,
+                            num_nafs=num_nafs,
+                            num_publishers=len(publisher_counts),
+                            content_chars=content_chars)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Generate a synthetic SignalMedia jsonl with NewsReader NAFs by recombining the NAFs in naf/.''')
+    parser.add_argument('-n', type=int, dest="num_articles", required=True, help="number of articles")
+    parser.add_argument('-o', dest="path_jsonl", required=True, help="path to output jsonl")
+    parser.add_argument('--nafs', dest="path_nafs", default='', help="folder to write the NAFs to (no NAFs if not provided)")
+    parser.add_argument('--templates', dest="path_templates", default='naf', help="folder with the NewsReader NAFs used as templates")
+    parser.add_argument('--naf-ratio', type=float, dest="naf_ratio", default=0.25, help="fraction of the articles with a NAF")
+    parser.add_argument('-z', dest="compress_nafs", action='store_true', help="write the NAFs gzipped (.in.naf.gz)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random generator")
+
+    args = parser.parse_args()
+
+    stats = generate_corpus(args.num_articles,
+                            args.path_jsonl,
+                            path_nafs=args.path_nafs,
+                            path_templates=args.path_templates,
+                            naf_ratio=args.naf_ratio,
+                            compress_nafs=args.compress_nafs,
+                            seed=args.seed)
+    print('articles: %s' % stats.num_articles)
+    print('NAFs: %s' % stats.num_nafs)
+    print('publishers: %s' % stats.num_publishers)
+    print('mean content length: %.0f' % (stats.content_chars / max(stats.num_articles, 1)))
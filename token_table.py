@@ -0,0 +1,80 @@
+"""
+per-document token table of a NAF
+
+The mentions of a NAF only need, per token, the offset, length, sentence and
+wordform of text/wf and the lemma of terms/term. TokenTable reads them once
+into parallel arrays, so that the mentions are built with array lookups
+instead of attribute lookups (and int conversions) on lxml elements, and the
+NAF tree can be released as soon as the mentions have been extracted.
+
+Tokens are addressed by the number of their identifier (7 for w7 and t7).
+"""
+from array import array
+
+
+def _rows(idens):
+    """
+    map token numbers to rows
+
+    :param list idens: token numbers in document order
+
+    :rtype: dict | None
+    :return: None if the numbers are 1, 2, 3, ... (row = number - 1),
+    else mapping number -> row
+    """
+    if idens == list(range(1, len(idens) + 1)):
+        return None
+    return {iden: row for row, iden in enumerate(idens)}
+
+
+def _lookup(idens, rows, num_rows):
+    if rows is not None:
+        return [rows[iden] for iden in idens]
+    for iden in idens:
+        if not 0 < iden <= num_rows:
+            raise KeyError(iden)
+    return [iden - 1 for iden in idens]
+
+
+class TokenTable:
+    """
+    offsets, lengths, sentences, wordforms and lemmas of the tokens of a NAF
+    """
+    __slots__ = ('offsets', 'lengths', 'sents', 'wordforms', 'lemmas',
+                 '_wf_rows', '_term_rows')
+
+    def __init__(self, naf):
+        """
+        :param naf: NAF tree (lxml.etree._ElementTree or root element)
+        """
+        wf_els = list(naf.iterfind('text/wf'))
+        self.offsets = array('q', [int(wf_el.get('offset')) for wf_el in wf_els])
+        self.lengths = array('q', [int(wf_el.get('length')) for wf_el in wf_els])
+        self.sents = array('q', [int(wf_el.get('sent')) for wf_el in wf_els])
+        self.wordforms = [wf_el.text for wf_el in wf_els]
+        self._wf_rows = _rows([int(wf_el.get('id')[1:]) for wf_el in wf_els])
+
+        term_els = list(naf.iterfind('terms/term'))
+        self.lemmas = [term_el.get('lemma') for term_el in term_els]
+        self._term_rows = _rows([int(term_el.get('id')[1:]) for term_el in term_els])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def wf_rows(self, idens):
+        """
+        :param list idens: numbers of tokens (7 for w7)
+
+        :rtype: list
+        :return: rows of the tokens in offsets, lengths, sents and wordforms
+        """
+        return _lookup(idens, self._wf_rows, len(self.offsets))
+
+    def term_rows(self, idens):
+        """
+        :param list idens: numbers of terms (7 for t7)
+
+        :rtype: list
+        :return: rows of the terms in lemmas
+        """
+        return _lookup(idens, self._term_rows, len(self.lemmas))
@@ -0,0 +1,227 @@
+"""
+embedded on-disk triple store (SQLite) for local lookups of mentions
+
+All triples are stored in the triples table (N-Triples terms). Next to it, the
+triples that are needed for the lookups are indexed in dedicated tables:
+
+* mention_spans: mention -> news item (nif:referenceContext), smallest
+  nif:beginIndex and largest nif:endIndex, indexed on (news item, begin, end)
+* denotes: mention -> instance (gaf:denotes), indexed on instance
+* same_as: instance -> entity (owl:sameAs), indexed on entity
+
+SQLiteStore is a sink (see rdf_sinks.py), so utils.rdfize_news_item can add
+its triples to it directly. load_file bulk loads existing shards.
+"""
+import os
+import sqlite3
+import argparse
+
+from rdflib import Graph, ConjunctiveGraph, URIRef, Literal
+from rdflib.namespace import OWL
+
+import rdf_sinks
+import compressed_io
+
+NIF_PREFIX = 'http://persistence.uni-leipzig.org/nlp2rdf/ontologies/nif-core#'
+REFERENCE_CONTEXT = URIRef('%sreferenceContext' % NIF_PREFIX)
+BEGIN_INDEX = URIRef('%sbeginIndex' % NIF_PREFIX)
+END_INDEX = URIRef('%sendIndex' % NIF_PREFIX)
+DENOTES = URIRef('http://groundedannotationframework.org/gaf#denotes')
+SAME_AS = OWL.sameAs
+
+FLUSH_SIZE = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS triples (subject TEXT, predicate TEXT, object TEXT,
+                                    PRIMARY KEY (subject, predicate, object)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS triples_pos ON triples (predicate, object);
+CREATE TABLE IF NOT EXISTS mention_spans (mention TEXT PRIMARY KEY, context TEXT,
+                                          begin_index INTEGER, end_index INTEGER);
+CREATE INDEX IF NOT EXISTS mention_spans_context ON mention_spans (context, begin_index, end_index);
+CREATE TABLE IF NOT EXISTS denotes (mention TEXT, instance TEXT,
+                                    PRIMARY KEY (instance, mention)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS same_as (instance TEXT, entity TEXT,
+                                    PRIMARY KEY (entity, instance)) WITHOUT ROWID;
+'''
+
+INSERT_TRIPLE = 'INSERT OR IGNORE INTO triples VALUES (?, ?, ?)'
+UPSERT_CONTEXT = '''INSERT INTO mention_spans (mention, context) VALUES (?, ?)
+                    ON CONFLICT (mention) DO UPDATE SET context = excluded.context'''
+UPSERT_BEGIN = '''INSERT INTO mention_spans (mention, begin_index) VALUES (?, ?)
+                  ON CONFLICT (mention) DO UPDATE
+                  SET begin_index = min(coalesce(begin_index, excluded.begin_index), excluded.begin_index)'''
+UPSERT_END = '''INSERT INTO mention_spans (mention, end_index) VALUES (?, ?)
+                ON CONFLICT (mention) DO UPDATE
+                SET end_index = max(coalesce(end_index, excluded.end_index), excluded.end_index)'''
+INSERT_DENOTES = 'INSERT OR IGNORE INTO denotes VALUES (?, ?)'
+INSERT_SAME_AS = 'INSERT OR IGNORE INTO same_as VALUES (?, ?)'
+
+class SQLiteStore:
+    """
+    triple store in an SQLite database, usable as sink of utils.rdfize_news_item
+    """
+    def __init__(self, destination):
+        self.destination = destination
+        self.connection = sqlite3.connect(destination)
+        self.connection.executescript(SCHEMA)
+        self.num_added = 0
+        self._pending = {statement: [] for statement in (INSERT_TRIPLE,
+                                                         UPSERT_CONTEXT,
+                                                         UPSERT_BEGIN,
+                                                         UPSERT_END,
+                                                         INSERT_DENOTES,
+                                                         INSERT_SAME_AS)}
+        self._num_pending = 0
+
+    def add(self, triple):
+        subject, predicate, obj = triple
+        self._pending[INSERT_TRIPLE].append((rdf_sinks.nt_term(subject),
+                                             rdf_sinks.nt_term(predicate),
+                                             rdf_sinks.nt_term(obj)))
+        if predicate == REFERENCE_CONTEXT:
+            self._pending[UPSERT_CONTEXT].append((str(subject), str(obj)))
+        elif predicate == BEGIN_INDEX:
+            self._pending[UPSERT_BEGIN].append((str(subject), int(obj)))
+        elif predicate == END_INDEX:
+            self._pending[UPSERT_END].append((str(subject), int(obj)))
+        elif predicate == DENOTES:
+            self._pending[INSERT_DENOTES].append((str(subject), str(obj)))
+        elif predicate == SAME_AS:
+            self._pending[INSERT_SAME_AS].append((str(subject), str(obj)))
+
+        self.num_added += 1
+        self._num_pending += 1
+        if self._num_pending >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        write the pending triples in one transaction
+        """
+        with self.connection:
+            for statement, rows in self._pending.items():
+                if rows:
+                    self.connection.executemany(statement, rows)
+                    rows.clear()
+        self._num_pending = 0
+
+    def load_file(self, path):
+        """
+        bulk load an output file of the conversion
+
+        :param str path: path to .ttl, .nt, .nq (optionally .gz or .zst) or .sqlite file
+        """
+        output_format = rdf_sinks.format_of_path(path)[0]
+        if output_format == 'sqlite':
+            self._load_store(path)
+            return
+        if output_format is None:
+            raise ValueError('unknown output format: %s' % path)
+
+        g = ConjunctiveGraph() if output_format == 'nquads' else Graph()
+        with compressed_io.open_binary(path) as infile:
+            g.parse(infile, format=output_format)
+        for triple in g.triples((None, None, None)):
+            self.add(triple)
+        self.flush()
+
+    def _load_store(self, path):
+        # copied table by table, without going through rdflib
+        self.flush()
+        self.connection.execute('ATTACH DATABASE ? AS shard', (path,))
+        try:
+            with self.connection:
+                num_triples = self.connection.execute('SELECT COUNT(*) FROM shard.triples').fetchone()[0]
+                self.connection.execute('INSERT OR IGNORE INTO triples SELECT * FROM shard.triples')
+                self.connection.execute('''INSERT INTO mention_spans SELECT * FROM shard.mention_spans WHERE true
+                                           ON CONFLICT (mention) DO UPDATE
+                                           SET context = coalesce(excluded.context, context),
+                                               begin_index = min(coalesce(begin_index, excluded.begin_index),
+                                                                 coalesce(excluded.begin_index, begin_index)),
+                                               end_index = max(coalesce(end_index, excluded.end_index),
+                                                               coalesce(excluded.end_index, end_index))''')
+                self.connection.execute('INSERT OR IGNORE INTO denotes SELECT * FROM shard.denotes')
+                self.connection.execute('INSERT OR IGNORE INTO same_as SELECT * FROM shard.same_as')
+        finally:
+            self.connection.execute('DETACH DATABASE shard')
+        self.num_added += num_triples
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute('SELECT COUNT(*) FROM triples').fetchone()[0]
+
+    def mentions_in_range(self, news_item, begin_index, end_index):
+        """
+        find the mentions in a news item that fall in a character range
+
+        :param str news_item: URI of the news item
+        :param int begin_index: begin of the range
+        :param int end_index: end of the range
+
+        :rtype: list
+        :return: list of (mention URI, begin index, end index), sorted by offsets
+        """
+        self.flush()
+        rows = self.connection.execute('''SELECT mention, begin_index, end_index
+                                          FROM mention_spans
+                                          WHERE context = ? AND begin_index >= ? AND end_index <= ?
+                                          ORDER BY begin_index, end_index, mention''',
+                                       (str(news_item), begin_index, end_index))
+        return rows.fetchall()
+
+    def news_items_mentioning(self, entity):
+        """
+        find the news items that mention an entity (owl:sameAs of the
+        instance that a mention denotes)
+
+        :param str entity: e.g. http://dbpedia.org/resource/Barack_Obama
+
+        :rtype: list
+        :return: sorted list of news item URIs
+        """
+        self.flush()
+        rows = self.connection.execute('''SELECT DISTINCT mention_spans.context
+                                          FROM same_as
+                                          JOIN denotes ON denotes.instance = same_as.instance
+                                          JOIN mention_spans ON mention_spans.mention = denotes.mention
+                                          WHERE same_as.entity = ?
+                                          ORDER BY mention_spans.context''',
+                                       (str(entity),))
+        return [context for context, in rows]
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Load the output of the conversion into an SQLite triple store and query it.''')
+    parser.add_argument('-o', dest="path_store", required=True, help="path to the SQLite store")
+    parser.add_argument('-i', dest="input_paths", nargs='*', default=[],
+                        help="output files (.ttl, .nt, .nq, optionally .gz or .zst, or .sqlite) or folders with output files to load")
+    parser.add_argument('--range', nargs=3, metavar=('NEWS_ITEM', 'BEGIN', 'END'),
+                        help="print the mentions in a news item within a character range")
+    parser.add_argument('--entity', help="print the news items that mention an entity")
+
+    args = parser.parse_args()
+
+    store = SQLiteStore(args.path_store)
+    for input_path in args.input_paths:
+        if os.path.isdir(input_path):
+            paths = sorted(os.path.join(input_path, basename)
+                           for basename in os.listdir(input_path)
+                           if rdf_sinks.format_of_path(basename)[0] is not None)
+        else:
+            paths = [input_path]
+        for path in paths:
+            store.load_file(path)
+            print('loaded %s' % path)
+
+    if args.range:
+        news_item, begin_index, end_index = args.range
+        for row in store.mentions_in_range(news_item, int(begin_index), int(end_index)):
+            print('%s\t%s\t%s' % row)
+    if args.entity:
+        for news_item in store.news_items_mentioning(args.entity):
+            print(news_item)
+    store.close()
@@ -1,19 +1,58 @@
 import json
 import logging
+import multiprocessing
 import os
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, deque
 import urllib.parse
 import hashlib
+import threading
+import contextlib
+from functools import lru_cache
 import spacy_to_naf
+import corpus_index
+import naf_reader
+import compressed_io
+import manifest
+import token_table
+import annotation_cache
+import prefetch
 import semeval_classes 
-from spacy.en import English
+from metrics import NO_METRICS
 from lxml import etree
-nlp = English()
 
 from rdflib import Graph, URIRef, Literal, Namespace
 from rdflib.namespace import RDF, FOAF, DC, OWL, DCTERMS
 import datetime
 import re
+import time
+
+# the spaCy NAF layers written by the converter (the deps and chunks layers
+# are not used by load_article_into_newsitem_class)
+SPACY_NAF_LAYERS = ('text', 'terms', 'entities')
+
+# the spaCy pipeline is loaded on first use by get_nlp (see there)
+nlp = None
+SPACY_MODEL = 'en'
+
+news_item = namedtuple('news_item',
+                       ['signalmedia_json', 'preprocessing', 'spacy_entity_mentions',
+                        'duplicate_of', 'line_number'],
+                       defaults=(None, None, None))
+
+def get_nlp():
+    '''
+    return the spaCy pipeline, loading it on the first call
+
+    the pipeline is stored at module level, so calling get_nlp in a parent
+    process before forking workers (e.g. parallel_conversion.py) loads the
+    model once and shares it with all workers. Code that does not annotate
+    with spaCy (locations2rdf, NewsReader-only conversion) never loads it.
+    '''
+    global nlp
+    if nlp is None:
+        from spacy.en import English
+        nlp = English()
+    return nlp
 
 def start_logger(log_path):
     '''
@@ -36,61 +75,530 @@ def start_logger(log_path):
     
     return logger 
 
+def iter_article_lines(path_signalmedia_json,
+                       start=None,
+                       end=None,
+                       path_line_index='',
+                       line_numbers=None,
+                       with_line_numbers=False):
+    """
+    create generator of lines of signalmedia jsonl
+
+    :param str path_signalmedia_json: path to all signalmedia article in jsonl
+    (possibly compressed, see compressed_io.py)
+    :param int start: start line
+    :param int end: end line (inclusive)
+    :param str path_line_index: path to line index (see corpus_index.py)
+    of path_signalmedia_json. If provided, the reading starts at the byte offset
+    of the start line instead of at the first line.
+    :param list line_numbers: if provided, only these lines are read (in
+    increasing order) instead of start till end. Requires path_line_index.
+    :param bool with_line_numbers: if True, (line number, line) is
+    generated instead of the line
+
+    :rtype: generator
+    :return: generator of lines
+    """
+    if line_numbers is not None:
+        if not path_line_index:
+            raise ValueError('reading selected lines requires a line index')
+        with corpus_index.LineIndex(path_line_index) as line_index:
+            for line_number, line in corpus_index.iter_selected_lines(path_signalmedia_json,
+                                                                      line_index,
+                                                                      line_numbers):
+                yield (line_number, line) if with_line_numbers else line
+        return
+
+    if path_line_index:
+        with corpus_index.LineIndex(path_line_index) as line_index:
+            for line_number, line in corpus_index.iter_lines(path_signalmedia_json,
+                                                             line_index,
+                                                             start=start or 1,
+                                                             end=end):
+                yield (line_number, line) if with_line_numbers else line
+        return
+
+    if end:
+        line_range = range(start, end+1)
+
+    with compressed_io.open_binary(path_signalmedia_json) as infile:
+        for counter, line in enumerate(infile, 1):
+
+            if end:
+                if counter not in line_range:
+                    continue
+                if counter > end:
+                    break
+
+            yield (counter, line) if with_line_numbers else line
+
+def entity_mentions_from_doc(doc, provenance='spacy'):
+    """
+    create EntityMention objects directly from a spaCy Doc
+
+    the mentions are identical to the ones create_entity_mention_obj
+    creates from the NAF of spacy_to_naf.naf_from_doc (same mention, sentence id,
+    type and offsets), without building and walking the NAF
+
+    :param spacy.tokens.Doc doc: annotated document
+    :param str provenance: spacy
+
+    :rtype: list
+    :return: list of semeval_classes.EntityMention
+    """
+    token2sent_id = {}
+    for sentence_number, sentence in enumerate(doc.sents, start=1):
+        sent_id = str(sentence_number)
+        for token in sentence:
+            token2sent_id[token.i] = sent_id
+
+    entity_mentions = []
+    for entity in spacy_to_naf.entities(doc):
+        tokens = [doc[i] for i in range(entity.start, entity.end + 1)]
+
+        # get sentence id
+        sent_ids = {token2sent_id[token.i] for token in tokens}
+        assert len(sent_ids) == 1, 'entity in multiple sentences'
+        sent_id = sent_ids.pop()
+
+        # get mention
+        mention = ' '.join([spacy_to_naf.normalize_token_orth(token.text)
+                            for token in tokens])
+
+        # get start and end offset
+        begin_index = tokens[0].idx
+        end_index = tokens[-1].idx + len(tokens[-1].text)
+
+        entity_mentions.append(semeval_classes.EntityMention(
+            sentence=sent_id,
+            mention=mention,
+            meaning='',
+            the_type=entity.entity_type,
+            begin_index=begin_index,
+            end_index=end_index,
+            provenance=provenance))
+
+    return entity_mentions
+
+def annotate_doc(doc, naf_output=False, metrics=NO_METRICS):
+    """
+    extract what the converter needs from a spaCy Doc
+
+    :param spacy.tokens.Doc doc: annotated document
+    :param bool naf_output: if True, the NAF of the document (layers
+    SPACY_NAF_LAYERS) is created as well
+    :param metrics.Metrics metrics: if provided, the NAF building is timed
+
+    :rtype: tuple
+    :return: (list of semeval_classes.EntityMention,
+    lxml.etree._Element or None)
+    """
+    spacy_naf = None
+    if naf_output:
+        with metrics.stage('spacy_naf'):
+            spacy_naf = spacy_to_naf.naf_from_doc(doc, time=spacy_to_naf.current_time(),
+                                                  layers=SPACY_NAF_LAYERS)
+    return entity_mentions_from_doc(doc), spacy_naf
+
+def _annotate_texts(texts, naf_output):
+    """
+    annotate texts with spaCy in a worker process
+
+    the worker uses the module level nlp, which it inherits from the parent
+    when the pool is forked (see get_nlp). lxml trees can not be pickled, hence the NAFs
+    are returned as bytestrings.
+
+    :param list texts: list of article contents
+    :param bool naf_output: if True, the NAFs are created as well
+
+    :rtype: tuple
+    :return: (list of (list of semeval_classes.EntityMention, NAF bytestring
+    or None), seconds spent)
+    """
+    started = time.perf_counter()
+    annotations = []
+    for doc in get_nlp().pipe(texts, batch_size=len(texts)):
+        entity_mentions, spacy_naf = annotate_doc(doc, naf_output=naf_output)
+        if spacy_naf is not None:
+            spacy_naf = spacy_to_naf.NAF_to_string(spacy_naf, byte=True)
+        annotations.append((entity_mentions, spacy_naf))
+    return annotations, time.perf_counter() - started
+
+def _annotate_in_process(texts, batch_size, n_threads, naf_output, metrics=NO_METRICS):
+    """
+    annotate texts with spaCy in this process
+
+    :rtype: list
+    :return: list of (list of semeval_classes.EntityMention, lxml.etree._Element or None)
+    """
+    with metrics.stage('nlp'):
+        return [annotate_doc(doc, naf_output=naf_output, metrics=metrics)
+                for doc in get_nlp().pipe(texts, batch_size=batch_size, n_threads=n_threads)]
+
+# marks the articles that get the annotation of their canonical article,
+# which is earlier in the same batch
+_REUSE = object()
+
+def _batches(iterable, size):
+    """
+    create generator of lists of at most size items of iterable
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def annotate_articles(articles, batch_size=1000, n_process=1, n_threads=1,
+                      naf_output=False, cache=None, metrics=NO_METRICS,
+                      duplicates=None):
+    """
+    create generator of (article, entity mentions, spacy NAF), annotating
+    the article contents in batches with nlp.pipe
+
+    :param iterable articles: signalmedia articles (dicts)
+    :param int batch_size: number of texts per nlp.pipe batch
+    :param int n_process: number of worker processes. If 1, the annotation
+    is done in this process.
+    :param int n_threads: number of threads used by nlp.pipe
+    :param bool naf_output: if True, the NAF is created as well, else
+    the spacy NAF is None
+    :param annotation_cache.AnnotationCache cache: if provided, the entity
+    mentions of contents that are in the cache are taken from it instead of
+    running spaCy, and new annotations are added to it. The cache is not
+    used if naf_output is True.
+    :param metrics.Metrics metrics: if provided, the stages nlp, spacy_naf
+    and annotation_cache are timed (with n_process > 1, nlp is the time
+    spent waiting for the workers)
+    :param dedup.DuplicateDetector duplicates: if provided, the articles that
+    it found to be duplicates (see dedup.DuplicateDetector.check) are not
+    annotated, but get the entity mentions of their canonical article. A
+    duplicate of which the annotation of the canonical article is no longer
+    known is annotated like any other article. The annotations are not
+    reused if naf_output is True.
+
+    :rtype: generator
+    :return: generator of (article, list of semeval_classes.EntityMention,
+    lxml.etree._Element or None) in input order
+    """
+    if naf_output:
+        cache = None
+        duplicates = None
+
+    def lookup(batch):
+        """
+        :rtype: list
+        :return: per article of the batch its reused or cached entity
+        mentions, _REUSE if its canonical article is earlier in the batch,
+        None if it has to be annotated
+        """
+        cached = [None] * len(batch)
+        if duplicates is not None:
+            batch_contents = {}  # id -> content of the articles before in the batch
+            for index, article in enumerate(batch):
+                match = duplicates.match(article['id'])
+                if match is not None:
+                    if match.canonical_id in batch_contents:
+                        if duplicates.reusable(article['id'], article['content'],
+                                               batch_contents[match.canonical_id]):
+                            cached[index] = _REUSE
+                    else:
+                        cached[index] = duplicates.annotation_of(article['id'], article['content'])
+                batch_contents[article['id']] = article['content']
+        if cache is not None:
+            with metrics.stage('annotation_cache'):
+                cached = [cache.get(article['content']) if entity_mentions is None else entity_mentions
+                          for article, entity_mentions in zip(batch, cached)]
+                cache.flush()
+        return cached
+
+    def merge(batch, cached, annotations):
+        """
+        yield the articles of a batch with the cached, reused or new annotations
+        """
+        annotations = iter(annotations)
+        batch_annotations = {}  # id -> (content, entity mentions), for _REUSE
+        new_annotations = []  # (content, entity mentions) to cache
+        merged = []
+        for article, entity_mentions in zip(batch, cached):
+            spacy_naf = None
+            if entity_mentions is _REUSE:
+                match = duplicates.match(article['id'])
+                canonical_content, canonical_mentions = batch_annotations[match.canonical_id]
+                entity_mentions = duplicates.reuse(article['id'], article['content'],
+                                                   canonical_content, canonical_mentions)
+            elif entity_mentions is None:
+                entity_mentions, spacy_naf = next(annotations)
+                new_annotations.append((article['content'], entity_mentions))
+            if duplicates is not None:
+                duplicates.remember(article['id'], entity_mentions)
+                batch_annotations[article['id']] = (article['content'], entity_mentions)
+            merged.append((article, entity_mentions, spacy_naf))
+        if cache is not None:
+            # one transaction per batch
+            with metrics.stage('annotation_cache'):
+                cache.put_many(new_annotations)
+        yield from merged
+
+    def texts_of(batch, cached):
+        return [article['content']
+                for article, entity_mentions in zip(batch, cached)
+                if entity_mentions is None]
+
+    if n_process <= 1:
+        for batch in _batches(articles, batch_size):
+            cached = lookup(batch)
+            texts = texts_of(batch, cached)
+            annotations = []
+            if texts:
+                started = time.perf_counter()
+                annotations = _annotate_in_process(texts, batch_size, n_threads, naf_output,
+                                                   metrics=metrics)
+                if duplicates is not None:
+                    duplicates.record_nlp(time.perf_counter() - started, sum(map(len, texts)))
+            yield from merge(batch, cached, annotations)
+        return
+
+    # at most two batches per worker are in flight, which keeps the memory
+    # bounded and the output in input order
+    max_in_flight = 2 * n_process
+    in_flight = deque()
+    get_nlp()  # load the model once, before the workers are forked
+    with multiprocessing.get_context('fork').Pool(n_process) as pool:
+
+        def collect():
+            batch, cached, result = in_flight.popleft()
+            annotations = []
+            if result is not None:
+                with metrics.stage('nlp'):
+                    result, seconds = result.get()
+                if duplicates is not None:
+                    duplicates.record_nlp(seconds, sum(len(article['content'])
+                                                       for article, entity_mentions in zip(batch, cached)
+                                                       if entity_mentions is None))
+                for entity_mentions, naf_string in result:
+                    spacy_naf = None
+                    if naf_string is not None:
+                        spacy_naf = etree.fromstring(naf_string)
+                    annotations.append((entity_mentions, spacy_naf))
+            yield from merge(batch, cached, annotations)
+
+        for batch in _batches(articles, batch_size):
+            cached = lookup(batch)
+            texts = texts_of(batch, cached)
+            result = None
+            if texts:
+                result = pool.apply_async(_annotate_texts, (texts, naf_output))
+            in_flight.append((batch, cached, result))
+            if len(in_flight) >= max_in_flight:
+                yield from collect()
+        while in_flight:
+            yield from collect()
+
 def process_first_x_files(path_signalmedia_json,
                           path_newsreader_nafs='',
                           start=None,
-                          end=None):
+                          end=None,
+                          path_line_index='',
+                          nlp_batch_size=1000,
+                          n_process=1,
+                          path_spacy_nafs='',
+                          path_annotation_cache='',
+                          annotation_cache_size=annotation_cache.DEFAULT_MAX_BYTES,
+                          spacy_annotation=True,
+                          line_numbers=None,
+                          ids_with_naf=None,
+                          metrics=NO_METRICS,
+                          prefetch_depth=0,
+                          n_threads=2,
+                          duplicates=None):
     """
     create generator of json objects (representing signalmedia articles)
     
     :param str path_signalmedia_json: path to all signalmedia article in jsonl
     (originally called signalmedia-1m.jsonl
     :param str path_newsreader_nafs: path to where signalmedia processed
-    with pipeline is stored in NAF
+    with pipeline is stored in NAF: a folder or a zip/tar archive
+    (see naf_reader.open_naf_store)
     :param int start: start line
     :param int end: end line
+    :param str path_line_index: path to line index (see corpus_index.py)
+    :param int nlp_batch_size: number of articles per nlp.pipe batch
+    :param int n_process: number of processes used for the spaCy annotation
+    :param str path_spacy_nafs: if provided, the NAF of the spaCy annotation
+    is written to this folder ({identifier}.naf). It is not needed for the
+    conversion itself.
+    :param str path_annotation_cache: if provided, the spaCy annotations are
+    looked up in and added to the annotation cache (see annotation_cache.py)
+    at this path
+    :param int annotation_cache_size: maximum size of the annotation cache in bytes
+    :param bool spacy_annotation: if False, spaCy is not used (and not loaded)
+    and only the articles with a NewsReader NAF are converted
+    :param list line_numbers: if provided, only these lines are converted
+    instead of start till end (see corpus_index.CorpusMetadata.select)
+    :param set ids_with_naf: if provided, the ids of the articles that have a
+    NewsReader NAF (see corpus_index.CorpusMetadata.ids_with_naf), which saves
+    checking the file system for every article
+    :param metrics.Metrics metrics: if provided, the stages read,
+    json_decode, nlp, spacy_naf, write_spacy_naf, naf_read and naf_parse
+    are timed (see metrics.py)
+    :param int prefetch_depth: if larger than 0, the jsonl is read and
+    decoded in a reader thread, and the NewsReader NAFs are read and parsed
+    in n_threads threads, both at most prefetch_depth articles ahead (see
+    prefetch.py). The read and naf_wait stages are then the time spent
+    waiting for them.
+    :param int n_threads: number of threads for the NewsReader NAFs
+    :param dedup.DuplicateDetector duplicates: if provided, every article is
+    checked for being a duplicate of an earlier article. A duplicate gets
+    the spaCy mentions of its canonical article instead of being annotated
+    (see annotate_articles), and the id of its canonical article as
+    duplicate_of.
 
     :rtype: generator
     :return: generator of json objects
     """
-    if end:
-        line_range = range(start, end+1)
+    spacy_naf_template = '{path_spacy_nafs}/{identifier}.naf'
 
-    news_item = namedtuple('news_item',
-                           ['signalmedia_json', 'preprocessing'])
-    path_template = '{path_newsreader_nafs}/{identifier}.in.naf'
+    def decode(line):
+        with metrics.stage('json_decode'):
+            return json.loads(line)
 
-    with open(path_signalmedia_json) as infile:
-        for counter, line in enumerate(infile, 1):
+    lines = iter_article_lines(path_signalmedia_json,
+                               start=start,
+                               end=end,
+                               path_line_index=path_line_index,
+                               line_numbers=line_numbers,
+                               with_line_numbers=True)
 
-            if end:
-                if counter not in line_range:
-                    continue            
-                if counter > end:
-                    break
+    # the line numbers of the articles that have been read, in order
+    article_line_numbers = deque()
+
+    def numbered(pairs):
+        for line_number, article in pairs:
+            article_line_numbers.append(line_number)
+            yield article
+
+    if prefetch_depth > 0:
+        articles = numbered(metrics.iter_timed(prefetch.iter_prefetched(((line_number, json.loads(line))
+                                                                         for line_number, line in lines),
+                                                                        prefetch_depth),
+                                               'read'))
+    else:
+        articles = numbered((line_number, decode(line))
+                            for line_number, line in metrics.iter_timed(lines, 'read'))
+
+    if duplicates is not None:
+        articles = duplicates.scan(articles)
+
+    cache = None
+    if path_annotation_cache and spacy_annotation:
+        cache = annotation_cache.AnnotationCache(path_annotation_cache,
+                                                 annotation_cache.model_identifier(SPACY_MODEL),
+                                                 max_bytes=annotation_cache_size)
 
-            article = json.loads(line)
+    nafs = None
+    if path_newsreader_nafs:
+        nafs = naf_reader.open_naf_store(path_newsreader_nafs)
+
+    def has_naf(identifier):
+        return nafs is not None and (ids_with_naf is None or identifier in ids_with_naf)
+
+    newsreader_nafs = None
+    if prefetch_depth > 0 and nafs is not None:
+        # the archives can only be read by one thread at a time
+        store_lock = contextlib.nullcontext() if nafs.thread_safe else threading.Lock()
+
+        def load_newsreader_naf(identifier):
+            if identifier is None:
+                return None
+            with store_lock:
+                naf_data = nafs.read(identifier)
+            if naf_data is None:
+                return None
+            return naf_reader.parse_naf(naf_data)
+
+        newsreader_nafs = prefetch.OrderedPrefetcher(load_newsreader_naf,
+                                                     n_threads=n_threads,
+                                                     depth=prefetch_depth)
+
+        def announce(articles):
+            # the NAFs are loaded in the order in which the articles are annotated
+            for article in articles:
+                identifier = article['id']
+                newsreader_nafs.add(identifier if has_naf(identifier) else None)
+                yield article
+
+        articles = announce(articles)
+
+    if spacy_annotation:
+        annotated_articles = annotate_articles(articles,
+                                               batch_size=nlp_batch_size,
+                                               n_process=n_process,
+                                               naf_output=bool(path_spacy_nafs),
+                                               cache=cache,
+                                               metrics=metrics,
+                                               duplicates=duplicates)
+    else:
+        annotated_articles = ((article, None, None) for article in articles)
+
+    try:
+        for article, entity_mentions, spacy_naf in annotated_articles:
             identifier = article['id']
-            spacy_naf = spacy_to_naf.text_to_NAF(article['content'], nlp)
-            the_preprocessing = {('spacy', spacy_naf)}
+            line_number = article_line_numbers.popleft()
+            the_preprocessing = set()
+
+            if spacy_naf is not None:
+                spacy_naf_path = spacy_naf_template.format_map(locals())
+                with metrics.stage('write_spacy_naf'), open(spacy_naf_path, 'wb') as outfile:
+                    outfile.write(spacy_to_naf.NAF_to_string(spacy_naf, byte=True))
 
-            if path_newsreader_nafs:
-                path_newsreader_naf = path_template.format_map(locals())
-                if os.path.exists(path_newsreader_naf):
-                    newsreader_naf = etree.parse(path_newsreader_naf)
+            if newsreader_nafs is not None:
+                with metrics.stage('naf_wait'):
+                    newsreader_naf = newsreader_nafs.next()
+                if newsreader_naf is not None:
                     the_preprocessing.add(('newsreader', newsreader_naf))
+            elif has_naf(identifier):
+                with metrics.stage('naf_read'):
+                    naf_data = nafs.read(identifier)
+                if naf_data is not None:
+                    with metrics.stage('naf_parse'):
+                        newsreader_naf = naf_reader.parse_naf(naf_data)
+                    the_preprocessing.add(('newsreader', newsreader_naf))
+
+            duplicate_of = None
+            if duplicates is not None:
+                match = duplicates.match(identifier)
+                if match is not None:
+                    duplicate_of = match.canonical_id
+                duplicates.release(identifier)
+
+            if not spacy_annotation and not the_preprocessing:
+                continue
 
             a_news_item = news_item(signalmedia_json=article,
-                                    preprocessing=the_preprocessing)
+                                    preprocessing=the_preprocessing,
+                                    spacy_entity_mentions=entity_mentions,
+                                    duplicate_of=duplicate_of,
+                                    line_number=line_number)
             yield a_news_item
+    finally:
+        if newsreader_nafs is not None:
+            newsreader_nafs.close()
+        if nafs is not None:
+            nafs.close()
+        if cache is not None:
+            cache.close()
 
-def create_entity_mention_obj(entity_el, provenance, iden2wf_el, debug=False):
+def create_entity_mention_obj(entity_el, provenance, tokens, debug=False):
     """
     create EntityMention object
 
     :param lxml.etree._Element entity_el: entities/entity from NAF
     :param str provenance: spacy | newsreader
-    :param dict iden2wf_el: mapping int (no 'w') -> wf element (text/wf)
+    :param token_table.TokenTable tokens: token table of the NAF
 
     :return: semeval_classes.EntityMention
     """
@@ -98,25 +606,21 @@ def create_entity_mention_obj(entity_el, provenance, iden2wf_el, debug=False):
     idens = [int(t_id.get('id')[1:])
              for t_id in entity_el.iterfind('references/span/target')]
 
+    rows = tokens.wf_rows(idens)
+
     # get mention
-    mention = ' '.join([iden2wf_el[iden].text
-                        for iden in idens])
+    mention = ' '.join([tokens.wordforms[row]
+                        for row in rows])
 
     # get sentence id
-    sent_ids = [iden2wf_el[iden].get('sent')
-                for iden in idens]
+    sent_ids = [tokens.sents[row]
+                for row in rows]
     assert len(set(sent_ids)) == 1, 'entity in multiple sentences'
-    sent_id = sent_ids[0]
+    sent_id = str(sent_ids[0])
 
     # get start and end offset
-    wf_el = iden2wf_el[idens[0]]
-    begin_index = int(wf_el.get('offset'))
-
-    if len(idens) == 1:
-        end_index = begin_index + int(wf_el.get('length'))
-    else:
-        end_wf_el = iden2wf_el[idens[-1]]
-        end_index = int(end_wf_el.get('offset')) + int(end_wf_el.get('length'))
+    begin_index = tokens.offsets[rows[0]]
+    end_index = tokens.offsets[rows[-1]] + tokens.lengths[rows[-1]]
 
     # find meaning
     xpath_query = 'externalReferences/externalRef[@resource="spotlight_v1"]'
@@ -151,7 +655,7 @@ def create_entity_mention_obj(entity_el, provenance, iden2wf_el, debug=False):
 
 
 def create_event_mention_obj(predicate_el, provenance,
-                             iden2wf_el, tid2lemma,
+                             tokens,
                              basename,
                              debug=False):
     """
@@ -159,8 +663,7 @@ def create_event_mention_obj(predicate_el, provenance,
 
     :param lxml.etree._Element predicate_el: srl/predicate from NAF
     :param str provenance: spacy | newsreader
-    :param dict iden2wf_el: mapping int (no 'w') -> wf element (text/wf)
-    :param dict tid2lemma: mapping int (no 't') -> lemma
+    :param token_table.TokenTable tokens: token table of the NAF
     :param str basename: basename of NAF file
 
     :return:
@@ -170,25 +673,22 @@ def create_event_mention_obj(predicate_el, provenance,
              for t_id in first_span_el.iterfind('target')]
 
     # get sentence id
-    sent_ids = [iden2wf_el[iden].get('sent')
-                for iden in idens]
+    rows = tokens.wf_rows(idens)
+    sent_ids = [tokens.sents[row]
+                for row in rows]
     assert len(set(sent_ids)) == 1, 'predicate in multiple sentences: %s from %s: %s' % (predicate_el.get('id'), basename, sent_ids)
-    sent_id = sent_ids[0]
+    sent_id = str(sent_ids[0])
 
     # get mention
-    mention = ' '.join([iden2wf_el[iden].text
-                        for iden in idens])
+    mention = ' '.join([tokens.wordforms[row]
+                        for row in rows])
 
     # get lemma
-    lemma = ' '.join([tid2lemma[iden]
-                      for iden in idens])
+    lemma = ' '.join([tokens.lemmas[row]
+                      for row in tokens.term_rows(idens)])
 
-    mention_offset_ranges = []
-    for iden in idens:
-        wf_el = iden2wf_el[iden]
-        start_offset = int(wf_el.get('offset'))
-        end_offset = start_offset + int(wf_el.get('length'))
-        mention_offset_ranges.append((start_offset, end_offset))
+    mention_offset_ranges = [(tokens.offsets[row], tokens.offsets[row] + tokens.lengths[row])
+                             for row in rows]
 
     an_event_mention_obj = semeval_classes.EventMention(
         sentence=sent_id,
@@ -216,6 +716,10 @@ def load_article_into_newsitem_class(info_about_news_item):
     :param collections.namedtuple info_about_news_item: namedtuple with as attribute
     1. signammedia_json -> the original json from signalmedia
     2. preprocessing -> set of tuples (provenance, naf)
+    3. spacy_entity_mentions -> EntityMention objects created directly from
+    the spaCy Doc (see entity_mentions_from_doc), or None
+    4. duplicate_of -> id of the article that this article duplicates
+    (see dedup.py), or None
     
     :rtype: semeval_classes.NewsItem
     :return: semeval_classes.NewsItem with relevant attributes set
@@ -228,13 +732,15 @@ def load_article_into_newsitem_class(info_about_news_item):
         collection = 'SignalMedia',
         dct = article['published'],
         publisher = article['source'])
+    a_news_item.duplicate_of = info_about_news_item.duplicate_of
+
+    if info_about_news_item.spacy_entity_mentions:
+        a_news_item.entity_mentions.update(info_about_news_item.spacy_entity_mentions)
     
+    # nothing that is extracted refers to the NAF trees, so they can be
+    # released as soon as this function returns
     for provenance, naf in info_about_news_item.preprocessing:
-        iden2wf_el = {int(wf_el.get('id')[1:]): wf_el
-                      for wf_el in naf.iterfind('text/wf')}
-
-        tid2lemma = {int(term_el.get('id')[1:]): term_el.get('lemma')
-                     for term_el in naf.iterfind('terms/term')}
+        tokens = token_table.TokenTable(naf)
         basename = ''
         if provenance == 'newsreader':
             basename = naf.find('nafHeader/fileDesc').get('filename')
@@ -242,7 +748,7 @@ def load_article_into_newsitem_class(info_about_news_item):
         # add entity mentions
         for entity_el in naf.iterfind('entities/entity'):
             entity_mention_obj = create_entity_mention_obj(entity_el, provenance,
-                                                           iden2wf_el,
+                                                           tokens,
                                                            debug=False)
             a_news_item.entity_mentions.add(entity_mention_obj)
 
@@ -250,8 +756,7 @@ def load_article_into_newsitem_class(info_about_news_item):
         for predicate_el in naf.iterfind('srl/predicate'):
             an_event_mention_obj = create_event_mention_obj(predicate_el,
                                                             provenance,
-                                                            iden2wf_el,
-                                                            tid2lemma,
+                                                            tokens,
                                                             basename,
                                                             debug=False)
             a_news_item.event_mentions.add(an_event_mention_obj)
@@ -277,25 +782,81 @@ cltlPublisherPrefix='%spublisher/' % cltlPrefix
 cltlNewsPrefix='%snews/' % cltlPrefix
 cltlTypePrefix='%stype/' % cltlPrefix
 
+# attribute access on a Namespace creates a new URIRef every time,
+# so the terms used per mention are looked up once
+gafMention=GAF.Mention
+gafInstance=GAF.Instance
+gafDenotes=GAF.denotes
+cltlvSent=CLTLV.sent
+cltlvEntity=CLTLV.Entity
+cltlvEvent=CLTLV.Event
+cltlvDuplicateOf=CLTLV.duplicateOf
+nifAnchorOf=NIF.anchorOf
+nifLemma=NIF.lemma
+nifReferenceContext=NIF.referenceContext
+nifBeginIndex=NIF.beginIndex
+nifEndIndex=NIF.endIndex
+provWasAttributedTo=PROV.wasAttributedTo
+
+# maximum number of terms kept by each of the interning functions below
+TERM_CACHE_SIZE=2 ** 16
+NON_WORD_PATTERN=re.compile(r'\W+')
+
 def hash_offsets(hash_me):
     hashhash=repr(hash_me).encode('utf-8')
     hash_object=hashlib.md5(hashhash)
     return hash_object.hexdigest()
 
 def create_publisher_uri(p):
-    return '%s%s' % (cltlPublisherPrefix, re.sub(r'\W+', '', p))
+    return '%s%s' % (cltlPublisherPrefix, NON_WORD_PATTERN.sub('', p))
 
 def create_topic_uri(domain):
-    return '%s%s' % (cltlTopicPrefix, re.sub(r'\W+', '', domain))
+    return '%s%s' % (cltlTopicPrefix, NON_WORD_PATTERN.sub('', domain))
 
 def makeType(t):
     return '%s%s' % (cltlTypePrefix, t)
 
+# The functions below intern the terms that recur across articles: the same
+# (immutable) rdflib term is returned for the same input, so it is created
+# once instead of once per triple. The caches are bounded (least recently
+# used terms are dropped), so corpora with many distinct values do not grow
+# them without limit.
+
+@lru_cache(maxsize=TERM_CACHE_SIZE)
+def publisher_uri(p):
+    return URIRef(create_publisher_uri(p))
+
+@lru_cache(maxsize=TERM_CACHE_SIZE)
+def topic_uri(domain):
+    return URIRef(create_topic_uri(domain))
+
+@lru_cache(maxsize=TERM_CACHE_SIZE)
+def collection_uri(collection):
+    return URIRef('%s%s' % (cltlDataPrefix, collection))
+
+@lru_cache(maxsize=TERM_CACHE_SIZE)
+def type_uri(t):
+    return URIRef(makeType(t))
+
+@lru_cache(maxsize=TERM_CACHE_SIZE)
+def provenance_uri(provenance, kind):
+    """
+    :param str provenance: e.g. newsreader or spacy
+    :param str kind: entity | event
+    """
+    return URIRef('%sprovenance/%s/%s' % (cltlPrefix, provenance, kind))
+
+@lru_cache(maxsize=TERM_CACHE_SIZE, typed=True)
+def int_literal(number):
+    # typed: 1, 1.0 and True are equal keys, but different literals
+    return Literal(number)
+
 def rdfize_news_item(a_news_item, g):
     """
     convert instance of semeval_classes.NewsItem into RDF
     
     :param semeval_classes.NewsItem a_news_item: instance of semeval_classes.NewsItem
+    :param g: rdflib.Graph or sink from rdf_sinks (anything with an add method)
     """
     news_item_id = a_news_item.identifier
     # create URI for this news item
@@ -305,14 +866,16 @@ def rdfize_news_item(a_news_item, g):
     # Add the news item triples to the graph
     g.add(( newsItem, RDF.type, newsItemType))
     g.add(( newsItem, DCTERMS.source, Literal(news_item_id) ))
-    g.add(( newsItem, DCTERMS.isPartOf, URIRef('%s%s' % (cltlDataPrefix, a_news_item.collection)) ))
+    g.add(( newsItem, DCTERMS.isPartOf, collection_uri(a_news_item.collection) ))
     dct=datetime.datetime.strptime(a_news_item.dct, '%Y-%m-%dT%H:%M:%SZ') # 2015-09-04T10:43:03Z
     g.add(( newsItem, DCTERMS.created, Literal(dct)))
-    g.add(( newsItem, DCTERMS.publisher, URIRef(create_publisher_uri(a_news_item.publisher))))
+    g.add(( newsItem, DCTERMS.publisher, publisher_uri(a_news_item.publisher)))
     if a_news_item.domain and len(a_news_item.domain):
         for domain in a_news_item.domain:
             if domain:
-                g.add(( newsItem, DCTERMS.subject, URIRef(create_topic_uri(domain)) ))
+                g.add(( newsItem, DCTERMS.subject, topic_uri(domain) ))
+    if a_news_item.duplicate_of:
+        g.add(( newsItem, cltlvDuplicateOf, URIRef("%s%s" % (cltlNewsPrefix, a_news_item.duplicate_of)) ))
 
     # iterate through the entity mentions
     for entity_mention_obj in a_news_item.entity_mentions:
@@ -325,47 +888,48 @@ def rdfize_news_item(a_news_item, g):
                                                   entity_mention_obj.end_index))
         entityMentionURI=URIRef(entityMentionURIString)
 
-        g.add((entityMentionURI, RDF.type, GAF.Mention))
+        g.add((entityMentionURI, RDF.type, gafMention))
         # add entity mention triples
-        g.add((entityMentionURI, CLTLV.sent, Literal(int(entity_mention_obj.sentence))))
-        g.add((entityMentionURI, NIF.anchorOf, Literal(entity_mention_obj.mention)))
+        g.add((entityMentionURI, cltlvSent, int_literal(int(entity_mention_obj.sentence))))
+        g.add((entityMentionURI, nifAnchorOf, Literal(entity_mention_obj.mention)))
 #        if entity_mention_obj.lemma:
 #            g.add((entityMentionURI, NIF.lemma, Literal(entity_mention.obj.lemma) ))
-        g.add(( entityMentionURI, NIF.referenceContext, newsItem ))
-        g.add(( entityMentionURI, GAF.denotes, instanceURI ))
-        g.add((instanceURI, RDF.type, GAF.Instance))
-        g.add((instanceURI, RDF.type, CLTLV.Entity))
-        g.add((instanceURI, RDF.type, URIRef(makeType(entity_mention_obj.the_type))))
-        g.add((entityMentionURI, NIF.beginIndex, Literal(entity_mention_obj.begin_index)))
-        g.add((entityMentionURI, NIF.endIndex, Literal(entity_mention_obj.end_index)))
-        g.add((entityMentionURI, PROV.wasAttributedTo, URIRef('%sprovenance/%s/entity' % (cltlPrefix, entity_mention_obj.provenance)) ))
+        g.add(( entityMentionURI, nifReferenceContext, newsItem ))
+        g.add(( entityMentionURI, gafDenotes, instanceURI ))
+        g.add((instanceURI, RDF.type, gafInstance))
+        g.add((instanceURI, RDF.type, cltlvEntity))
+        g.add((instanceURI, RDF.type, type_uri(entity_mention_obj.the_type)))
+        g.add((entityMentionURI, nifBeginIndex, int_literal(entity_mention_obj.begin_index)))
+        g.add((entityMentionURI, nifEndIndex, int_literal(entity_mention_obj.end_index)))
+        g.add((entityMentionURI, provWasAttributedTo, provenance_uri(entity_mention_obj.provenance, 'entity') ))
         if entity_mention_obj.meaning:
             g.add(( instanceURI, OWL.sameAs, URIRef(entity_mention_obj.meaning) ))
 
     # Iterate through the event mentions
     for event_mention_obj in a_news_item.event_mentions:
         # create URI for this entity mention
-        eventMentionURIString="%s#mention=%s" % (newsItemURIString,
-                                                  hash_offsets(event_mention_obj.mention_offset_ranges))
-        instanceURI=URIRef("%s#event=%s" % (newsItemURIString,
-                                                  hash_offsets(event_mention_obj.mention_offset_ranges)))
+        # (the hash of the offsets is used by both URIs; it is the hash of
+        # the repr of a list, as when the offset ranges were stored in a list)
+        offsets_hash=hash_offsets(list(event_mention_obj.mention_offset_ranges))
+        eventMentionURIString="%s#mention=%s" % (newsItemURIString, offsets_hash)
+        instanceURI=URIRef("%s#event=%s" % (newsItemURIString, offsets_hash))
         eventMentionURI=URIRef(eventMentionURIString)
 
-        g.add((eventMentionURI, RDF.type, GAF.Mention))
+        g.add((eventMentionURI, RDF.type, gafMention))
         # add entity mention triples
-        g.add((eventMentionURI, CLTLV.sent, Literal(int(event_mention_obj.sentence))))
-        g.add((eventMentionURI, NIF.anchorOf, Literal(event_mention_obj.mention)))
+        g.add((eventMentionURI, cltlvSent, int_literal(int(event_mention_obj.sentence))))
+        g.add((eventMentionURI, nifAnchorOf, Literal(event_mention_obj.mention)))
         if event_mention_obj.lemma:
-            g.add((eventMentionURI, NIF.lemma, Literal(event_mention_obj.lemma) ))
-        g.add(( eventMentionURI, NIF.referenceContext, newsItem ))
-        g.add(( eventMentionURI, GAF.denotes, instanceURI ))
+            g.add((eventMentionURI, nifLemma, Literal(event_mention_obj.lemma) ))
+        g.add(( eventMentionURI, nifReferenceContext, newsItem ))
+        g.add(( eventMentionURI, gafDenotes, instanceURI ))
         for offset_range in event_mention_obj.mention_offset_ranges:    
-            g.add((eventMentionURI, NIF.beginIndex, Literal(offset_range[0])))
-            g.add((eventMentionURI, NIF.endIndex, Literal(offset_range[1])))
-        g.add((instanceURI, RDF.type, GAF.Instance))
-        g.add((instanceURI, RDF.type, CLTLV.Event))
+            g.add((eventMentionURI, nifBeginIndex, int_literal(offset_range[0])))
+            g.add((eventMentionURI, nifEndIndex, int_literal(offset_range[1])))
+        g.add((instanceURI, RDF.type, gafInstance))
+        g.add((instanceURI, RDF.type, cltlvEvent))
         #g.add((instanceURI, RDF.type, Literal(entity_mention_obj.the_type)))
-        g.add((eventMentionURI, PROV.wasAttributedTo, URIRef('%sprovenance/%s/event' % (cltlPrefix, event_mention_obj.provenance)) ))
+        g.add((eventMentionURI, provWasAttributedTo, provenance_uri(event_mention_obj.provenance, 'event') ))
         if event_mention_obj.meaning:
             g.add(( instanceURI, OWL.sameAs, URIRef(event_mention_obj.meaning) ))
 
@@ -378,25 +942,100 @@ def json2rdf(article, g):
     convert json article into rdf (saved in 'signalmedia_rdf')
     
     :param dict article: json of signalmedia article (dict in python)
+    :param g: rdflib.Graph or sink from rdf_sinks (anything with an add method)
     """
     a_news_item = load_article_into_newsitem_class(article)
     g = rdfize_news_item(a_news_item, g)
     return g
 
-def locations2rdf():
-    j=open('locations.json', 'r')
-    locations=json.load(j)
+def publisher2rdf(publisher, info, g):
+    """
+    add the triples of a publisher from locations.json to g
+
+    :param str publisher: publisher (key in locations.json)
+    :param dict info: value of the publisher in locations.json
+    :param g: rdflib.Graph or sink from rdf_sinks (anything with an add method)
+    """
+    pubURI=publisher_uri(publisher)
+    if "homepage" in info:
+        g.add((pubURI, FOAF.homepage, URIRef(info["homepage"])))
+    g.add((pubURI, DCTERMS.title, Literal(info["name"])))
+    if "dbpedia_uri" in info:
+        g.add((pubURI, OWL.sameAs, URIRef(info["dbpedia_uri"])))
+    if "location_dbpedia_uri" in info:
+        g.add((pubURI, DCTERMS.spatial, URIRef(info["location_dbpedia_uri"])))
+    g.add((pubURI, RDF.type, URIRef("http://longtailcorpus.org/Publisher")))
+
+def hash_publisher(info):
+    """
+    :param dict info: value of a publisher in locations.json
+
+    :rtype: str
+    :return: sha1 of the (key sorted) json of info
+    """
+    return hashlib.sha1(json.dumps(info, sort_keys=True).encode('utf-8')).hexdigest()
+
+def locations2rdf(path_locations='locations.json',
+                  locations_rdf='locations.ttl',
+                  incremental=False,
+                  path_manifest=None):
+    """
+    convert the publishers in locations.json into RDF (Turtle)
+
+    The hash of every converted publisher is stored in a manifest (json).
+    In incremental mode, only the publishers that were added or changed since
+    the previous run are converted: their triples replace the old ones in
+    locations_rdf, and the triples of removed publishers are dropped.
+    Without a manifest or previous output, everything is converted.
+
+    :param str path_locations: path to locations.json
+    :param str locations_rdf: path to the Turtle output
+    :param bool incremental: only convert added and changed publishers
+    :param str path_manifest: path to the manifest,
+    default is locations_rdf + '.manifest.json'
+
+    :rtype: tuple
+    :return: (list of converted publishers, list of removed publishers)
+    """
+    if path_manifest is None:
+        path_manifest = '%s.manifest.json' % locations_rdf
+
+    with open(path_locations, 'r') as j:
+        locations=json.load(j)
+    publisher2hash = {publisher: hash_publisher(info)
+                      for publisher, info in locations.items()}
+
+    previous = None
+    if incremental and os.path.exists(path_manifest) and os.path.exists(locations_rdf):
+        with open(path_manifest) as infile:
+            previous = json.load(infile)
+
     g=Graph()
-    locations_rdf="locations.ttl"
-    for publisher in locations:
-        pubURI=URIRef(create_publisher_uri(publisher))
-        if "homepage" in locations[publisher]:
-            g.add((pubURI, FOAF.homepage, URIRef(locations[publisher]["homepage"])))
-        g.add((pubURI, DCTERMS.title, Literal(locations[publisher]["name"])))
-        if "dbpedia_uri" in locations[publisher]:
-            g.add((pubURI, OWL.sameAs, URIRef(locations[publisher]["dbpedia_uri"])))
-        if "location_dbpedia_uri" in locations[publisher]:
-            g.add((pubURI, DCTERMS.spatial, URIRef(locations[publisher]["location_dbpedia_uri"])))
-        g.add((pubURI, RDF.type, URIRef("http://longtailcorpus.org/Publisher")))
-        g.serialize(destination=locations_rdf, format='turtle')
-    j.close()
+    if previous is None:
+        changed = list(locations)
+        removed = []
+    else:
+        changed = [publisher for publisher, the_hash in publisher2hash.items()
+                   if previous.get(publisher) != the_hash]
+        removed = [publisher for publisher in previous
+                   if publisher not in locations]
+        if not changed and not removed:
+            return changed, removed
+        g.parse(locations_rdf, format='turtle')
+        stale_uris = {publisher_uri(publisher) for publisher in changed + removed}
+        for pubURI in stale_uris:
+            g.remove((pubURI, None, None))
+        # publishers whose names only differ in non-word characters share a URI
+        changed = [publisher for publisher in locations
+                   if publisher_uri(publisher) in stale_uris]
+
+    for publisher in changed:
+        publisher2rdf(publisher, locations[publisher], g)
+
+    # serialized once, after all publishers have been added
+    tmp_path = '%s.tmp' % locations_rdf
+    g.serialize(destination=tmp_path, format='turtle')
+    os.replace(tmp_path, locations_rdf)
+    manifest.atomic_write(path_manifest,
+                          json.dumps(publisher2hash, sort_keys=True, indent=1).encode('utf-8'))
+    return changed, removed
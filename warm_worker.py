@@ -0,0 +1,321 @@
+"""
+long-running conversion worker for articles that arrive one by one
+
+The worker loads spaCy once and keeps it, and the URI caches of utils.py,
+warm for all articles. It reads SignalMedia articles, one json object per
+line, from stdin or from a spool folder, and appends the triples of every
+article to the output as soon as it is converted (N-Triples or N-Quads,
+flushed after every article).
+
+A line is a SignalMedia article. It may have an extra key naf_path with the
+path to its NewsReader NAF; else the NAF is looked up by id in the NAF store
+(--nafs), if provided.
+
+Spool folder: every *.jsonl file in the folder is converted and then moved
+to {spool}/done (or to {spool}/failed if any of its lines failed). Producers
+should write the file under another name (e.g. .jsonl.tmp) and rename it
+when it is complete. The folder is polled for new files. The byte offset of
+the next line is kept in {file}.progress, so a restarted worker continues
+with the first article that it had not written (an article whose triples
+were written just before the worker was killed may be written twice).
+SIGTERM and SIGINT stop the worker after the current article.
+
+The latency of every article (from reading the line to the flushed output)
+is measured; a summary (mean, median, 95th percentile, maximum in ms) is
+logged every report_every articles and when the worker stops.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import signal
+import argparse
+from collections import deque
+
+import utils
+import naf_reader
+import rdf_sinks
+import conversion
+
+LATENCY_WINDOW = 10000
+PROGRESS_SUFFIX = '.progress'
+
+
+class _ListSink:
+    """
+    sink that collects the triples of an article in a list
+    """
+    def __init__(self, triples):
+        self.add = triples.append
+
+
+class WarmWorker:
+    """
+    convert articles one by one into an appended N-Triples (N-Quads) output
+    """
+    def __init__(self, output_path, output_format='nt', compression=None,
+                 path_newsreader_nafs='', spacy_annotation=True,
+                 logger=None, report_every=1000):
+        """
+        :param str output_path: path to the output, appended to if it exists
+        :param str output_format: nt | nquads
+        :param str compression: gzip | zstd | None
+        :param str path_newsreader_nafs: if provided, NAF store (see
+        naf_reader.open_naf_store) in which the NAFs are looked up by id
+        :param bool spacy_annotation: if False, spaCy is not loaded and only
+        articles with a NewsReader NAF are converted
+        :param logging.Logger logger: if provided, errors and latencies are logged
+        :param int report_every: number of articles between latency reports
+        """
+        if output_format not in {'nt', 'nquads'}:
+            raise ValueError('the output of the worker is nt or nquads, not %s' % output_format)
+        self.sink = rdf_sinks.NTriplesSink(output_path,
+                                           graph_name=conversion.graph_name if output_format == 'nquads' else None,
+                                           compression=compression,
+                                           append=True)
+        self.nafs = None
+        if path_newsreader_nafs:
+            self.nafs = naf_reader.open_naf_store(path_newsreader_nafs)
+        self.spacy_annotation = spacy_annotation
+        if spacy_annotation:
+            utils.get_nlp()
+        self.logger = logger
+        self.report_every = report_every
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.num_articles = 0
+        self.num_skipped = 0
+        self.num_failed = 0
+
+    def convert(self, article, naf_path=None):
+        """
+        convert one article and append its triples to the output
+
+        :param dict article: SignalMedia article
+        :param str naf_path: if provided, path to its NewsReader NAF
+
+        :rtype: int
+        :return: number of triples added
+        """
+        the_preprocessing = set()
+        if naf_path:
+            the_preprocessing.add(('newsreader', naf_reader.parse_naf(naf_path)))
+        elif self.nafs is not None:
+            naf_data = self.nafs.read(article['id'])
+            if naf_data is not None:
+                the_preprocessing.add(('newsreader', naf_reader.parse_naf(naf_data)))
+
+        entity_mentions = None
+        if self.spacy_annotation:
+            entity_mentions, spacy_naf = utils.annotate_doc(utils.get_nlp()(article['content']))
+        elif not the_preprocessing:
+            return 0
+
+        item = utils.news_item(signalmedia_json=article,
+                               preprocessing=the_preprocessing,
+                               spacy_entity_mentions=entity_mentions)
+        # the triples are only written once the article is converted
+        # completely, so a failing article leaves nothing in the output
+        triples = []
+        utils.json2rdf(item, _ListSink(triples))
+        for triple in triples:
+            self.sink.add(triple)
+        self.sink.flush()
+        return len(triples)
+
+    def handle_line(self, line):
+        """
+        convert the article on a line
+
+        :param str line: json of a SignalMedia article, optionally with naf_path
+
+        :rtype: bool
+        :return: False if the article could not be converted
+        """
+        if not line.strip():
+            return True
+        started = time.perf_counter()
+        try:
+            article = json.loads(line)
+            naf_path = article.pop('naf_path', None)
+            num_triples = self.convert(article, naf_path=naf_path)
+        except Exception:
+            self.num_failed += 1
+            if self.logger is not None:
+                self.logger.exception('failed to convert %s' % line[:100])
+            return False
+        if not num_triples:
+            self.num_skipped += 1
+            return True
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        self.num_articles += 1
+        if self.logger is not None and self.num_articles % self.report_every == 0:
+            self.logger.info(self.report())
+        return True
+
+    def latency_summary(self):
+        """
+        :rtype: dict
+        :return: number of articles converted, skipped and failed, and the
+        mean, median, 95th percentile and maximum latency in ms (of the
+        last LATENCY_WINDOW articles)
+        """
+        summary = {'num_articles': self.num_articles,
+                   'num_skipped': self.num_skipped,
+                   'num_failed': self.num_failed}
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            summary.update({'mean_ms': sum(latencies) / len(latencies),
+                            'p50_ms': latencies[len(latencies) // 2],
+                            'p95_ms': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+                            'max_ms': latencies[-1]})
+        return summary
+
+    def report(self):
+        summary = self.latency_summary()
+        if 'mean_ms' not in summary:
+            return '%(num_articles)s articles, %(num_skipped)s skipped, %(num_failed)s failed' % summary
+        return ('%(num_articles)s articles, %(num_skipped)s skipped, %(num_failed)s failed | '
+                'latency mean %(mean_ms).1f ms, p50 %(p50_ms).1f ms, '
+                'p95 %(p95_ms).1f ms, max %(max_ms).1f ms' % summary)
+
+    def close(self):
+        self.sink.close()
+        if self.nafs is not None:
+            self.nafs.close()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class _Stop:
+    """
+    set when SIGTERM or SIGINT is received; the current article is finished.
+    While the worker waits for input (idle), _Stopped is raised instead, to
+    interrupt the wait.
+    """
+    def __init__(self):
+        self.requested = False
+        self.idle = False
+        signal.signal(signal.SIGTERM, self.request)
+        signal.signal(signal.SIGINT, self.request)
+
+    def request(self, signum, frame):
+        self.requested = True
+        if self.idle:
+            raise _Stopped()
+
+
+def run_stream(worker, stream, stop):
+    """
+    convert the articles on the lines of stream until it ends or the worker
+    is stopped
+    """
+    while not stop.requested:
+        stop.idle = True
+        try:
+            line = stream.readline()
+        except _Stopped:
+            break
+        finally:
+            stop.idle = False
+        if not line:
+            break
+        worker.handle_line(line)
+
+
+def _read_progress(progress_path):
+    """
+    :rtype: tuple
+    :return: (byte offset of the first line that is not converted, False if
+    a line failed) of a spool file, (0, True) if it was not started
+    """
+    if not os.path.exists(progress_path):
+        return 0, True
+    with open(progress_path) as infile:
+        offset, ok = infile.read().split()
+    return int(offset), ok == 'ok'
+
+
+def _write_progress(progress_path, offset, ok):
+    part_path = progress_path + '.part'
+    with open(part_path, 'w') as outfile:
+        outfile.write('%s %s\n' % (offset, 'ok' if ok else 'failed'))
+    os.replace(part_path, progress_path)
+
+
+def run_spool(worker, spool_folder, stop, poll_interval=1.0):
+    """
+    convert the *.jsonl files that appear in spool_folder until stopped
+
+    the offset of the next line of a file is kept in {file}.progress after
+    every article, so a stopped or killed worker continues where it was
+    """
+    done_folder = os.path.join(spool_folder, 'done')
+    failed_folder = os.path.join(spool_folder, 'failed')
+    for folder in [done_folder, failed_folder]:
+        os.makedirs(folder, exist_ok=True)
+
+    while not stop.requested:
+        paths = sorted(glob.glob(os.path.join(spool_folder, '*.jsonl')),
+                       key=os.path.getmtime)
+        if not paths:
+            time.sleep(poll_interval)
+            continue
+        for path in paths:
+            progress_path = path + PROGRESS_SUFFIX
+            offset, ok = _read_progress(progress_path)
+            with open(path, 'rb') as infile:
+                infile.seek(offset)
+                for line in iter(infile.readline, b''):
+                    ok = worker.handle_line(line.decode('utf-8')) and ok
+                    _write_progress(progress_path, infile.tell(), ok)
+                    if stop.requested:
+                        return
+            os.replace(path, os.path.join(done_folder if ok else failed_folder,
+                                          os.path.basename(path)))
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
+            if stop.requested:
+                return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='''Convert SignalMedia articles to RDF as they arrive, with spaCy loaded once.''')
+    parser.add_argument('-o', dest="output_path", required=True, help="path to the output (appended to)")
+    parser.add_argument('-f', dest="output_format", default='nt', choices=['nt', 'nquads'], help="output format")
+    parser.add_argument('-z', dest="compression", choices=sorted(rdf_sinks.COMPRESSION2EXTENSION), help="compress the output")
+    parser.add_argument('-s', dest="spool_folder", help="spool folder with *.jsonl files (default: read stdin)")
+    parser.add_argument('--nafs', dest="path_newsreader_nafs", default='', help="NAF store in which NAFs are looked up by id")
+    parser.add_argument('--newsreader-only', dest="newsreader_only", action='store_true',
+                        help="only convert articles with a NewsReader NAF, without loading spaCy")
+    parser.add_argument('--poll', type=float, dest="poll_interval", default=1.0, help="seconds between polls of the spool folder")
+    parser.add_argument('--report', type=int, dest="report_every", default=1000, help="number of articles between latency reports")
+    parser.add_argument('--log', dest="log_path", default='logs/warm_worker.log', help="path to the log")
+
+    args = parser.parse_args()
+
+    log_folder = os.path.dirname(args.log_path)
+    if log_folder:
+        os.makedirs(log_folder, exist_ok=True)
+    logger = utils.start_logger(args.log_path)
+
+    stop = _Stop()
+    worker = WarmWorker(args.output_path,
+                        output_format=args.output_format,
+                        compression=args.compression,
+                        path_newsreader_nafs=args.path_newsreader_nafs,
+                        spacy_annotation=not args.newsreader_only,
+                        logger=logger,
+                        report_every=args.report_every)
+    logger.info('worker ready')
+    try:
+        if args.spool_folder:
+            run_spool(worker, args.spool_folder, stop, poll_interval=args.poll_interval)
+        else:
+            run_stream(worker, sys.stdin, stop)
+    finally:
+        worker.close()
+        logger.info('stopped: %s' % worker.report())
+        print(worker.report(), file=sys.stderr)